@@ -0,0 +1,152 @@
+"""
+A small thread-safe MySQL connection pool shared by the spiders and processors.
+
+Connections are created lazily up to pool_size, pinged before being handed out and
+transparently replaced when the server dropped them.
+"""
+from contextlib import contextmanager
+import logging
+import queue
+import threading
+import time
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+import db.utils as dbutil
+from utils import metrics
+
+
+class MysqlSessionPool:
+    def __init__(self, pool_size=4, timeout=60, **db_config):
+        """
+        :param pool_size: Max number of open connections
+        :param timeout: Seconds to wait for a free connection before raising PoolError
+        :param db_config: mysql.connector.connect kwargs, default to dbutil.get_db_config()
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.db_config = {**dbutil.get_db_config(), **db_config}
+        self._idle_cnx_queue = queue.LifoQueue()
+        self._num_created_cnx = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        return mysql.connector.connect(**self.db_config)
+
+    def _free_slot(self, wake_waiter=True):
+        with self._lock:
+            self._num_created_cnx -= 1
+        if wake_waiter:
+            # Wake one thread waiting for an idle connection, it can now open a new one instead.
+            self._idle_cnx_queue.put(None)
+
+    def _discard(self, cnx, wake_waiter=True):
+        try:
+            cnx.close()
+        except mysql.connector.Error:
+            pass
+        self._free_slot(wake_waiter)
+
+    def _is_healthy(self, cnx):
+        try:
+            cnx.ping(reconnect=True, attempts=3, delay=1)
+            return True
+        except mysql.connector.Error as e:
+            logging.error(f'Discard broken MySQL connection: {e}')
+            return False
+
+    def acquire(self):
+        """
+        Get a healthy connection from the pool, opening a new one if the pool is not full yet.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                cnx = self._idle_cnx_queue.get_nowait()
+            except queue.Empty:
+                cnx = None
+                with self._lock:
+                    can_create = self._num_created_cnx < self.pool_size
+                    if can_create:
+                        self._num_created_cnx += 1
+                if can_create:
+                    try:
+                        return self._new_connection()
+                    except mysql.connector.Error:
+                        self._free_slot()
+                        raise
+                try:
+                    cnx = self._idle_cnx_queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise PoolError(f'No MySQL connection available after {self.timeout}s.')
+
+            if cnx is None:
+                # A discarded connection freed a slot, try to open a new one.
+                continue
+            if self._is_healthy(cnx):
+                return cnx
+            self._discard(cnx)
+
+    def release(self, cnx):
+        self._idle_cnx_queue.put(cnx)
+
+    @contextmanager
+    def session(self):
+        """
+        Yield (cnx, cur) for one unit of work. A connection that failed with a
+        connection-level error is dropped instead of being returned to the pool.
+        """
+        cnx = self.acquire()
+        cur = metrics.instrument_cursor(cnx.cursor(buffered=True))
+        try:
+            yield cnx, cur
+        except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+            self._discard(cnx)
+            raise
+        except Exception:
+            cur.close()
+            cnx.rollback()
+            self.release(cnx)
+            raise
+        else:
+            cur.close()
+            self.release(cnx)
+
+    def close(self):
+        while True:
+            try:
+                cnx = self._idle_cnx_queue.get_nowait()
+            except queue.Empty:
+                break
+            if cnx is not None:
+                self._discard(cnx, wake_waiter=False)
+
+
+_session_pool = None
+_session_pool_users = 0
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool(pool_size=4, **db_config):
+    """
+    Return the process-wide pool, creating it on first use.
+    Every call must be paired with a close_session_pool() once the caller is done, so that
+    spiders sharing one process (see houspider_runner) do not close the pool under each other.
+    """
+    global _session_pool, _session_pool_users
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = MysqlSessionPool(pool_size=pool_size, **db_config)
+        else:
+            _session_pool.pool_size = max(_session_pool.pool_size, pool_size)
+        _session_pool_users += 1
+        return _session_pool
+
+
+def close_session_pool():
+    global _session_pool, _session_pool_users
+    with _session_pool_lock:
+        _session_pool_users = max(_session_pool_users - 1, 0)
+        if _session_pool is not None and _session_pool_users == 0:
+            _session_pool.close()
+            _session_pool = None
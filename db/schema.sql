@@ -10,6 +10,7 @@ CREATE TABLE IF NOT EXISTS lifull_house_link (
 	is_available BOOLEAN NOT NULL,
 	first_available_date DATE NOT NULL,
 	unavailable_date DATE,
+	page_fingerprint CHAR(32),
 	PRIMARY KEY(house_id, sale_category)
 );
 
@@ -22,7 +23,8 @@ CREATE TABLE IF NOT EXISTS lifull_rent_link (
 	city VARCHAR(255) NOT NULL,
 	is_available BOOLEAN NOT NULL,
 	first_available_date DATE NOT NULL,
-	unavailable_date DATE
+	unavailable_date DATE,
+	page_fingerprint CHAR(32)
 );
 
 CREATE TABLE IF NOT EXISTS lifull_house_price_history (
@@ -143,5 +145,12 @@ CREATE TABLE IF NOT EXISTS lifull_crawler_stats (
 	new_unavailable_become_available_house_num INT NOT NULL DEFAULT 0,
 	updated_house_num INT NOT NULL DEFAULT 0,
 	new_unavailable_house_num INT NOT NULL DEFAULT 0,
+	changed_page_num INT NOT NULL DEFAULT 0,
 	PRIMARY KEY(crawl_date, category, city)
 );
+
+
+-- Migrations for existing databases
+-- ALTER TABLE lifull_house_link ADD COLUMN page_fingerprint CHAR(32);
+-- ALTER TABLE lifull_rent_link ADD COLUMN page_fingerprint CHAR(32);
+-- ALTER TABLE lifull_crawler_stats ADD COLUMN changed_page_num INT NOT NULL DEFAULT 0;
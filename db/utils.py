@@ -1,8 +1,40 @@
+import json
+import os
 import mysql.connector
 
+from utils import metrics
 
-def get_mysql_cnx(user='root', password='houspider', host='localhost', database='house'):
-    return mysql.connector.connect(user=user, password=password, host=host, database=database)
+DEFAULT_DB_CONFIG = {
+    'user': 'root',
+    'password': 'houspider',
+    'host': 'localhost',
+    'database': 'house',
+}
+
+
+def get_db_config():
+    """
+    Read database credentials from the json file at $HOUSPIDER_DB_CONFIG if set,
+    then let $HOUSPIDER_DB_USER/PASSWORD/HOST/DATABASE override single fields.
+    """
+    db_config = DEFAULT_DB_CONFIG.copy()
+    config_path = os.environ.get('HOUSPIDER_DB_CONFIG')
+    if config_path:
+        with open(config_path) as f:
+            db_config.update(json.load(f))
+    for key in DEFAULT_DB_CONFIG:
+        env_val = os.environ.get(f'HOUSPIDER_DB_{key.upper()}')
+        if env_val:
+            db_config[key] = env_val
+    return db_config
+
+
+def get_mysql_cnx(user=None, password=None, host=None, database=None):
+    db_config = get_db_config()
+    for key, val in (('user', user), ('password', password), ('host', host), ('database', database)):
+        if val is not None:
+            db_config[key] = val
+    return metrics.instrument_connection(mysql.connector.connect(**db_config))
 
 
 def is_row_exist(col, val, table_name, cur):
@@ -47,3 +79,77 @@ def insert_table(val_map, table_name, cur, on_duplicate_update_val_map=None):
         """
     cur.execute(f'{query};', tuple(param_list))
     return cur.rowcount
+
+
+def count_existing_rows(rows, key_columns, table_name, cur, columns=None):
+    """
+    Count how many of rows already have their key in table_name.
+
+    :param columns: The columns of rows if they are tuples rather than val_map dicts
+    """
+    if len(rows) == 0:
+        return 0
+    row_clause = f"({','.join(['%s'] * len(key_columns))})"
+    if columns is None:
+        param_list = [row[k] for row in rows for k in key_columns]
+    else:
+        key_indexes = [columns.index(k) for k in key_columns]
+        param_list = [row[i] for row in rows for i in key_indexes]
+    query = f"""
+        SELECT COUNT(*) FROM {table_name}
+        WHERE ({','.join(key_columns)}) IN ({','.join([row_clause] * len(rows))})
+        """
+    cur.execute(f'{query};', tuple(param_list))
+    return cur.fetchone()[0]
+
+
+def bulk_upsert(rows, table_name, update_columns, cur, chunk_size=1000, key_columns=('house_id',), cnx=None,
+                columns=None, count_existing=False):
+    """
+    Insert rows with one multi-VALUES `INSERT ... ON DUPLICATE KEY UPDATE` per chunk.
+
+    :param rows: A list of val_map dicts which all share the same columns, or of value tuples if columns is given
+    :param columns: The columns of the value tuples in rows, e.g. records.MANSION_INFO_COLUMNS with MansionInfo.to_row()
+    :param update_columns: Columns to overwrite when the key already exists
+    :param key_columns: The primary key of table_name, only used with count_existing
+    :param cnx: If given, commit once after each chunk
+    :param count_existing: Tell inserted rows from updated rows with a keyed COUNT(*) before each chunk.
+                           Otherwise they are derived from the affected rows (1 per insert, 2 per changed update),
+                           which is exact unless an existing row is left unchanged: MySQL counts it 0.
+    :return: A list of (inserted_rowcount, updated_rowcount) per chunk
+    """
+    if len(rows) == 0:
+        return []
+
+    column_list = list(rows[0].keys()) if columns is None else list(columns)
+    row_clause = f"({','.join(['%s'] * len(column_list))})"
+    on_duplicate_update_clause = ','.join([f'{k}=VALUES({k})' for k in update_columns])
+
+    chunk_rowcounts = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        num_existing_rows = None
+        if count_existing and len(update_columns) > 0:
+            num_existing_rows = count_existing_rows(chunk, key_columns, table_name, cur, columns)
+
+        if columns is None:
+            param_list = [row[x] for row in chunk for x in column_list]
+        else:
+            param_list = [x for row in chunk for x in row]
+        query = f"""
+            INSERT INTO {table_name} ({','.join(column_list)})
+            VALUES {','.join([row_clause] * len(chunk))}
+            """
+        if len(update_columns) > 0:
+            query += f"""
+            ON DUPLICATE KEY UPDATE
+               {on_duplicate_update_clause}
+            """
+        cur.execute(f'{query};', tuple(param_list))
+        if num_existing_rows is None:
+            num_existing_rows = min(max(cur.rowcount - len(chunk), 0), len(chunk))
+        if cnx is not None:
+            cnx.commit()
+
+        chunk_rowcounts.append((len(chunk) - num_existing_rows, num_existing_rows))
+    return chunk_rowcounts
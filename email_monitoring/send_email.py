@@ -44,7 +44,8 @@ def send_summary_email(crawl_date):
     stats_df = pd.read_sql(f"""SELECT category, city, new_added_house_num, 
                             new_unavailable_become_available_house_num, 
                             updated_house_num,
-                            new_unavailable_house_num 
+                            new_unavailable_house_num,
+                            changed_page_num
                         FROM lifull_crawler_stats 
                         WHERE crawl_date = '{crawl_date}'
                         ORDER BY city, category
@@ -53,7 +54,7 @@ def send_summary_email(crawl_date):
     subject = f"{stats_df['new_added_house_num'].sum()} New, {stats_df['new_unavailable_house_num'].sum()} Removed, {stats_df['updated_house_num'].sum()} Updated, {stats_df['new_unavailable_become_available_house_num'].sum()} Reopen"
 
     result_content = '\n'.join([
-        f'{x.city} {x.category}: {x.new_added_house_num} New, {x.new_unavailable_house_num} Removed, {x.updated_house_num} Updated, {x.new_unavailable_become_available_house_num} Reopen'
+        f'{x.city} {x.category}: {x.new_added_house_num} New, {x.new_unavailable_house_num} Removed, {x.updated_house_num} Updated, {x.new_unavailable_become_available_house_num} Reopen, {x.changed_page_num} Pages Changed'
         for _, x in stats_df.iterrows()])
 
     send_email(subject=f'[Houspider Update][{crawl_date}] {subject}',
@@ -63,9 +64,24 @@ def send_summary_email(crawl_date):
     print('Summary Email Sent successfully.')
 
 
-def send_alert_email(crawl_date):
+def send_alert_email(crawl_date, failed_stages=None):
+    """
+    :param failed_stages: {stage_key: {'status': 'failed' or 'skipped', 'error': ...}} of houspider_runner stages
+                          that did not complete
+    """
     subject = ''
 
+    failed_stages_error_content = ''
+    if failed_stages:
+        failed_stages_str = '\n'.join(
+            [f"{stage_key}: {stage['status']}" + (f" ({stage['error']})" if stage.get('error') else '')
+             for stage_key, stage in failed_stages.items()])
+        failed_stages_error_content = f"""
+{len(failed_stages)} pipeline stages did not complete:
+{failed_stages_str}
+"""
+        subject += ' failed_stage'
+
     has_error_list_urls_alert = False
     error_list_urls_error_content = ''
     error_list_urls_paths = [f'/home/ubuntu/houspiders/house_list_spider/output/{crawl_date}/error_list_urls.csv',
@@ -96,9 +112,10 @@ def send_alert_email(crawl_date):
     has_error_house_info_urls_alert = False
     error_house_info_urls_error_content = ''
     error_house_info_url_df = None
-    error_house_info_url_paths = [f'/home/ubuntu/houspiders/house_info_spider/output/{crawl_date}/error_house_id2.csv',
-                                  f'/home/ubuntu/houspiders/house_info_spider/output/{crawl_date}/error_house_chintai_id2.csv',
-                                  f'/home/ubuntu/houspiders/house_info_spider/output/{crawl_date}/error_house_other_id2.csv']
+    # Only the pages still failing after the in-crawl retries, see house_info_spider/retry.py
+    error_house_info_url_paths = [f'/home/ubuntu/houspiders/house_info_spider/output/{crawl_date}/error_house_id.csv',
+                                  f'/home/ubuntu/houspiders/house_info_spider/output/{crawl_date}/error_house_chintai_id.csv',
+                                  f'/home/ubuntu/houspiders/house_info_spider/output/{crawl_date}/error_house_other_id.csv']
     for error_house_info_url_path in error_house_info_url_paths:
         try:
             error_house_info_url_df = pd.read_csv(error_house_info_url_path)
@@ -120,20 +137,20 @@ def send_alert_email(crawl_date):
     if has_error_house_info_urls_alert:
             subject += ' error_house_info_url'
 
-    if has_error_list_urls_alert or has_error_house_info_urls_alert:
+    if failed_stages or has_error_list_urls_alert or has_error_house_info_urls_alert:
         send_email(subject=f'[Houspider Error][{crawl_date}]{subject}',
                    mail_content=f"""We found following errors during crawling data for {crawl_date}:
-{error_list_urls_error_content}{error_house_info_urls_error_content}
+{failed_stages_error_content}{error_list_urls_error_content}{error_house_info_urls_error_content}
 """)
     else:
         print('No alerts today.')
 
 
-def main(mode, crawl_date):
+def main(mode, crawl_date, failed_stages=None):
     if mode == 'summary':
         send_summary_email(crawl_date)
     elif mode == 'alert':
-        send_alert_email(crawl_date)
+        send_alert_email(crawl_date, failed_stages)
 
 
 if __name__ == "__main__":
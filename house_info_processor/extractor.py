@@ -0,0 +1,49 @@
+"""
+Run MansionInfo/RentInfo extraction outside the spider's reactor thread.
+
+Workers receive the raw page bytes and return plain dicts, which are cheap to pickle
+back to the parent process and are turned into house info objects again there.
+"""
+import hashlib
+import re
+import sys
+from scrapy import Selector
+
+sys.path.append('../')
+
+from house_info_processor.mansion_info import MansionInfo
+from house_info_processor.rent_info import RentInfo
+from utils import constant
+
+MANSION_DETAIL_SECTIONS = ['.mod-buildingName', '.mod-detailTopSale', '.mod-bukkenSpecDetail', '.mod-bukkenNotes']
+RENT_DETAIL_SECTIONS = ['.mod-detailTopRent', '.mod-bukkenSpecDetail', '.mod-bukkenNotes']
+
+
+def get_house_info_class(category):
+    return RentInfo if category == constant.CHINTAI else MansionInfo
+
+
+def build_house_info(house_id, response, category):
+    return get_house_info_class(category)(house_id, response)
+
+
+def extract_house_info_fields(house_id, body, encoding, category):
+    """
+    Entry point of an extractor worker process.
+    """
+    response = Selector(text=body.decode(encoding, errors='replace'))
+    return build_house_info(house_id, response, category).to_dict()
+
+
+def house_info_from_fields(fields, category):
+    return get_house_info_class(category).from_dict(fields)
+
+
+def get_page_fingerprint(response, category):
+    """
+    md5 of the whitespace-normalized detail sections the extractors read, so that
+    ads or recommendations elsewhere on the page do not count as a change.
+    """
+    sections = RENT_DETAIL_SECTIONS if category == constant.CHINTAI else MANSION_DETAIL_SECTIONS
+    detail_html = ''.join(''.join(response.css(x).getall()) for x in sections)
+    return hashlib.md5(re.sub(r'\s+', ' ', detail_html).encode('utf-8')).hexdigest()
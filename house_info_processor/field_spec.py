@@ -0,0 +1,134 @@
+"""
+Declarative field specs of the detail pages, compiled once and evaluated in a single pass per page.
+
+A spec names the css selectors MansionInfo/RentInfo read, e.g. `'price': ('top', '#chk-bkc-moneyroom::text')`.
+Every selector is translated to a lxml XPath when the spec is built (module import), instead of
+on every `response.css()` call. Selectors starting with an element id are anchored on it:
+extract() walks each section subtree once, indexes the anchor elements by id and the `tr` rows
+of the row section by their header, and then only evaluates a field's XPath on its anchor.
+Other selectors are evaluated on their section element.
+
+A new field is one more spec entry.
+"""
+import re
+import time
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+_translator = HTMLTranslator()
+_ANCHOR_ID_PATTERN = re.compile(r'#([\w-]+)')
+
+# Rows of `.mod-bukkenNotes`, the same on mansion and rent pages
+NOTE_ROW_FIELDS = {
+    'normal_equipment': 'ul.normalEquipment',
+    'normal_equipments': 'ul.normalEquipment li::text',
+    'active_equipments': 'ul.bukkenEquipment li.active span::text',
+    'cells': 'td::text',
+    'note': 'td#chk-bkf-biko::text',
+}
+
+
+def compile_css(css, prefix='descendant-or-self::'):
+    return etree.XPath(_translator.css_to_xpath(css, prefix=prefix))
+
+
+def _to_values(results):
+    return [str(x) if isinstance(x, str) else x for x in results]
+
+
+def _add_time(field_times, name, start_time):
+    """
+    :return: The new start time
+    """
+    if field_times is None:
+        return None
+    end_time = time.perf_counter()
+    field_times[name] = field_times.get(name, 0) + end_time - start_time
+    return end_time
+
+
+class PageRow:
+    def __init__(self, spec, element):
+        self.spec = spec
+        self.element = element
+        headers = spec.row_header(element)
+        # Same as tr.css('th::text').get()
+        self.header = str(headers[0]) if len(headers) > 0 else None
+
+    def getall(self, name):
+        return _to_values(self.spec.row_fields[name](self.element))
+
+    def has(self, name):
+        return len(self.spec.row_fields[name](self.element)) > 0
+
+
+class PageFields:
+    def __init__(self, values, rows):
+        self.values = values
+        self.rows = rows
+
+    def get(self, name, default=None):
+        values = self.values[name]
+        return values[0] if len(values) > 0 else default
+
+    def getall(self, name):
+        return self.values[name]
+
+
+class FieldSpec:
+    def __init__(self, sections, fields, row_section=None, row_fields=None):
+        """
+        :param sections: {section name: css of the section, e.g. '.mod-bukkenSpecDetail'}
+        :param fields: {field name: (section name, css inside the section)}
+        :param row_section: Section whose `tr` rows are collected by header
+        :param row_fields: {row field name: css inside a `tr`}
+        """
+        self.sections = {name: compile_css(css) for name, css in sections.items()}
+        # section name -> {field name: (anchor id, xpath)}
+        self.anchored_fields = {name: {} for name in sections}
+        # section name -> {field name: xpath}
+        self.section_fields = {name: {} for name in sections}
+        for name, (section, css) in fields.items():
+            match = _ANCHOR_ID_PATTERN.match(css)
+            if match is None:
+                self.section_fields[section][name] = compile_css(css)
+            else:
+                self.anchored_fields[section][name] = (match.group(1), compile_css(css, prefix='self::'))
+        self.anchor_ids = {name: {x[0] for x in anchored.values()} for name, anchored in self.anchored_fields.items()}
+        self.row_section = row_section
+        self.row_header = compile_css('th::text')
+        self.row_fields = {name: compile_css(css) for name, css in (row_fields or {}).items()}
+
+    def extract(self, response, field_times=None):
+        """
+        :param response: A scrapy response or a parsel Selector of the detail page
+        :param field_times: If set, seconds spent per field (and per section walk) are added to it, see parser_benchmark
+        """
+        root = getattr(response, 'selector', response).root
+        values = {}
+        rows = []
+        for section_name, section_xpath in self.sections.items():
+            start_time = time.perf_counter() if field_times is not None else None
+            section_elements = section_xpath(root)
+            anchor_ids = self.anchor_ids[section_name]
+            anchors = {}
+            if len(anchor_ids) > 0 or section_name == self.row_section:
+                for section_element in section_elements:
+                    for element in section_element.iter(etree.Element):
+                        element_id = element.get('id')
+                        # First one wins, like .get() on the section.
+                        if element_id in anchor_ids and element_id not in anchors:
+                            anchors[element_id] = element
+                        if section_name == self.row_section and element.tag == 'tr':
+                            rows.append(PageRow(self, element))
+            start_time = _add_time(field_times, f'({section_name} walk)', start_time)
+
+            for name, (anchor_id, xpath) in self.anchored_fields[section_name].items():
+                anchor = anchors.get(anchor_id)
+                values[name] = [] if anchor is None else _to_values(xpath(anchor))
+                start_time = _add_time(field_times, name, start_time)
+            for name, xpath in self.section_fields[section_name].items():
+                values[name] = [x for section_element in section_elements for x in _to_values(xpath(section_element))]
+                start_time = _add_time(field_times, name, start_time)
+        return PageFields(values, rows)
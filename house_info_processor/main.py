@@ -1,8 +1,14 @@
 """
 python3 ./main.py -i /home/ubuntu/houspiders/house_info_spider/output/raw_html --logfile log/2022-11-15-log.txt --category mansion_chuko
+
+# Re-extract in 8 processes, resumable from the checkpoint file
+python3 ./main.py -i /home/ubuntu/houspiders/house_info_spider/output/raw_html --logfile log/2022-11-15-log.txt --category mansion_chuko \
+--processes 8 --chunk_size 200 --checkpoint output/reprocess_checkpoint.txt
+
+# Re-extract the latest page of each house from the segment store
+python3 ./main.py -i /home/ubuntu/houspiders/house_info_spider/output/raw_pages --store segment \
+--logfile log/2022-11-15-log.txt --category chintai --processes 8
 """
-from os import listdir
-from os.path import isfile, join, basename
 import getopt
 import logging
 import sys
@@ -10,12 +16,15 @@ from scrapy import Selector
 
 from house_info_processor.mansion_info import MansionInfo
 from house_info_processor.rent_info import RentInfo
+from house_info_processor.records import CONDITION_COLUMNS, STATION_COLUMNS
+from house_info_processor import raw_page_store
 
 sys.path.append('../')
 
 import db.utils as dbutil
 from utils import utils
 from utils import constant
+from utils import metrics
 
 
 def process_unavailable_house(house_id, category, cnx, cur):
@@ -43,16 +52,21 @@ def process_unavailable_house(house_id, category, cnx, cur):
     return row_count
 
 
-def update_mansion_price_if_changed(house_id, house_price, cnx, cur):
+def update_mansion_price_if_changed(house_id, house_price, cnx, cur, price_index=None):
     """
     Update price in `house_price_history` table if different from latest or no record.
+    :param price_index: A loaded LatestPriceIndex to compare against instead of querying the history
     """
-    cur.execute(
-        f"SELECT price, price_date from lifull_house_price_history WHERE house_id={house_id} order by price_date asc;")
-    all_rows = cur.fetchall()
+    if price_index is not None:
+        is_price_changed = price_index.is_changed(house_id, house_price)
+    else:
+        cur.execute(
+            f"SELECT price, price_date from lifull_house_price_history WHERE house_id={house_id} order by price_date asc;")
+        all_rows = cur.fetchall()
+        is_price_changed = len(all_rows) == 0 or int(all_rows[-1][0]) != house_price
     rowcount = 0
     # If current price is different from latest or no record.
-    if len(all_rows) == 0 or int(all_rows[-1][0]) != house_price:
+    if is_price_changed:
         insert_data = {
             'house_id': house_id,
             'price': house_price,
@@ -70,20 +84,27 @@ def update_mansion_price_if_changed(house_id, house_price, cnx, cur):
             logging.info(f'house_id {house_id}: New price is updated.')
         # Commit the changes
         cnx.commit()
+        if price_index is not None and row_count > 0:
+            price_index.set(house_id, house_price)
     return rowcount
 
 
-def update_rent_price_if_changed(house_id, rent, manage_fee, cnx, cur):
+def update_rent_price_if_changed(house_id, rent, manage_fee, cnx, cur, price_index=None):
     """
     Update price in `lifull_rent_price_history` table if different from latest or no record.
+    :param price_index: A loaded LatestPriceIndex to compare against instead of querying the history
     """
-    cur.execute(
-        f'SELECT rent, manage_fee, price_date from lifull_rent_price_history WHERE '
-        f'house_id="{house_id}" order by price_date asc;')
-    all_rows = cur.fetchall()
+    if price_index is not None:
+        is_price_changed = price_index.is_changed(house_id, (rent, manage_fee))
+    else:
+        cur.execute(
+            f'SELECT rent, manage_fee, price_date from lifull_rent_price_history WHERE '
+            f'house_id="{house_id}" order by price_date asc;')
+        all_rows = cur.fetchall()
+        is_price_changed = len(all_rows) == 0 or int(all_rows[-1][0]) != rent or int(all_rows[-1][1]) != manage_fee
     rowcount = 0
     # If current price is different from latest or no record.
-    if len(all_rows) == 0 or int(all_rows[-1][0]) != rent or int(all_rows[-1][1]) != manage_fee:
+    if is_price_changed:
         insert_data = {
             'house_id': house_id,
             'rent': rent,
@@ -102,27 +123,71 @@ def update_rent_price_if_changed(house_id, rent, manage_fee, cnx, cur):
             logging.info(f'house_id {house_id}: New price is updated.')
         # Commit the changes
         cnx.commit()
+        if price_index is not None and row_count > 0:
+            price_index.set(house_id, (rent, manage_fee))
     return rowcount
 
 
+def update_price_history_batch(house_infos, category, price_index, cur):
+    """
+    Insert one `xxx_price_history` row per house whose price differs from price_index,
+    with a single multi-row statement.
+    :return: {house_id: price} of the written rows, to be set in price_index after commit
+    """
+    price_date = utils.get_date_str_today()
+    changed_prices = {}
+    price_val_maps = []
+    for house_info in house_infos:
+        if category == constant.CHINTAI:
+            price = (house_info.rent, house_info.manage_fee)
+            val_map = {'house_id': house_info.house_id, 'rent': house_info.rent, 'manage_fee': house_info.manage_fee}
+        else:
+            price = house_info.price
+            val_map = {'house_id': house_info.house_id, 'price': house_info.price}
+        if price_index.is_changed(house_info.house_id, price):
+            changed_prices[house_info.house_id] = price
+            price_val_maps.append({**val_map, 'price_date': price_date})
+
+    price_columns = [x for x in price_val_maps[0] if x not in ('house_id', 'price_date')] if price_val_maps else []
+    dbutil.bulk_upsert(rows=price_val_maps,
+                       table_name=price_index.get_table_name(),
+                       update_columns=price_columns,
+                       cur=cur,
+                       # price_index alone tells which prices are new, the history is never read here.
+                       count_existing=False)
+    if len(changed_prices) > 0:
+        logging.info(f'{len(changed_prices)} new prices written to {price_index.get_table_name()}.')
+    return changed_prices
+
+
+def get_info_table_name_from_category(category):
+    return 'lifull_rent_info' if category == constant.CHINTAI else 'lifull_house_info'
+
+
+def get_link_table_name_from_category(category):
+    return 'lifull_rent_link' if category == constant.CHINTAI else 'lifull_house_link'
+
+
+def get_house_info_val_maps(house_info, category):
+    """
+    Split a MansionInfo/RentInfo into the val_maps of the info, station and condition tables.
+    """
+    insert_data = dict(zip(house_info.COLUMNS, house_info.to_row()))
+    station_val_maps = [dict(zip(STATION_COLUMNS, x)) for x in house_info.get_station_rows(category)]
+    condition_val_maps = [dict(zip(CONDITION_COLUMNS, x)) for x in house_info.get_condition_rows(category)]
+    return insert_data, station_val_maps, condition_val_maps
+
+
 def update_house_info_table(house_info, category, cnx, cur):
     logging.debug(f'Full info for house_id {house_info.house_id}: {house_info}')
     if house_info.num_null_fields > 0:
         logging.error(f'house_id {house_info.house_id}: {house_info.num_null_fields} null fields in House Info.')
 
-    insert_data = house_info.__dict__.copy()
-    # We don't need this field in the table.
-    del insert_data['num_null_fields']
-    # We will store stations in another table.
-    stations = insert_data['stations']
-    del insert_data['stations']
-    # We will store conditions in another table.
-    conditions = insert_data['conditions']
-    del insert_data['conditions']
+    insert_data, station_val_maps, condition_val_maps = get_house_info_val_maps(house_info, category)
 
     row_count = dbutil.insert_table(
         val_map=insert_data,
-        table_name='lifull_rent_info' if category == constant.CHINTAI else 'lifull_house_info',
+        table_name=get_info_table_name_from_category(category),
         cur=cur,
         on_duplicate_update_val_map=insert_data
     )
@@ -136,14 +201,7 @@ def update_house_info_table(house_info, category, cnx, cur):
 
     # Update stations info in lifull_stations_near_house table.
     num_inserted_station = 0
-    for line, station, walk_min in stations:
-        insert_data = {
-            'house_id': house_info.house_id,
-            'line_name': line,
-            'station_name': station,
-            'walk_distance_in_minute': walk_min,
-            'category': category
-        }
+    for insert_data in station_val_maps:
         row_count = dbutil.insert_table(
             val_map=insert_data,
             table_name='lifull_stations_near_house',
@@ -158,14 +216,7 @@ def update_house_info_table(house_info, category, cnx, cur):
 
     # Update conditions info in lifull_house_condition table.
     num_inserted_condition = 0
-    for condition in conditions:
-        if condition == '':
-            continue
-        insert_data = {
-            'house_id': house_info.house_id,
-            'house_condition': condition,
-            'category': category
-        }
+    for insert_data in condition_val_maps:
         row_count = dbutil.insert_table(
             val_map=insert_data,
             table_name='lifull_house_condition',
@@ -179,6 +230,108 @@ def update_house_info_table(house_info, category, cnx, cur):
         logging.info(f'house_id {house_info.house_id}: {num_inserted_condition} conditions are inserted.')
 
 
+def update_houses_availability(house_ids, is_available, category, cur):
+    """
+    Mark a batch of houses as available/unavailable in `xxx_link` table with one statement.
+    """
+    if len(house_ids) == 0:
+        return 0
+    val_map = {
+        'is_available': 1 if is_available else 0,
+        'unavailable_date': None if is_available else utils.get_date_str_today()
+    }
+    set_clause = ','.join([f'{k}=%s' for k in val_map])
+    cur.execute(f"""
+        UPDATE {get_link_table_name_from_category(category)}
+        SET {set_clause}
+        WHERE house_id IN ({','.join(['%s'] * len(house_ids))});""",
+                tuple(val_map.values()) + tuple(str(x) for x in house_ids))
+    return cur.rowcount
+
+
+def load_page_fingerprints(category, cur):
+    """
+    :return: {house_id: page_fingerprint} of the available houses of category in `xxx_link` table
+    """
+    if category == constant.CHINTAI:
+        cur.execute('SELECT house_id, page_fingerprint FROM lifull_rent_link '
+                    'WHERE is_available AND page_fingerprint IS NOT NULL;')
+    else:
+        cur.execute('SELECT house_id, page_fingerprint FROM lifull_house_link '
+                    'WHERE is_available AND sale_category=%s AND page_fingerprint IS NOT NULL;', (category,))
+    return {str(house_id): page_fingerprint for house_id, page_fingerprint in cur.fetchall()}
+
+
+def update_page_fingerprints(page_fingerprints, category, cur):
+    """
+    Store {house_id: page_fingerprint} in `xxx_link` table.
+    """
+    if len(page_fingerprints) == 0:
+        return
+    cur.executemany(f'UPDATE {get_link_table_name_from_category(category)} SET page_fingerprint=%s WHERE house_id=%s;',
+                    [(page_fingerprint, str(house_id)) for house_id, page_fingerprint in page_fingerprints.items()])
+
+
+def write_house_info_batch(house_infos, category, cnx, cur, price_index=None, mark_available=True):
+    """
+    Batch version of process_mansion_info/process_rent_info for already extracted house infos:
+    1. Mark them all as available in `xxx_link` table;
+    2. Update their prices in `xxx_price_history` table if different from latest or no record;
+    3. Upsert info, stations and conditions with one multi-row statement per table;
+
+    :param price_index: A loaded LatestPriceIndex; without it prices are checked with one query per house
+    :param mark_available: Skip step 1 when re-processing saved pages rather than fresh ones
+    """
+    if len(house_infos) == 0:
+        return
+    if mark_available:
+        update_houses_availability([x.house_id for x in house_infos], True, category, cur)
+
+    info_rows = []
+    station_rows = []
+    condition_rows = []
+    for house_info in house_infos:
+        if house_info.num_null_fields > 0:
+            logging.error(f'house_id {house_info.house_id}: {house_info.num_null_fields} null fields in House Info.')
+        if price_index is None:
+            if category == constant.CHINTAI:
+                update_rent_price_if_changed(house_info.house_id, house_info.rent, house_info.manage_fee, cnx, cur)
+            else:
+                update_mansion_price_if_changed(house_info.house_id, house_info.price, cnx, cur)
+        info_rows.append(house_info.to_row())
+        station_rows += house_info.get_station_rows(category)
+        condition_rows += house_info.get_condition_rows(category)
+    changed_prices = {}
+    if price_index is not None:
+        changed_prices = update_price_history_batch(house_infos, category, price_index, cur)
+
+    info_columns = house_infos[0].COLUMNS
+    info_rowcounts = dbutil.bulk_upsert(rows=info_rows,
+                                        table_name=get_info_table_name_from_category(category),
+                                        update_columns=list(info_columns),
+                                        cur=cur,
+                                        columns=info_columns)
+    station_rowcounts = dbutil.bulk_upsert(rows=station_rows,
+                                           table_name='lifull_stations_near_house',
+                                           update_columns=['walk_distance_in_minute', 'category'],
+                                           cur=cur,
+                                           key_columns=('house_id', 'line_name', 'station_name'),
+                                           columns=STATION_COLUMNS)
+    condition_rowcounts = dbutil.bulk_upsert(rows=condition_rows,
+                                             table_name='lifull_house_condition',
+                                             update_columns=['category'],
+                                             cur=cur,
+                                             key_columns=('house_id', 'house_condition'),
+                                             columns=CONDITION_COLUMNS)
+    cnx.commit()
+    for house_id, price in changed_prices.items():
+        price_index.set(house_id, price)
+    logging.info(f'{len(house_infos)} house infos written: '
+                 f'{sum(x[0] for x in info_rowcounts)} inserted, {sum(x[1] for x in info_rowcounts)} updated, '
+                 f'{sum(x[0] for x in station_rowcounts)} stations and '
+                 f'{sum(x[0] for x in condition_rowcounts)} conditions inserted.')
+
+
 def process_mansion_info(house_id, response, category, cnx, cur):
     """
     1. Update its price in `house_price_history` table if different from latest or no record;
@@ -214,14 +367,23 @@ def process_rent_info(house_id, response, cnx, cur):
 
 
 if __name__ == "__main__":
-    usage = 'main.py -i <parent_dir_path> --id <certain_house_id> --logfile <log_file> --loglevel <loglevel> --category <category>'
+    usage = 'main.py -i <parent_dir_path> --id <certain_house_id> --logfile <log_file> --loglevel <loglevel> --category <category> ' \
+            '--processes <num_processes> --chunk_size <chunk_size> --checkpoint <checkpoint_path> ' \
+            '--store <file|segment> --crawl_date <crawl_date>'
     parent_dir_path = ''
     log_file = ''
     certain_house_id = ''
     category = ''
     loglevel = logging.INFO
+    num_processes = 0
+    chunk_size = 200
+    checkpoint_path = ''
+    store_type = raw_page_store.FLAT_FILE
+    crawl_dates = None
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hi:l:", ["dir=", "logfile=", "id=", "loglevel=", "category="])
+        opts, args = getopt.getopt(sys.argv[1:], "hi:l:", ["dir=", "logfile=", "id=", "loglevel=", "category=",
+                                                          "processes=", "chunk_size=", "checkpoint=", "store=",
+                                                          "crawl_date="])
     except getopt.GetoptError:
         print(usage)
         sys.exit(2)
@@ -239,9 +401,20 @@ if __name__ == "__main__":
             log_file = arg
         elif opt in ("--category"):
             category = arg
+        elif opt in ("--processes"):
+            num_processes = int(arg)
+        elif opt in ("--chunk_size"):
+            chunk_size = int(arg)
+        elif opt in ("--checkpoint"):
+            checkpoint_path = arg
+        elif opt in ("--store"):
+            store_type = arg
+        elif opt in ("--crawl_date"):
+            crawl_dates = [arg]
     if parent_dir_path == '' or log_file == '' or category == '':
         print(usage)
         sys.exit(2)
+    assert store_type in (raw_page_store.FLAT_FILE, raw_page_store.SEGMENT)
     print('Input parent dir path is', parent_dir_path)
 
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
@@ -249,6 +422,15 @@ if __name__ == "__main__":
                         level=loglevel,
                         filemode='w',
                         filename=log_file)
+    metrics.enable_from_env()
+
+    # Parallel batch mode
+    if num_processes > 0 and certain_house_id == '':
+        from house_info_processor.reprocess import reprocess_html_dir
+        reprocess_html_dir(parent_dir_path, category, num_processes, chunk_size, checkpoint_path,
+                           store_type=store_type, crawl_dates=crawl_dates)
+        metrics.export(f'house_info_processor-{category}')
+        sys.exit()
 
     # Connect to the database
     cnx = dbutil.get_mysql_cnx()
@@ -256,17 +438,16 @@ if __name__ == "__main__":
 
     # If we only want to check a certain_house_id
     if certain_house_id != '':
-        file_path = join(parent_dir_path, f'{certain_house_id}.html')
-        with open(file_path, 'r') as f:
-            logging.debug(f'process_mansion_info for {file_path}')
-            process_mansion_info(int(certain_house_id), Selector(text=str(f.read())), category, cnx, cur)
-        sys.exit()
-
-    file_paths = [join(parent_dir_path, f) for f in listdir(parent_dir_path)
-                  if isfile(join(parent_dir_path, f)) and f.endswith('.html')]
-    print(f'{len(file_paths)} html files will be processed.')
-    for file_path in file_paths:
-        house_id = basename(file_path).replace('.html', '')
-        with open(file_path, 'r') as f:
-            logging.debug(f'process_mansion_info for {file_path}')
-            process_mansion_info(house_id, Selector(text=str(f.read())), category, cnx, cur)
+        page_refs = [x for x in raw_page_store.list_page_refs(parent_dir_path, store_type, category, crawl_dates)
+                     if x[0] == certain_house_id]
+    else:
+        page_refs = raw_page_store.list_page_refs(parent_dir_path, store_type, category, crawl_dates)
+    print(f'{len(page_refs)} pages will be processed.')
+    for house_id, page_ref in page_refs:
+        logging.debug(f'process house info for {house_id} {page_ref}')
+        response = Selector(text=raw_page_store.read_page(page_ref).decode('utf-8'))
+        if category == constant.CHINTAI:
+            process_rent_info(house_id, response, cnx, cur)
+        else:
+            process_mansion_info(house_id, response, category, cnx, cur)
+    metrics.export(f'house_info_processor-{category}')
@@ -1,15 +1,67 @@
-from datetime import date
-import json
 import logging
 import re
 import sys
 
 sys.path.append('../')
 
-from utils import utils
+from house_info_processor.field_spec import FieldSpec, NOTE_ROW_FIELDS
+from house_info_processor.records import MANSION_INFO_COLUMNS, HOUSE_INFO_EXTRA_FIELDS, HouseInfoRecord, Condition, \
+    Station
+from utils import text_parsers
+from utils.district import resolve_district
+
+MANSION_FIELD_SPEC = FieldSpec(
+    sections={
+        'building': '.mod-buildingName',
+        'top': '.mod-detailTopSale',
+        'spec': '.mod-bukkenSpecDetail',
+        'notes': '.mod-bukkenNotes',
+    },
+    fields={
+        'name': ('building', '.bukkenName::text'),
+        'room': ('building', '.bukkenRoom::text'),
+        'price': ('top', '#chk-bkc-moneyroom::text'),
+        'price_inner': ('top', '#chk-bkc-moneyroom .num>span::text'),
+        'address': ('top', '#chk-bkc-fulladdress::text'),
+        'moneykyoueki': ('top', '#chk-bkc-moneykyoueki::text'),
+        'moneyshuuzen': ('top', '#chk-bkc-moneyshuuzen::text'),
+        'traffic': ('top', '#chk-bkc-fulltraffic .traffic::text'),
+        'traffic_p': ('top', '#chk-bkc-fulltraffic>p::text'),
+        'build_date': ('top', '#chk-bkc-kenchikudate::text'),
+        'window_angle': ('top', '#chk-bkc-windowangle::text'),
+        'house_area': ('top', '#chk-bkc-housearea::text'),
+        'balcony_area': ('top', '#chk-bkc-balconyarea::text'),
+        'floor_plan': ('top', '#chk-bkc-marodi::text'),
+        'feature_comment': ('top', '#chk-bkp-featurecomment::text'),
+        'register_date': ('top', '#chk-bkh-newdate::text'),
+        'cash_on_cash_roi_percentage': ('spec', '#chk-bkd-moneyrimawari::text'),
+        'spec_house_area_min_max': ('spec', '#chk-bkd-houseareaminmax::text'),
+        'spec_house_area': ('spec', '#chk-bkd-housearea::text'),
+        'land_area': ('spec', '#chk-bkd-landarea::text'),
+        'spec_balcony_area': ('spec', '#chk-bkd-balconyarea::text'),
+        'unit_num': ('spec', '#chk-bkd-allunit::text'),
+        'floor_infos': ('spec', '#chk-bkd-housekai::text'),
+        'house_structure': ('spec', '#chk-bkd-housekouzou::text'),
+        'structure': ('spec', '#chk-bkd-kouzou::text'),
+        'land_usage': ('spec', '#chk-bkd-landyouto::text'),
+        'land_position': ('spec', '#chk-bkd-landchisei::text'),
+        'land_right': ('spec', '#chk-bkd-landright::text'),
+        'land_moneyshakuchi': ('spec', '#chk-bkd-moneyshakuchi::text'),
+        'land_term': ('spec', '#chk-bkd-conterm::text'),
+        'land_landkokudoho': ('spec', '#chk-bkd-landkokudoho::text'),
+        'other_fee_details': ('spec', '#chk-bkd-moneyother::text'),
+        'manage_details': ('spec', '#chk-bkd-management::text'),
+        'latest_rent_status': ('spec', '#chk-bkd-genkyo .genkyoText::text'),
+        'trade_method': ('spec', '#chk-bkd-taiyou::text'),
+    },
+    row_section='notes',
+    row_fields=NOTE_ROW_FIELDS)
+
+
+class MansionInfo(HouseInfoRecord):
+    __slots__ = MANSION_INFO_COLUMNS + HOUSE_INFO_EXTRA_FIELDS
+    COLUMNS = MANSION_INFO_COLUMNS
 
-
-class MansionInfo:
     def safe_strip(self, item, default=None, do_not_count_null=False):
         if isinstance(item, str):
             return item.strip()
@@ -24,186 +76,140 @@ class MansionInfo:
         self.num_null_fields = 0
 
         self.house_id = house_id
-        self.name = response.css('.mod-buildingName').css('.bukkenName::text').get()
-        self.room = response.css('.mod-buildingName').css('.bukkenRoom::text').get()
+        fields = MANSION_FIELD_SPEC.extract(response)
+        self.name = fields.get('name')
+        self.room = fields.get('room')
 
-        detailTopSale = response.css('.mod-detailTopSale')
-        self.price = utils.get_float_from_text(detailTopSale.css('#chk-bkc-moneyroom::text').get())
+        self.price = text_parsers.parse_price(fields.get('price'))
         if self.price == 0:
             # If the price is not available it is possible in inner span
-            self.price = utils.get_float_from_text(detailTopSale.css('#chk-bkc-moneyroom').css('.num>span::text').get())
-        self.address = self.safe_strip(detailTopSale.css('#chk-bkc-fulladdress::text').get())
+            self.price = text_parsers.parse_price(fields.get('price_inner'))
+        self.address = self.safe_strip(fields.get('address'))
 
-        valid_district = utils.get_district_from_name(self.address)
-        if len(valid_district) == 0:
+        district = resolve_district(self.address)
+        if district is None:
             logging.error(f'{house_id}: error parse district {self.address})')
             self.district = ''
-        elif len(valid_district) > 1:
-            logging.error(f'{house_id}: error parse district {self.address})')
-            self.district = valid_district[0]
         else:
-            self.district = valid_district[0]
+            self.district = district.name
 
-        self.moneykyoueki = utils.get_float_from_text(
-            self.safe_strip(detailTopSale.css('#chk-bkc-moneykyoueki::text').get()))
-        self.moneyshuuzen = utils.get_float_from_text(
-            self.safe_strip(detailTopSale.css('#chk-bkc-moneyshuuzen::text').get()))
+        self.moneykyoueki = text_parsers.parse_yen(self.safe_strip(fields.get('moneykyoueki')))
+        self.moneyshuuzen = text_parsers.parse_yen(self.safe_strip(fields.get('moneyshuuzen')))
 
         self.stations = []
-        station_text_list = detailTopSale.css('#chk-bkc-fulltraffic').css('.traffic::text').getall()
+        station_text_list = fields.getall('traffic')
         if len(station_text_list) == 0:
-            station_text_list = detailTopSale.css('#chk-bkc-fulltraffic>p::text').getall()
+            station_text_list = fields.getall('traffic_p')
         for traffic in station_text_list:
             traffic = re.split(' +', traffic.strip())
             if len(traffic) != 3:
                 continue
             if '徒歩' not in traffic[2]:
                 continue
-            self.stations.append((traffic[0], traffic[1], utils.get_int_from_text(traffic[2])))
+            self.stations.append(
+                Station(traffic[0], traffic[1], text_parsers.parse_walk_minutes(traffic[2], default=0)))
 
-        build_date_str = self.safe_strip(detailTopSale.css('#chk-bkc-kenchikudate::text').get(), default='')
-        tmp_l = re.findall(r'\d+', ''.join(re.findall(r'\d+年\d+月', build_date_str)))
-        if len(tmp_l) != 2:
+        build_date_str = self.safe_strip(fields.get('build_date'), default='')
+        build_date = text_parsers.parse_year_month(build_date_str)
+        if build_date is None:
             self.num_null_fields += 1
             logging.error(f'{house_id}: error parse build_date {build_date_str})')
             self.build_date = None
         else:
-            self.build_date = date(int(tmp_l[0]), int(tmp_l[1]), 1).strftime("%Y-%m-%d")
-        tmp_l = re.findall(r'築\d+年', build_date_str)
-        if len(tmp_l) != 1:
-            if len(re.findall(r'新築', build_date_str)) > 0:
-                self.age = 0
-            else:
-                self.num_null_fields += 1
-                logging.error(f'{house_id}: error parse build_age {build_date_str})')
-                self.age = None
-        else:
-            self.age = utils.get_int_from_text(tmp_l[0])
-
-        self.window_angle = self.safe_strip(detailTopSale.css('#chk-bkc-windowangle::text').get(),
-                                            do_not_count_null=True)
-        self.house_area = utils.get_float_from_text(
-            self.safe_strip(detailTopSale.css('#chk-bkc-housearea::text').get()))
-        self.balcony_area = utils.get_float_from_text(
-            self.safe_strip(detailTopSale.css('#chk-bkc-balconyarea::text').get(), default='0', do_not_count_null=True))
+            self.build_date = build_date.strftime("%Y-%m-%d")
+        self.age = text_parsers.parse_building_age(build_date_str)
+        if self.age is None:
+            self.num_null_fields += 1
+            logging.error(f'{house_id}: error parse build_age {build_date_str})')
+
+        self.window_angle = self.safe_strip(fields.get('window_angle'), do_not_count_null=True)
+        self.house_area = text_parsers.parse_area(self.safe_strip(fields.get('house_area')))
+        self.balcony_area = text_parsers.parse_area(
+            self.safe_strip(fields.get('balcony_area'), default='0', do_not_count_null=True))
         self.has_balcony = self.balcony_area > 0
-        self.floor_plan = self.safe_strip(detailTopSale.css('#chk-bkc-marodi::text').get())
-        self.feature_comment = self.safe_strip(detailTopSale.css('#chk-bkp-featurecomment::text').get(),
-                                               do_not_count_null=True)
-        register_date = detailTopSale.css('#chk-bkh-newdate::text').get()
+        self.floor_plan = self.safe_strip(fields.get('floor_plan'))
+        self.feature_comment = self.safe_strip(fields.get('feature_comment'), do_not_count_null=True)
+        register_date = fields.get('register_date')
         self.register_date = None if register_date is None else register_date.replace('/', '-')
 
-        bukkenNotes = response.css('.mod-bukkenNotes')
         self.has_elevator = False
         self.note = None
         self.has_special_note = False
         self.conditions = []
 
-        for tr in bukkenNotes.css('tr'):
-            if tr.css('th::text').get() == '設備・サービス':
-                equipments = tr.css('ul.normalEquipment').css('li::text').getall()
-                equipments = [re.sub('\n.*', '', x.strip()) for x in equipments]
-                self.has_elevator = self.has_elevator or 'エレベーター' in equipments
-            if tr.css('th::text').get() == '設備・条件':
-                equipments = tr.css('ul.normalEquipment').css('li::text').getall()
-                equipments = [re.sub('\n.*', '', x.strip()) for x in equipments]
-                self.has_elevator = self.has_elevator or 'エレベーター' in equipments
-            elif tr.css('th::text').get() == 'この物件のこだわり':
-                tmpl = tr.css('ul.bukkenEquipment').css('li.active').css('span::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '物件の状況':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '保険・保証':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '備考':
-                self.note = ''.join(tr.css('td#chk-bkf-biko::text').getall()).strip()
-                self.has_special_note = '告知事項' in self.note
-            elif tr.css('th::text').get() == 'その他':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-
-        bukkenSpecDetail = response.css('.mod-bukkenSpecDetail')
-        self.cash_on_cash_roi_percentage = utils.get_float_from_text(
-                self.safe_strip(bukkenSpecDetail.css('#chk-bkd-moneyrimawari::text').get(),
-                                do_not_count_null=True))
+        row_parsers = {
+            '設備・サービス': self.parse_equipment_row,
+            '設備・条件': self.parse_equipment_row,
+            'この物件のこだわり': self.parse_kodawari_row,
+            '物件の状況': self.parse_condition_row,
+            '保険・保証': self.parse_condition_row,
+            '備考': self.parse_note_row,
+            'その他': self.parse_condition_row,
+        }
+        for row in fields.rows:
+            row_parser = row_parsers.get(row.header)
+            if row_parser is not None:
+                row_parser(row)
+
+        self.cash_on_cash_roi_percentage = text_parsers.parse_number(
+                self.safe_strip(fields.get('cash_on_cash_roi_percentage'), do_not_count_null=True))
 
         # Fallback house_area to new entries in bukkenSpecDetail
         if self.house_area is None or self.house_area == 0:
-            self.house_area = utils.get_float_from_text(
-                self.safe_strip(bukkenSpecDetail.css('#chk-bkd-houseareaminmax::text').get(), default='0',
-                                do_not_count_null=True).split('～')[0])
+            # The min of `min～max`
+            self.house_area = text_parsers.parse_area(
+                self.safe_strip(fields.get('spec_house_area_min_max'), default='0', do_not_count_null=True))
         if self.house_area is None or self.house_area == 0:
-            self.house_area = utils.get_float_from_text(
-                self.safe_strip(bukkenSpecDetail.css('#chk-bkd-housearea::text').get(), default='0',
-                                do_not_count_null=True))
+            self.house_area = text_parsers.parse_area(
+                self.safe_strip(fields.get('spec_house_area'), default='0', do_not_count_null=True))
 
-        self.land_area = utils.get_float_from_text(
-                self.safe_strip(bukkenSpecDetail.css('#chk-bkd-landarea::text').get(), do_not_count_null=True))
+        self.land_area = text_parsers.parse_area(self.safe_strip(fields.get('land_area'), do_not_count_null=True))
 
         # Fallback balcony_area to new entries in bukkenSpecDetail
         if self.balcony_area == 0:
-            self.balcony_area = utils.get_float_from_text(
-                self.safe_strip(bukkenSpecDetail.css('#chk-bkd-balconyarea::text').get(), default='0',
-                                do_not_count_null=True))
+            self.balcony_area = text_parsers.parse_area(
+                self.safe_strip(fields.get('spec_balcony_area'), default='0', do_not_count_null=True))
             self.has_balcony = self.balcony_area > 0
 
-        self.unit_num = utils.get_int_from_text(bukkenSpecDetail.css('#chk-bkd-allunit::text').get())
+        self.unit_num = text_parsers.parse_int(fields.get('unit_num'))
 
-        num_floor_infos = bukkenSpecDetail.css('#chk-bkd-housekai::text').get()
-        self.floor_num = None
-        self.num_total_floor = None
-        if num_floor_infos is None:
-            self.num_null_fields += 2
-        else:
-            floor_num_l = re.findall(r'\d+階 /', num_floor_infos)
-            num_total_floor_l = re.findall(r'/ \d+階建', num_floor_infos)
-            if len(floor_num_l) != 1:
-                self.num_null_fields += 1
-            else:
-                self.floor_num = utils.get_int_from_text(floor_num_l[0], empty_str_to_none=True)
-
-            if len(num_total_floor_l) != 1:
-                self.num_null_fields += 1
-            else:
-                self.num_total_floor = utils.get_int_from_text(num_total_floor_l[0], empty_str_to_none=True)
-
-        if bukkenSpecDetail.css('#chk-bkd-housekouzou::text').get() is not None:
-            self.structure = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-housekouzou::text').get())
+        self.floor_num, self.num_total_floor = text_parsers.parse_floors(fields.get('floor_infos'))
+        self.num_null_fields += int(self.floor_num is None) + int(self.num_total_floor is None)
+
+        if fields.get('house_structure') is not None:
+            self.structure = self.safe_strip(fields.get('house_structure'))
         else:
-            self.structure = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-kouzou::text').get())
-        self.land_usage = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-landyouto::text').get(),
-                                          do_not_count_null=True)
-        self.land_position = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-landchisei::text').get(),
-                                             do_not_count_null=True)
-        self.land_right = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-landright::text').get())
-        land_moneyshakuchi = bukkenSpecDetail.css('#chk-bkd-moneyshakuchi::text').get()
-        self.land_moneyshakuchi = None if land_moneyshakuchi is None else utils.get_float_from_text(
+            self.structure = self.safe_strip(fields.get('structure'))
+        self.land_usage = self.safe_strip(fields.get('land_usage'), do_not_count_null=True)
+        self.land_position = self.safe_strip(fields.get('land_position'), do_not_count_null=True)
+        self.land_right = self.safe_strip(fields.get('land_right'))
+        land_moneyshakuchi = fields.get('land_moneyshakuchi')
+        self.land_moneyshakuchi = None if land_moneyshakuchi is None else text_parsers.parse_yen(
             land_moneyshakuchi.strip())
-        land_term = bukkenSpecDetail.css('#chk-bkd-conterm::text').get()
+        land_term = fields.get('land_term')
         self.land_term = None if land_term is None else land_term.strip()
-        self.land_landkokudoho = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-landkokudoho::text').get())
+        self.land_landkokudoho = self.safe_strip(fields.get('land_landkokudoho'))
+
+        self.other_fee_details = self.safe_strip(fields.get('other_fee_details'), do_not_count_null=True)
+
+        self.total_other_fee = 0 if self.other_fee_details is None else \
+            text_parsers.parse_yen_total(self.other_fee_details)
+
+        self.manage_details = self.safe_strip(fields.get('manage_details'))
+        self.latest_rent_status = self.safe_strip(fields.get('latest_rent_status'))
+        self.trade_method = self.safe_strip(fields.get('trade_method'))
 
-        self.other_fee_details = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-moneyother::text').get(),
-                                                 do_not_count_null=True)
+    def parse_equipment_row(self, row):
+        equipments = [re.sub('\n.*', '', x.strip()) for x in row.getall('normal_equipments')]
+        self.has_elevator = self.has_elevator or 'エレベーター' in equipments
 
-        other_fees = [] if self.other_fee_details is None else re.findall(r'\d*,?\d+円', self.other_fee_details)
-        self.total_other_fee = sum(utils.get_float_from_text(x) for x in other_fees)
+    def parse_kodawari_row(self, row):
+        self.conditions += [Condition(re.sub('\n.*', '', x.strip())) for x in row.getall('active_equipments')]
 
-        self.manage_details = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-management::text').get())
-        self.latest_rent_status = self.safe_strip(
-            bukkenSpecDetail.css('#chk-bkd-genkyo').css('.genkyoText::text').get())
-        self.trade_method = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-taiyou::text').get())
+    def parse_condition_row(self, row):
+        tmpl = row.getall('normal_equipments') if row.has('normal_equipment') else row.getall('cells')
+        self.conditions += [Condition(re.sub('\n.*', '', x.strip())) for x in tmpl]
 
-    def __str__(self):
-        return json.dumps(self.__dict__, indent=2, ensure_ascii=False)
\ No newline at end of file
+    def parse_note_row(self, row):
+        self.note = ''.join(row.getall('note')).strip()
+        self.has_special_note = '告知事項' in self.note
@@ -0,0 +1,72 @@
+"""
+In-memory index of the latest known price per house, loaded once from `xxx_price_history`
+so that checking whether a crawled price changed does not need a query per house.
+"""
+import logging
+import math
+import threading
+import sys
+
+sys.path.append('../')
+
+from utils import constant
+
+
+def is_price_changed(latest_price, price):
+    """
+    The columns are single-precision FLOAT, so 12.3 reads back as 12.300000190734863: compare with a tolerance.
+    """
+    if latest_price is None or price is None:
+        return latest_price is not price
+    return not math.isclose(latest_price, price, rel_tol=1e-6, abs_tol=1e-6)
+
+
+class LatestPriceIndex:
+    def __init__(self, category):
+        self.category = category
+        # house_id -> price for mansion, house_id -> (rent, manage_fee) for chintai
+        self.latest_prices = {}
+        self._lock = threading.Lock()
+
+    def get_table_name(self):
+        return 'lifull_rent_price_history' if self.category == constant.CHINTAI else 'lifull_house_price_history'
+
+    def get_price_columns(self):
+        return ['rent', 'manage_fee'] if self.category == constant.CHINTAI else ['price']
+
+    def load(self, cur):
+        """
+        Read the latest row of every house with one grouped query.
+        """
+        table_name = self.get_table_name()
+        price_columns = self.get_price_columns()
+        cur.execute(f"""
+            SELECT h.house_id, {','.join([f'h.{c}' for c in price_columns])}
+            FROM {table_name} h
+            JOIN (SELECT house_id, MAX(price_date) AS price_date FROM {table_name} GROUP BY house_id) latest
+            ON h.house_id=latest.house_id AND h.price_date=latest.price_date;""")
+        latest_prices = {}
+        for row in cur.fetchall():
+            latest_prices[str(row[0])] = row[1] if len(price_columns) == 1 else tuple(row[1:])
+        with self._lock:
+            self.latest_prices = latest_prices
+        logging.info(f'{len(latest_prices)} latest prices loaded from {table_name}.')
+        return len(latest_prices)
+
+    def get(self, house_id):
+        return self.latest_prices.get(str(house_id))
+
+    def set(self, house_id, price):
+        with self._lock:
+            self.latest_prices[str(house_id)] = price
+
+    def is_changed(self, house_id, price):
+        """
+        :return: True if there is no record, or the stored price differs from the crawled one
+        """
+        latest_price = self.get(house_id)
+        if latest_price is None:
+            return True
+        if self.category == constant.CHINTAI:
+            return is_price_changed(latest_price[0], price[0]) or is_price_changed(latest_price[1], price[1])
+        return is_price_changed(latest_price, price)
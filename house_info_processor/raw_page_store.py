@@ -0,0 +1,159 @@
+"""
+Storage for the raw detail pages saved by house_info_spider.
+
+Two backends share the same put/close interface:
+
+- FlatFileRawPageStore: the original layout, one uncompressed `{house_id}.html` per house,
+  overwritten on every crawl.
+- SegmentRawPageStore: date-partitioned append-only segment files. Each page is one gzip
+  member appended to `{root}/{crawl_date}/{category}-{pid}-{seq}.seg` and its offset is
+  recorded in the matching `.idx` file as `house_id<TAB>offset<TAB>length<TAB>written_at`,
+  so every day's pages are kept and any page can be read back without scanning the segment.
+"""
+import gzip
+import os
+import time
+
+FLAT_FILE = 'file'
+SEGMENT = 'segment'
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+
+class FlatFileRawPageStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def put(self, house_id, body):
+        with open(os.path.join(self.root_dir, f'{house_id}.html'), 'wb') as html_file:
+            html_file.write(body)
+
+    def close(self):
+        pass
+
+
+class SegmentRawPageStore:
+    def __init__(self, root_dir, crawl_date, category, segment_max_bytes=256 * 1024 * 1024, compresslevel=6):
+        self.partition_dir = os.path.join(root_dir, crawl_date)
+        self.category = category
+        self.segment_max_bytes = segment_max_bytes
+        self.compresslevel = compresslevel
+        self.segment_seq = 0
+        self.segment_file = None
+        self.index_file = None
+        os.makedirs(self.partition_dir, exist_ok=True)
+
+    def _open_next_segment(self):
+        self.close()
+        while True:
+            segment_prefix = os.path.join(self.partition_dir, f'{self.category}-{os.getpid()}-{self.segment_seq:04d}')
+            self.segment_seq += 1
+            if not os.path.exists(segment_prefix + SEGMENT_SUFFIX):
+                break
+        self.segment_file = open(segment_prefix + SEGMENT_SUFFIX, 'ab')
+        self.index_file = open(segment_prefix + INDEX_SUFFIX, 'a')
+
+    def put(self, house_id, body):
+        if self.segment_file is None or self.segment_file.tell() >= self.segment_max_bytes:
+            self._open_next_segment()
+        record = gzip.compress(body, compresslevel=self.compresslevel)
+        offset = self.segment_file.tell()
+        self.segment_file.write(record)
+        self.segment_file.flush()
+        # Only index the record once its bytes are written, so a crash never indexes a partial record.
+        self.index_file.write(f'{house_id}\t{offset}\t{len(record)}\t{time.time():.6f}\n')
+        self.index_file.flush()
+
+    def close(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.index_file.close()
+            self.segment_file = None
+            self.index_file = None
+
+
+def get_raw_page_store(store_type, root_dir, crawl_date, category):
+    if store_type == SEGMENT:
+        return SegmentRawPageStore(root_dir, crawl_date, category)
+    return FlatFileRawPageStore(root_dir)
+
+
+def list_crawl_dates(root_dir):
+    return sorted(x for x in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, x)))
+
+
+def list_page_refs(root_dir, store_type, category=None, crawl_dates=None, latest_only=True):
+    """
+    List the saved pages without reading them.
+
+    :param category: Only read segments written for this category
+    :param crawl_dates: Only read these partitions, default to all of them
+    :param latest_only: Keep only the most recent page of each house
+    :return: [(house_id, page_ref)] sorted by page_ref so reads are sequential per segment;
+             a page_ref is the file path for FLAT_FILE and (segment_path, offset, length) for SEGMENT
+    """
+    if store_type != SEGMENT:
+        page_refs = []
+        with os.scandir(root_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.html'):
+                    page_refs.append((entry.name[:-len('.html')], entry.path))
+        return sorted(page_refs, key=lambda x: x[1])
+
+    # {house_id: ((crawl_date, written_at), page_ref)}
+    latest_page_refs = {}
+    page_refs = []
+    for crawl_date in (crawl_dates or list_crawl_dates(root_dir)):
+        partition_dir = os.path.join(root_dir, crawl_date)
+        if not os.path.isdir(partition_dir):
+            continue
+        for index_name in sorted(os.listdir(partition_dir)):
+            if not index_name.endswith(INDEX_SUFFIX):
+                continue
+            if category is not None and not index_name.startswith(f'{category}-'):
+                continue
+            segment_path = os.path.join(partition_dir, index_name[:-len(INDEX_SUFFIX)] + SEGMENT_SUFFIX)
+            index_path = os.path.join(partition_dir, index_name)
+            # Indexes written before written_at was recorded fall back to the time of their last record.
+            index_mtime = os.path.getmtime(index_path)
+            with open(index_path) as index_file:
+                for line in index_file:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) not in (3, 4):
+                        continue
+                    page_ref = (segment_path, int(fields[1]), int(fields[2]))
+                    if latest_only:
+                        # Index files of one day are not in write order (a resumed crawl has another pid),
+                        # so compare the write times; a later record of the same index file wins a tie.
+                        written_at = (crawl_date, float(fields[3]) if len(fields) == 4 else index_mtime)
+                        latest_page_ref = latest_page_refs.get(fields[0])
+                        if latest_page_ref is None or written_at >= latest_page_ref[0]:
+                            latest_page_refs[fields[0]] = (written_at, page_ref)
+                    else:
+                        page_refs.append((fields[0], page_ref))
+    if latest_only:
+        page_refs = [(house_id, x[1]) for house_id, x in latest_page_refs.items()]
+    return sorted(page_refs, key=lambda x: x[1])
+
+
+def read_page(page_ref):
+    """
+    :return: The raw page bytes of a page_ref from list_page_refs
+    """
+    if isinstance(page_ref, str):
+        with open(page_ref, 'rb') as f:
+            return f.read()
+    segment_path, offset, length = page_ref
+    with open(segment_path, 'rb') as f:
+        f.seek(offset)
+        return gzip.decompress(f.read(length))
+
+
+def iter_pages(root_dir, store_type, category=None, crawl_dates=None, latest_only=True):
+    """
+    Stream (house_id, page_bytes) for every saved page.
+    """
+    for house_id, page_ref in list_page_refs(root_dir, store_type, category, crawl_dates, latest_only):
+        yield house_id, read_page(page_ref)
@@ -0,0 +1,98 @@
+"""
+Record types of the extracted detail pages, and the columns they are written to.
+
+MANSION_INFO_COLUMNS/RENT_INFO_COLUMNS are the columns of lifull_house_info/lifull_rent_info in
+db/schema.sql, in the same order; keep them in sync when the schema changes. MansionInfo/RentInfo
+keep exactly these columns plus their child records in __slots__, and to_row() returns the columns as
+one tuple for dbutil.bulk_upsert(columns=...). Stations and conditions are Station/Condition records,
+written to lifull_stations_near_house/lifull_house_condition with the house_id and category.
+
+to_dict()/from_dict() are the plain form sent back by the extractor processes and compared by
+parser_benchmark, with stations as [line, station, minutes] and conditions as strings.
+"""
+import collections
+import json
+import operator
+
+MANSION_INFO_COLUMNS = (
+    'house_id', 'name', 'price', 'address', 'moneykyoueki', 'moneyshuuzen', 'district', 'build_date', 'room', 'age',
+    'window_angle', 'house_area', 'balcony_area', 'has_balcony', 'floor_plan', 'feature_comment', 'register_date',
+    'has_elevator', 'note', 'has_special_note', 'unit_num', 'floor_num', 'num_total_floor', 'structure', 'land_usage',
+    'land_position', 'land_right', 'land_moneyshakuchi', 'land_term', 'land_landkokudoho', 'other_fee_details',
+    'total_other_fee', 'manage_details', 'latest_rent_status', 'trade_method', 'land_area',
+    'cash_on_cash_roi_percentage',
+)
+RENT_INFO_COLUMNS = (
+    'house_id', 'name', 'room', 'rent', 'manage_fee', 'deposit_money_in_month', 'gift_money_in_month',
+    'guarantee_money_in_month', 'shokyaku_money_in_month', 'address', 'district', 'build_date', 'age', 'window_angle',
+    'house_area', 'balcony_area', 'has_balcony', 'floor_plan', 'other_fee_details', 'total_other_fee', 'structure',
+    'parking_lot', 'unit_num', 'floor_num', 'num_total_floor', 'rent_term', 'rent_refresh_fee', 'guarantee_company',
+    'insurance', 'current_status', 'rent_start_date', 'trade_method', 'register_date', 'has_elevator', 'note',
+    'has_special_note',
+)
+STATION_COLUMNS = ('house_id', 'line_name', 'station_name', 'walk_distance_in_minute', 'category')
+CONDITION_COLUMNS = ('house_id', 'house_condition', 'category')
+
+# Extracted with the columns but not written to the info table
+HOUSE_INFO_EXTRA_FIELDS = ('num_null_fields', 'stations', 'conditions')
+
+
+class Station(collections.namedtuple('Station', ['line_name', 'station_name', 'walk_distance_in_minute'])):
+    __slots__ = ()
+
+    def to_row(self, house_id, category):
+        return house_id, self.line_name, self.station_name, self.walk_distance_in_minute, category
+
+
+class Condition(collections.namedtuple('Condition', ['house_condition'])):
+    __slots__ = ()
+
+    def to_row(self, house_id, category):
+        return house_id, self.house_condition, category
+
+
+class HouseInfoRecord:
+    """
+    Base of MansionInfo/RentInfo, which set COLUMNS and __slots__ = COLUMNS + HOUSE_INFO_EXTRA_FIELDS.
+    """
+    __slots__ = ()
+    COLUMNS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._get_row = operator.attrgetter(*cls.COLUMNS)
+
+    def to_row(self):
+        """
+        :return: The COLUMNS values of the info table row
+        """
+        return self._get_row(self)
+
+    def get_station_rows(self, category):
+        return [x.to_row(self.house_id, category) for x in self.stations]
+
+    def get_condition_rows(self, category):
+        return [x.to_row(self.house_id, category) for x in self.conditions if x.house_condition != '']
+
+    def to_dict(self):
+        fields = dict(zip(self.COLUMNS, self.to_row()))
+        fields['num_null_fields'] = self.num_null_fields
+        fields['stations'] = [tuple(x) for x in self.stations]
+        fields['conditions'] = [x.house_condition for x in self.conditions]
+        return fields
+
+    @classmethod
+    def from_dict(cls, fields):
+        """
+        Rebuild an extracted record from to_dict(), e.g. as returned by an extractor worker process.
+        """
+        house_info = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            setattr(house_info, name, fields[name])
+        house_info.num_null_fields = fields['num_null_fields']
+        house_info.stations = [Station(*x) for x in fields['stations']]
+        house_info.conditions = [Condition(x) for x in fields['conditions']]
+        return house_info
+
+    def __str__(self):
+        return json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
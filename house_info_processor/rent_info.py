@@ -1,15 +1,58 @@
-from datetime import date
-import json
 import logging
 import re
 import sys
 
 sys.path.append('../')
 
-from utils import utils
+from house_info_processor.field_spec import FieldSpec, NOTE_ROW_FIELDS
+from house_info_processor.records import RENT_INFO_COLUMNS, HOUSE_INFO_EXTRA_FIELDS, HouseInfoRecord, Condition, \
+    Station
+from utils import text_parsers
+from utils.district import resolve_district
+
+RENT_FIELD_SPEC = FieldSpec(
+    sections={
+        'top': '.mod-detailTopRent',
+        'spec': '.mod-bukkenSpecDetail',
+        'notes': '.mod-bukkenNotes',
+    },
+    fields={
+        'name': ('top', '.bukkenName::text'),
+        'room': ('top', '.bukkenRoom::text'),
+        'rent': ('top', '.price #chk-bkc-moneyroom>.num>span::text'),
+        'manage_fee': ('top', '.price #chk-bkc-moneyroom::text'),
+        'deposit_gift_money': ('top', '#chk-bkc-moneyshikirei::text'),
+        'guarantee_shokyaku_money': ('top', '#chk-bkc-moneyhoshoukyaku::text'),
+        'address': ('top', '#chk-bkc-fulladdress::text'),
+        'traffic': ('top', '#chk-bkc-fulltraffic>p::text'),
+        'build_date': ('top', '#chk-bkc-kenchikudate::text'),
+        'window_angle': ('top', '#chk-bkc-windowangle::text'),
+        'house_area': ('top', '#chk-bkc-housearea::text'),
+        'balcony_area': ('top', '#chk-bkc-balconyarea::text'),
+        'floor_plan': ('top', '#chk-bkc-marodi::text'),
+        'other_fee_details': ('spec', '#chk-bkd-moneyother::text'),
+        'structure': ('spec', '#chk-bkd-housekouzou::text'),
+        'parking_lot': ('spec', '#chk-bkd-parking::text'),
+        'unit_num': ('spec', '#chk-bkd-parkunit::text'),
+        'floor_infos': ('spec', '#chk-bkd-housekai::text'),
+        'rent_term': ('spec', '#chk-bkd-conterm::text'),
+        'rent_refresh_fee': ('spec', '#chk-bkd-moneykoushin::text'),
+        'guarantee_company': ('spec', '#chk-bkd-guaranteecom::text'),
+        'insurance': ('spec', '#chk-bkd-insurance::text'),
+        'current_status': ('spec', '#chk-bkd-genkyo::text'),
+        'rent_start_date': ('spec', '#chk-bkd-usable::text'),
+        'rent_start_date_spec': ('spec', '#chk-bkd-usable div.spec::text'),
+        'trade_method': ('spec', '#chk-bkd-taiyou::text'),
+        'register_date': ('spec', '#chk-bkd-newdate::text'),
+    },
+    row_section='notes',
+    row_fields=NOTE_ROW_FIELDS)
+
+
+class RentInfo(HouseInfoRecord):
+    __slots__ = RENT_INFO_COLUMNS + HOUSE_INFO_EXTRA_FIELDS
+    COLUMNS = RENT_INFO_COLUMNS
 
-
-class RentInfo:
     def safe_strip(self, item, default=None, do_not_count_null=False):
         if isinstance(item, str):
             return item.strip()
@@ -24,169 +67,124 @@ class RentInfo:
         self.num_null_fields = 0
 
         self.house_id = house_id
+        fields = RENT_FIELD_SPEC.extract(response)
 
-        detailTopRent = response.css('.mod-detailTopRent')
-        self.name = detailTopRent.css('.bukkenName::text').get()
-        self.room = detailTopRent.css('.bukkenRoom::text').get()
-        self.rent = utils.get_float_from_text(
-            detailTopRent.css('.price').css('#chk-bkc-moneyroom>.num>span::text').get())
-        self.manage_fee = utils.get_float_from_text(detailTopRent.css('.price').css('#chk-bkc-moneyroom::text').get())
-        tmpl_l = self.safe_strip(detailTopRent.css('#chk-bkc-moneyshikirei::text').get(), default='').split('/')
+        self.name = fields.get('name')
+        self.room = fields.get('room')
+        self.rent = text_parsers.parse_price(fields.get('rent'))
+        self.manage_fee = text_parsers.parse_yen(fields.get('manage_fee'))
+        tmpl_l = self.safe_strip(fields.get('deposit_gift_money'), default='').split('/')
         if len(tmpl_l) != 2:
             self.deposit_money_in_month = 0
             self.gift_money_in_month = 0
         else:
-            self.deposit_money_in_month = utils.get_float_from_text(tmpl_l[0])
-            self.gift_money_in_month = utils.get_float_from_text(tmpl_l[1])
+            self.deposit_money_in_month = text_parsers.parse_number(tmpl_l[0])
+            self.gift_money_in_month = text_parsers.parse_number(tmpl_l[1])
 
-        tmpl_l = self.safe_strip(detailTopRent.css('#chk-bkc-moneyhoshoukyaku::text').get(), default='').split('/')
+        tmpl_l = self.safe_strip(fields.get('guarantee_shokyaku_money'), default='').split('/')
         if len(tmpl_l) != 2:
             self.guarantee_money_in_month = 0
             self.shokyaku_money_in_month = 0
         else:
-            self.guarantee_money_in_month = utils.get_float_from_text(tmpl_l[0])
-            self.shokyaku_money_in_month = utils.get_float_from_text(tmpl_l[1])
+            self.guarantee_money_in_month = text_parsers.parse_number(tmpl_l[0])
+            self.shokyaku_money_in_month = text_parsers.parse_number(tmpl_l[1])
 
-        self.address = self.safe_strip(detailTopRent.css('#chk-bkc-fulladdress::text').get())
+        self.address = self.safe_strip(fields.get('address'))
 
-        valid_district = utils.get_district_from_name(self.address)
-        if len(valid_district) == 0:
+        district = resolve_district(self.address)
+        if district is None:
             logging.error(f'{house_id}: error parse district {self.address})')
             self.district = ''
-        elif len(valid_district) > 1:
-            logging.error(f'{house_id}: error parse district {self.address})')
-            self.district = valid_district[0]
         else:
-            self.district = valid_district[0]
+            self.district = district.name
 
         self.stations = []
-        for traffic in detailTopRent.css('#chk-bkc-fulltraffic>p::text').getall():
+        for traffic in fields.getall('traffic'):
             traffic = re.split(' +', traffic.strip())
             if len(traffic) != 3:
                 continue
             if '徒歩' not in traffic[2]:
                 continue
-            self.stations.append((traffic[0], traffic[1], utils.get_int_from_text(traffic[2])))
+            self.stations.append(
+                Station(traffic[0], traffic[1], text_parsers.parse_walk_minutes(traffic[2], default=0)))
 
-        build_date_str = self.safe_strip(detailTopRent.css('#chk-bkc-kenchikudate::text').get(), default='')
-        tmp_l = re.findall(r'\d+', ''.join(re.findall(r'\d+年\d+月', build_date_str)))
-        if len(tmp_l) != 2:
+        build_date_str = self.safe_strip(fields.get('build_date'), default='')
+        build_date = text_parsers.parse_year_month(build_date_str)
+        if build_date is None:
             self.num_null_fields += 1
             logging.error(f'{house_id}: error parse build_date {build_date_str})')
             self.build_date = None
         else:
-            self.build_date = date(int(tmp_l[0]), int(tmp_l[1]), 1).strftime("%Y-%m-%d")
-        tmp_l = re.findall(r'築\d+年', build_date_str)
-        if len(tmp_l) != 1:
-            if len(re.findall(r'新築', build_date_str)) > 0:
-                self.age = 0
-            else:
-                self.num_null_fields += 1
-                logging.error(f'{house_id}: error parse build_age {build_date_str})')
-                self.age = None
-        else:
-            self.age = utils.get_int_from_text(tmp_l[0])
-
-        self.window_angle = self.safe_strip(detailTopRent.css('#chk-bkc-windowangle::text').get(),
-                                            do_not_count_null=True)
-        self.house_area = utils.get_float_from_text(
-            self.safe_strip(detailTopRent.css('#chk-bkc-housearea::text').get()))
-        self.balcony_area = utils.get_float_from_text(
-            self.safe_strip(detailTopRent.css('#chk-bkc-balconyarea::text').get()))
-        self.has_balcony = self.balcony_area > 0
-        self.floor_plan = self.safe_strip(detailTopRent.css('#chk-bkc-marodi::text').get())
-
-        bukkenSpecDetail = response.css('.mod-bukkenSpecDetail')
-        self.other_fee_details = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-moneyother::text').get(),
-                                                 do_not_count_null=True)
-        other_fees = [] if self.other_fee_details is None else re.findall(r'\d*,?\d+円', self.other_fee_details)
-        self.total_other_fee = sum(utils.get_float_from_text(x) for x in other_fees)
-        self.structure = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-housekouzou::text').get())
-        self.parking_lot = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-parking::text').get(), do_not_count_null=True)
-        self.unit_num = utils.get_int_from_text(bukkenSpecDetail.css('#chk-bkd-parkunit::text').get(),
-                                                empty_str_to_none=True)
-        num_floor_infos = bukkenSpecDetail.css('#chk-bkd-housekai::text').get()
-        self.floor_num = None
-        self.num_total_floor = None
-        if num_floor_infos is None:
-            self.num_null_fields += 2
-        else:
-            floor_num_l = re.findall(r'\d+階 /', num_floor_infos)
-            num_total_floor_l = re.findall(r'/ \d+階建', num_floor_infos)
-            if len(floor_num_l) != 1:
-                self.num_null_fields += 1
-            else:
-                self.floor_num = utils.get_int_from_text(floor_num_l[0], empty_str_to_none=True)
+            self.build_date = build_date.strftime("%Y-%m-%d")
+        self.age = text_parsers.parse_building_age(build_date_str)
+        if self.age is None:
+            self.num_null_fields += 1
+            logging.error(f'{house_id}: error parse build_age {build_date_str})')
 
-            if len(num_total_floor_l) != 1:
-                self.num_null_fields += 1
-            else:
-                self.num_total_floor = utils.get_int_from_text(num_total_floor_l[0], empty_str_to_none=True)
-        self.rent_term = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-conterm::text').get())
-        self.rent_refresh_fee = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-moneykoushin::text').get(),
-                                                do_not_count_null=True)
-        self.guarantee_company = self.safe_strip(''.join(bukkenSpecDetail.css('#chk-bkd-guaranteecom::text').getall()))
-        self.insurance = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-insurance::text').get())
-        self.current_status = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-genkyo::text').get())
-        
-        if bukkenSpecDetail.css('#chk-bkd-usable').css('div.spec::text').get() is None:
-            self.rent_start_date = bukkenSpecDetail.css('#chk-bkd-usable::text').get()
+        self.window_angle = self.safe_strip(fields.get('window_angle'), do_not_count_null=True)
+        self.house_area = text_parsers.parse_area(self.safe_strip(fields.get('house_area')))
+        self.balcony_area = text_parsers.parse_area(self.safe_strip(fields.get('balcony_area')))
+        self.has_balcony = self.balcony_area > 0
+        self.floor_plan = self.safe_strip(fields.get('floor_plan'))
+
+        self.other_fee_details = self.safe_strip(fields.get('other_fee_details'), do_not_count_null=True)
+        self.total_other_fee = 0 if self.other_fee_details is None else \
+            text_parsers.parse_yen_total(self.other_fee_details)
+        self.structure = self.safe_strip(fields.get('structure'))
+        self.parking_lot = self.safe_strip(fields.get('parking_lot'), do_not_count_null=True)
+        self.unit_num = text_parsers.parse_int(fields.get('unit_num'), default=None)
+        self.floor_num, self.num_total_floor = text_parsers.parse_floors(fields.get('floor_infos'))
+        self.num_null_fields += int(self.floor_num is None) + int(self.num_total_floor is None)
+        self.rent_term = self.safe_strip(fields.get('rent_term'))
+        self.rent_refresh_fee = self.safe_strip(fields.get('rent_refresh_fee'), do_not_count_null=True)
+        self.guarantee_company = self.safe_strip(''.join(fields.getall('guarantee_company')))
+        self.insurance = self.safe_strip(fields.get('insurance'))
+        self.current_status = self.safe_strip(fields.get('current_status'))
+
+        if fields.get('rent_start_date_spec') is None:
+            self.rent_start_date = fields.get('rent_start_date')
         else:
-            rent_start_date_str = self.safe_strip(
-                bukkenSpecDetail.css('#chk-bkd-usable').css('div.spec::text').get(), default='')
-            tmp_l = re.findall(r'\d+', ''.join(re.findall(r'\d+年\d+月', rent_start_date_str)))
-            if len(tmp_l) != 2:
+            rent_start_date_str = self.safe_strip(fields.get('rent_start_date_spec'), default='')
+            rent_start_date = text_parsers.parse_year_month(rent_start_date_str,
+                                                            day=15 if '下旬' in rent_start_date_str else 1)
+            if rent_start_date is None:
                 self.rent_start_date = rent_start_date_str
             else:
-                if '下旬' in rent_start_date_str:
-                    self.rent_start_date = date(int(tmp_l[0]), int(tmp_l[1]), 15).strftime("%Y-%m-%d")
-                else:
-                    self.rent_start_date = date(int(tmp_l[0]), int(tmp_l[1]), 1).strftime("%Y-%m-%d")
-        self.trade_method = self.safe_strip(bukkenSpecDetail.css('#chk-bkd-taiyou::text').get())
-        register_date = bukkenSpecDetail.css('#chk-bkd-newdate::text').get()
+                self.rent_start_date = rent_start_date.strftime("%Y-%m-%d")
+        self.trade_method = self.safe_strip(fields.get('trade_method'))
+        register_date = fields.get('register_date')
         self.register_date = None if register_date is None else register_date.replace('/', '-')
 
-        bukkenNotes = response.css('.mod-bukkenNotes')
         self.has_elevator = False
         self.note = None
         self.has_special_note = False
         self.conditions = []
 
-        for tr in bukkenNotes.css('tr'):
-            if tr.css('th::text').get() == '設備・サービス':
-                equipments = tr.css('ul.normalEquipment').css('li::text').getall()
-                equipments = [re.sub('\n.*', '', x.strip()) for x in equipments]
-                self.has_elevator = 'エレベーター' in equipments
-            elif tr.css('th::text').get() == 'この物件のこだわり':
-                tmpl = tr.css('ul.bukkenEquipment').css('li.active').css('span::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '入居条件':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '物件の状況':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '保険・保証':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-            elif tr.css('th::text').get() == '備考':
-                self.note = ''.join(tr.css('td#chk-bkf-biko::text').getall()).strip()
-                self.has_special_note = '告知事項' in self.note
-            elif tr.css('th::text').get() == 'その他':
-                if tr.css('ul.normalEquipment').get() is None:
-                    tmpl = tr.css('td::text').getall()
-                else:
-                    tmpl = tr.css('ul.normalEquipment').css('li::text').getall()
-                self.conditions += [re.sub('\n.*', '', x.strip()) for x in tmpl]
-
-    def __str__(self):
-        return json.dumps(self.__dict__, indent=2, ensure_ascii=False)
+        row_parsers = {
+            '設備・サービス': self.parse_equipment_row,
+            'この物件のこだわり': self.parse_kodawari_row,
+            '入居条件': self.parse_condition_row,
+            '物件の状況': self.parse_condition_row,
+            '保険・保証': self.parse_condition_row,
+            '備考': self.parse_note_row,
+            'その他': self.parse_condition_row,
+        }
+        for row in fields.rows:
+            row_parser = row_parsers.get(row.header)
+            if row_parser is not None:
+                row_parser(row)
+
+    def parse_equipment_row(self, row):
+        equipments = [re.sub('\n.*', '', x.strip()) for x in row.getall('normal_equipments')]
+        self.has_elevator = 'エレベーター' in equipments
+
+    def parse_kodawari_row(self, row):
+        self.conditions += [Condition(re.sub('\n.*', '', x.strip())) for x in row.getall('active_equipments')]
+
+    def parse_condition_row(self, row):
+        tmpl = row.getall('normal_equipments') if row.has('normal_equipment') else row.getall('cells')
+        self.conditions += [Condition(re.sub('\n.*', '', x.strip())) for x in tmpl]
+
+    def parse_note_row(self, row):
+        self.note = ''.join(row.getall('note')).strip()
+        self.has_special_note = '告知事項' in self.note
@@ -0,0 +1,96 @@
+"""
+Re-extract saved raw pages in parallel and write them back in batches.
+
+Used by `main.py --processes N` to backfill `xxx_info` tables after an extractor change.
+Pages from either raw_page_store backend are split into chunks which N worker processes
+extract into plain dicts; the parent process writes each chunk with one batch of statements
+and records the finished house_ids in a checkpoint file, so an interrupted run can be resumed.
+"""
+from multiprocessing import Pool
+import logging
+import os
+import sys
+import time
+
+sys.path.append('../')
+
+from house_info_processor import extractor
+from house_info_processor import raw_page_store
+from house_info_processor.main import write_house_info_batch
+from house_info_processor.price_index import LatestPriceIndex
+import db.pool as dbpool
+
+
+def read_checkpoint(checkpoint_path):
+    if checkpoint_path == '' or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as f:
+        return set(line.strip() for line in f if line.strip() != '')
+
+
+def extract_chunk(args):
+    """
+    Worker entry point: extract every page of the chunk.
+    :return: ([(house_id, fields)], [(house_id, error)])
+    """
+    page_refs, category = args
+    extracted = []
+    failed = []
+    for house_id, page_ref in page_refs:
+        try:
+            body = raw_page_store.read_page(page_ref)
+            extracted.append((house_id, extractor.extract_house_info_fields(house_id, body, 'utf-8', category)))
+        except Exception as e:
+            failed.append((house_id, repr(e)))
+    return extracted, failed
+
+
+def reprocess_html_dir(parent_dir_path, category, num_processes=4, chunk_size=200, checkpoint_path='',
+                       store_type=raw_page_store.FLAT_FILE, crawl_dates=None):
+    """
+    :param parent_dir_path: The raw_html dir for FLAT_FILE, the store root for SEGMENT
+    :param crawl_dates: SEGMENT only, partitions to read; the latest page of each house is used
+    """
+    page_refs = raw_page_store.list_page_refs(parent_dir_path, store_type, category=category, crawl_dates=crawl_dates)
+    done_house_ids = read_checkpoint(checkpoint_path)
+    page_refs = [x for x in page_refs if x[0] not in done_house_ids]
+    print(f'{len(page_refs)} pages will be processed, {len(done_house_ids)} skipped by checkpoint.')
+    logging.info(f'{len(page_refs)} pages will be processed, {len(done_house_ids)} skipped by checkpoint.')
+
+    chunks = [(page_refs[i:i + chunk_size], category) for i in range(0, len(page_refs), chunk_size)]
+    db_pool = dbpool.get_session_pool(pool_size=1)
+    price_index = LatestPriceIndex(category)
+    with db_pool.session() as (cnx, cur):
+        price_index.load(cur)
+
+    num_processed = 0
+    num_failed = 0
+    start_time = time.time()
+    checkpoint_file = open(checkpoint_path, 'a') if checkpoint_path != '' else None
+    try:
+        with Pool(processes=num_processes) as pool:
+            for extracted, failed in pool.imap_unordered(extract_chunk, chunks):
+                house_infos = [extractor.house_info_from_fields(fields, category) for _, fields in extracted]
+                with db_pool.session() as (cnx, cur):
+                    write_house_info_batch(house_infos, category, cnx, cur,
+                                           price_index=price_index, mark_available=False)
+
+                for house_id, error in failed:
+                    logging.error(f'{house_id}: fail to extract: {error}')
+                if checkpoint_file is not None:
+                    checkpoint_file.writelines(f'{house_id}\n' for house_id, _ in extracted + failed)
+                    checkpoint_file.flush()
+
+                num_processed += len(extracted)
+                num_failed += len(failed)
+                elapsed = time.time() - start_time
+                progress = f'{num_processed + num_failed}/{len(page_refs)} pages done, {num_failed} failed, ' \
+                           f'{num_processed / elapsed:.1f} pages/sec'
+                print(progress)
+                logging.info(progress)
+    finally:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+        dbpool.close_session_pool()
+
+    return num_processed, num_failed
@@ -10,3 +10,19 @@ class HouseInfoSpiderItem(scrapy.Item):
     # define the fields for your item here like:
     # name = scrapy.Field()
     pass
+
+
+class HouseInfoWriteItem(scrapy.Item):
+    """
+    A parsed detail page waiting to be written to MySQL by HouseInfoSpiderPipeline.
+    """
+    house_id = scrapy.Field()
+    category = scrapy.Field()
+    # False if the page is 404/expired.
+    is_available = scrapy.Field()
+    # MansionInfo or RentInfo, None if the page is unavailable or unchanged since the last crawl.
+    house_info = scrapy.Field()
+    # Fingerprint of the detail sections, to be stored once house_info is written.
+    page_fingerprint = scrapy.Field()
+    # Validators of the page, saved by RevalidationCacheMiddleware once the item is written.
+    revalidation_validators = scrapy.Field()
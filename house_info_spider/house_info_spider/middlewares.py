@@ -3,10 +3,63 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
+import sys
+
+sys.path.append('../')
+
+# Shared by both spiders, enabled with REVALIDATION_CACHE_ENABLED.
+from utils.http_cache import RevalidationCacheMiddleware
+
+
+class CrawlDeferred(IgnoreRequest):
+    """
+    Raised for a low-priority request once the crawl time budget is used up.
+    """
+
+
+class CrawlBudgetMiddleware:
+    """
+    Once the crawl has run for CRAWL_TIME_BUDGET seconds, requests with a priority below
+    CRAWL_BUDGET_MIN_PRIORITY (the routine revisits) are no longer downloaded. They are
+    deferred to the next day through HouseInfoSpider.defer_house instead.
+    """
+
+    def __init__(self, time_budget, min_priority, stats):
+        self.time_budget = time_budget
+        self.min_priority = min_priority
+        self.stats = stats
+        self.start_time = time.time()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        time_budget = crawler.settings.getfloat('CRAWL_TIME_BUDGET', 0)
+        if time_budget <= 0:
+            raise NotConfigured
+        middleware = cls(time_budget=time_budget,
+                         min_priority=crawler.settings.getint('CRAWL_BUDGET_MIN_PRIORITY', 10),
+                         stats=crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.start_time = time.time()
+
+    def process_request(self, request, spider):
+        if request.priority >= self.min_priority or time.time() - self.start_time < self.time_budget:
+            return None
+        house_id = request.cb_kwargs.get('house_id')
+        if house_id is None:
+            return None
+        spider.defer_house(house_id)
+        self.stats.inc_value('crawl_budget/deferred', spider=spider)
+        raise CrawlDeferred(f'{house_id} deferred, crawl time budget of {self.time_budget:.0f}s is used up')
 
 
 class HouseInfoSpiderSpiderMiddleware:
@@ -2,12 +2,240 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+import collections
+import logging
+import queue
+import sys
+import threading
+import time
 
+from scrapy import logformatter
+from scrapy.exceptions import DropItem
+from twisted.internet import defer
+from twisted.internet.threads import deferToThread
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+sys.path.append('../')
+
+from house_info_spider.items import HouseInfoWriteItem
+from house_info_processor.main import write_house_info_batch, update_houses_availability, update_page_fingerprints
+from house_info_processor.price_index import LatestPriceIndex
+import db.pool as dbpool
+from utils import http_cache
+from utils import metrics
+
+
+class QueuedForWrite(DropItem):
+    """
+    Raised once a HouseInfoWriteItem is queued so it does not reach the error feed export.
+    """
+
+
+class HouseInfoLogFormatter(logformatter.LogFormatter):
+    def dropped(self, item, exception, response, spider):
+        if isinstance(exception, QueuedForWrite):
+            return {
+                'level': logging.DEBUG,
+                'msg': 'Queued %(house_id)s for write-behind',
+                'args': {'house_id': item['house_id']},
+            }
+        return super().dropped(item, exception, response, spider)
+
+
+def queued_for_write(_):
+    raise QueuedForWrite()
+
 
 class HouseInfoSpiderPipeline:
+    """
+    Write-behind MySQL pipeline.
+
+    HouseInfoWriteItems are put on a bounded queue and written in batches by background
+    writer threads, so the reactor never waits on MySQL. When the queue is full the item
+    waits in pending_items and its Deferred only fires once a writer has made room, which
+    makes Scrapy slow down downloads; the scraper slot (SCRAPER_SLOT_MAX_ACTIVE_SIZE) bounds
+    how many items can be pending. A batch that fails twice is carried over to the next day
+    through the dead-letter store. Other items (e.g. the failed house_ids) pass through to
+    the feed export untouched.
+
+    With a HouseLinkStream, the items of new and reopened houses are held in held_items until
+    the stream has written their `xxx_link` rows, see HouseLinkStream.is_link_pending.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size, queue_size, flush_interval, num_writers, pool_size):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.num_writers = num_writers
+        self.pool_size = pool_size
+        self.write_queue = None
+        # (item, Deferred) waiting for room in write_queue, only touched on the reactor thread
+        self.pending_items = collections.deque()
+        # Items waiting for the link stream to close, only touched on the reactor thread
+        self.held_items = []
+        self.writer_threads = []
+        self.spider = None
+        self.stats_lock = threading.Lock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(batch_size=crawler.settings.getint('DB_WRITE_BATCH_SIZE', 50),
+                   queue_size=crawler.settings.getint('DB_WRITE_QUEUE_SIZE', 1000),
+                   flush_interval=crawler.settings.getfloat('DB_WRITE_FLUSH_INTERVAL', 2.0),
+                   num_writers=crawler.settings.getint('DB_WRITER_THREADS', 2),
+                   pool_size=crawler.settings.getint('DB_POOL_SIZE', 4))
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self.write_queue = queue.Queue(maxsize=self.queue_size)
+        self.db_pool = dbpool.get_session_pool(pool_size=self.pool_size)
+        # Load the latest prices once so writers never read the price history.
+        self.price_index = LatestPriceIndex(spider.category)
+        with self.db_pool.session() as (cnx, cur):
+            self.price_index.load(cur)
+        for idx in range(self.num_writers):
+            writer_thread = threading.Thread(target=self.write_loop, name=f'house_info_writer_{idx}', daemon=True)
+            writer_thread.start()
+            self.writer_threads.append(writer_thread)
+        if spider.link_stream is not None:
+            spider.link_stream.subscribe_close(self.release_held_items)
+
     def process_item(self, item, spider):
-        return item
+        if not isinstance(item, HouseInfoWriteItem):
+            return item
+        if spider.link_stream is not None and spider.link_stream.is_link_pending(item['house_id']):
+            self.held_items.append(item)
+            raise QueuedForWrite()
+        if len(self.pending_items) == 0:
+            try:
+                self.write_queue.put_nowait(item)
+            except queue.Full:
+                pass
+            else:
+                raise QueuedForWrite()
+        # Backpressure: the item is queued by release_pending_items once a writer has taken a batch.
+        d = defer.Deferred()
+        self.pending_items.append((item, d))
+        return d.addCallback(queued_for_write)
+
+    def release_pending_items(self):
+        while len(self.pending_items) > 0:
+            item, d = self.pending_items[0]
+            try:
+                self.write_queue.put_nowait(item)
+            except queue.Full:
+                return
+            self.pending_items.popleft()
+            d.callback(None)
+
+    def release_held_items(self):
+        if len(self.held_items) == 0:
+            return
+        logging.info(f'{len(self.held_items)} held houses released for write.')
+        # Nothing waits on these Deferreds, the items already left the scraper.
+        self.pending_items.extend((x, defer.Deferred()) for x in self.held_items)
+        self.held_items = []
+        self.release_pending_items()
+
+    def close_spider(self, spider):
+        if len(self.held_items) > 0:
+            # The link stream never closed, their `xxx_link` rows are missing.
+            house_ids = [x['house_id'] for x in self.held_items]
+            logging.error(f'{len(house_ids)} held houses not written, carried over to the next day: {house_ids}')
+            spider.dead_letter_unwritten_houses(house_ids)
+            self.held_items = []
+        # Released held items may still be pending, nothing else waits for them.
+        items = [x for x, _ in self.pending_items]
+        self.pending_items.clear()
+        # Flush whatever is left then stop the writers.
+        return deferToThread(self.stop_writers, items)
+
+    def stop_writers(self, items=()):
+        for item in items:
+            self.write_queue.put(item)
+        for _ in self.writer_threads:
+            self.write_queue.put(self._STOP)
+        for writer_thread in self.writer_threads:
+            writer_thread.join()
+        logging.info(f'{len(self.writer_threads)} house info writers stopped.')
+        dbpool.close_session_pool()
+
+    def write_loop(self):
+        while True:
+            batch = []
+            try:
+                item = self.write_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.wake_pending_items()
+                continue
+            while item is not self._STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.write_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.wake_pending_items()
+            if len(batch) > 0:
+                self.write_batch(batch)
+            if item is self._STOP:
+                return
+
+    def wake_pending_items(self):
+        # Also called on every idle timeout, in case items became pending after a writer's last check.
+        if len(self.pending_items) > 0:
+            from twisted.internet import reactor
+            reactor.callFromThread(self.release_pending_items)
+
+    def write_batch(self, batch):
+        """
+        Write a batch, retry it once if it fails and carry it over to the next day if it fails again.
+        """
+        house_ids = [x['house_id'] for x in batch]
+        try:
+            self.try_write_batch(batch)
+            return
+        except Exception:
+            logging.exception(f'Fail to write {len(batch)} houses, retrying: {house_ids}')
+        time.sleep(self.flush_interval)
+        try:
+            self.try_write_batch(batch)
+        except Exception:
+            logging.exception(f'Fail to write {len(batch)} houses again, carried over to the next day: {house_ids}')
+            from twisted.internet import reactor
+            reactor.callFromThread(self.spider.dead_letter_unwritten_houses, house_ids)
+
+    def try_write_batch(self, batch):
+        category = batch[0]['category']
+        if metrics.is_enabled():
+            metrics.QUEUE_DEPTH.labels(self.spider.name, category, 'write').set(self.write_queue.qsize())
+        available_house_ids = [x['house_id'] for x in batch if x['is_available']]
+        unavailable_house_ids = [x['house_id'] for x in batch if not x['is_available']]
+        # Unchanged pages come without house_info and only need to be marked as available.
+        changed_items = [x for x in batch if x['is_available'] and x['house_info'] is not None]
+        with self.db_pool.session() as (cnx, cur):
+            if len(unavailable_house_ids) > 0:
+                row_count = update_houses_availability(unavailable_house_ids, False, category, cur)
+                cnx.commit()
+                with self.stats_lock:
+                    self.spider.new_unavailable_house_num += row_count
+                logging.info(f'{row_count} of {len(unavailable_house_ids)} houses have been marked as unavailable: '
+                             f'{unavailable_house_ids}')
+            update_houses_availability(available_house_ids, True, category, cur)
+            write_house_info_batch([x['house_info'] for x in changed_items], category, cnx, cur,
+                                   price_index=self.price_index, mark_available=False)
+            update_page_fingerprints({x['house_id']: x['page_fingerprint'] for x in changed_items
+                                      if x.get('page_fingerprint') is not None}, category, cur)
+            cnx.commit()
+        self.spider.mark_completed(*[x['house_id'] for x in batch])
+        # Only now can the next crawl revalidate these pages as unchanged.
+        validators = [x['revalidation_validators'] for x in batch if x.get('revalidation_validators') is not None]
+        if len(validators) > 0:
+            from twisted.internet import reactor
+            reactor.callFromThread(self.spider.crawler.signals.send_catch_log,
+                                   signal=http_cache.validators_committed, validators=validators)
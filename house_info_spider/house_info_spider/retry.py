@@ -0,0 +1,117 @@
+"""
+Retry policies and the dead-letter store used by HouseInfoSpider.
+
+A failed detail page is re-scheduled inside the same crawl after an exponential backoff that
+depends on the failure class (see RETRY_SCHEDULER_POLICIES setting). Pages still failing once
+their retries are used up go to the dead-letter store, a small sqlite file that is read back by
+the next day's crawl, so leftovers are carried over without an extra spider run. Pages put off
+by the crawl budget are carried over from the same file but are not failures: they do not count
+towards DEAD_LETTER_MAX_DAYS.
+"""
+import os
+import random
+import sqlite3
+
+
+# Same fail_reason values as HouseInfoSpider.errback_httpbin
+TIMEOUT_ERROR = 'TimeoutError'
+HTTP_ERROR = 'HttpError'
+DNS_LOOKUP_ERROR = 'DNSLookupError'
+OTHER_ERROR = 'Other'
+# The page was crawled but HouseInfoSpiderPipeline failed to write it
+WRITE_ERROR = 'WriteError'
+# fail_reason of the deferred pages before they had their own table
+DEFERRED = 'Deferred'
+
+DEFAULT_RETRY_POLICIES = {
+    TIMEOUT_ERROR: {'max_retries': 3, 'base_delay': 30},
+    HTTP_ERROR: {'max_retries': 2, 'base_delay': 60},
+    DNS_LOOKUP_ERROR: {'max_retries': 5, 'base_delay': 10},
+    OTHER_ERROR: {'max_retries': 1, 'base_delay': 30},
+}
+
+
+class RetryPolicy:
+    def __init__(self, max_retries, base_delay, max_delay=900):
+        """
+        :param max_retries: Retries after the first attempt
+        :param base_delay: Seconds before the first retry, doubled for every following one
+        :param max_delay: Upper bound of a single delay
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempts):
+        # Jitter keeps retries of a burst of failures from hitting the site at the same time.
+        return min(self.base_delay * 2 ** attempts, self.max_delay) * random.uniform(0.8, 1.2)
+
+
+def get_retry_policies(policy_settings):
+    return {fail_reason: RetryPolicy(**policy) for fail_reason, policy in
+            {**DEFAULT_RETRY_POLICIES, **policy_settings}.items()}
+
+
+class DeadLetterStore:
+    def __init__(self, path, category):
+        self.category = category
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Autocommit, spiders of other categories may share the file.
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                category TEXT,
+                house_id TEXT,
+                fail_reason TEXT,
+                attempts INTEGER,
+                first_failed_date TEXT,
+                last_failed_date TEXT,
+                num_failed_days INTEGER,
+                PRIMARY KEY (category, house_id)
+            )""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS deferred_houses (
+                category TEXT,
+                house_id TEXT,
+                deferred_date TEXT,
+                PRIMARY KEY (category, house_id)
+            )""")
+        self.db.execute(f"""
+            INSERT OR IGNORE INTO deferred_houses
+            SELECT category, house_id, last_failed_date FROM dead_letters WHERE fail_reason='{DEFERRED}'""")
+        self.db.execute(f"DELETE FROM dead_letters WHERE fail_reason='{DEFERRED}'")
+
+    def load_house_ids(self, max_failed_days):
+        """
+        :return: The house_ids to carry over into today's crawl
+        """
+        rows = self.db.execute("""
+            SELECT house_id FROM dead_letters WHERE category=? AND num_failed_days<?
+            UNION SELECT house_id FROM deferred_houses WHERE category=?""",
+                               (self.category, max_failed_days, self.category)).fetchall()
+        return [x[0] for x in rows]
+
+    def add(self, house_id, fail_reason, attempts, crawl_date):
+        # A deferred house that is crawled and fails is a failure from now on.
+        self.db.execute('DELETE FROM deferred_houses WHERE category=? AND house_id=?', (self.category, house_id))
+        self.db.execute("""
+            INSERT INTO dead_letters VALUES (?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (category, house_id) DO UPDATE SET
+                fail_reason=excluded.fail_reason,
+                attempts=excluded.attempts,
+                num_failed_days=num_failed_days + (last_failed_date != excluded.last_failed_date),
+                last_failed_date=excluded.last_failed_date""",
+                        (self.category, house_id, fail_reason, attempts, crawl_date, crawl_date))
+
+    def defer(self, house_id, crawl_date):
+        """
+        Carry house_id over to the next day without counting a failed day.
+        """
+        self.db.execute('REPLACE INTO deferred_houses VALUES (?, ?, ?)', (self.category, house_id, crawl_date))
+
+    def remove(self, house_id):
+        self.db.execute('DELETE FROM dead_letters WHERE category=? AND house_id=?', (self.category, house_id))
+        self.db.execute('DELETE FROM deferred_houses WHERE category=? AND house_id=?', (self.category, house_id))
+
+    def close(self):
+        self.db.close()
@@ -19,6 +19,9 @@ NEWSPIDER_MODULE = 'house_info_spider.spiders'
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
+# Site to crawl, set to e.g. http://localhost:8080 to crawl mock_homes/server.py instead
+LIFULL_BASE_URL = 'https://www.homes.co.jp'
+
 LOG_FILE = 'log/log.txt'
 LOG_FILE_APPEND = False
 LOG_LEVEL = 'INFO'
@@ -57,6 +60,11 @@ LOG_LEVEL = 'INFO'
 #DOWNLOADER_MIDDLEWARES = {
 #    'house_info_spider.middlewares.HouseInfoSpiderDownloaderMiddleware': 543,
 #}
+# Runs after HttpCompressionMiddleware (590) has decompressed the body it hashes.
+DOWNLOADER_MIDDLEWARES = {
+    'house_info_spider.middlewares.CrawlBudgetMiddleware': 50,
+    'house_info_spider.middlewares.RevalidationCacheMiddleware': 580,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -66,9 +74,11 @@ LOG_LEVEL = 'INFO'
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'house_info_spider.pipelines.HouseInfoSpiderPipeline': 300,
-#}
+ITEM_PIPELINES = {
+    'house_info_spider.pipelines.HouseInfoSpiderPipeline': 300,
+}
+# Queued write-behind items are dropped from the feed export, log them at DEBUG only.
+LOG_FORMATTER = 'house_info_spider.pipelines.HouseInfoLogFormatter'
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -96,8 +106,95 @@ REQUEST_FINGERPRINTER_IMPLEMENTATION = '2.7'
 TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
 
 
-# AUTOTHROTTLE Settings
-AUTOTHROTTLE_ENABLED = True
+# AUTOTHROTTLE Settings, replaced by ConcurrencyAutoTuner below
+AUTOTHROTTLE_ENABLED = False
 AUTOTHROTTLE_TARGET_CONCURRENCY = 8.0
 DOWNLOAD_DELAY = 0.1
 
+
+# Size of the MySQL connection pool shared by the spider and its write-behind pipeline.
+# Credentials come from $HOUSPIDER_DB_CONFIG / $HOUSPIDER_DB_* (see db/utils.py).
+DB_POOL_SIZE = 4
+
+# Write-behind MySQL pipeline settings, see HouseInfoSpiderPipeline.
+DB_WRITE_BATCH_SIZE = 50
+DB_WRITE_QUEUE_SIZE = 1000
+DB_WRITE_FLUSH_INTERVAL = 2.0
+DB_WRITER_THREADS = 2
+
+# Number of worker processes running MansionInfo/RentInfo extraction.
+# 0 extracts inline on the reactor thread. Requires the asyncio reactor above.
+EXTRACT_PROCESSES = 0
+
+# Where detail pages are saved: 'file' writes output/raw_html/{house_id}.html as before,
+# 'segment' appends gzip records to date-partitioned segment files, see house_info_processor/raw_page_store.py.
+RAW_PAGE_STORE = 'segment'
+RAW_PAGE_STORE_DIR = 'output/raw_pages'
+
+# Skip extraction and info writes for pages whose detail sections hash the same as last crawl.
+SKIP_UNCHANGED_PAGES = True
+
+# Conditional requests with validators remembered from the last crawl, see utils/http_cache.py.
+REVALIDATION_CACHE_ENABLED = True
+REVALIDATION_CACHE_PATH = 'output/revalidation_cache.sqlite'
+# Unchanged detail pages are skipped, their bodies are not needed.
+REVALIDATION_CACHE_STORE_BODY = False
+# Save the validators of a page only once HouseInfoSpiderPipeline has written it.
+REVALIDATION_CACHE_SAVE_ON_COMMIT = True
+
+# Failed pages are retried within the crawl with an exponential backoff per failure class,
+# {fail_reason: {'max_retries': n, 'base_delay': seconds}}, see house_info_spider/retry.py.
+# Scrapy's own RetryMiddleware would retry them first without any backoff, so it is turned off.
+RETRY_ENABLED = False
+RETRY_SCHEDULER_POLICIES = {
+    'TimeoutError': {'max_retries': 3, 'base_delay': 30},
+    'HttpError': {'max_retries': 2, 'base_delay': 60},
+    'DNSLookupError': {'max_retries': 5, 'base_delay': 10},
+    'Other': {'max_retries': 1, 'base_delay': 30},
+}
+# Pages still failing are kept here and crawled again on the next days, up to DEAD_LETTER_MAX_DAYS.
+DEAD_LETTER_PATH = 'output/dead_letters.sqlite'
+DEAD_LETTER_MAX_DAYS = 3
+
+# Seconds after which requests with a priority below CRAWL_BUDGET_MIN_PRIORITY are deferred to the
+# next day, 0 to crawl everything. 10 is CRAWL_PRIORITY_MISSING, so only routine refreshes are deferred.
+CRAWL_TIME_BUDGET = 0
+CRAWL_BUDGET_MIN_PRIORITY = 10
+
+# Record queued/completed work in output/checkpoints/YYYY-MM-DD/, so a crawl interrupted
+# on the same day resumes where it stopped, see utils/crawl_checkpoint.py.
+CRAWL_CHECKPOINT_ENABLED = True
+CRAWL_CHECKPOINT_DIR = 'output/checkpoints'
+
+# Concurrency and delay per host are tuned from latency and errors by utils/autotune.py,
+# starting from CONCURRENT_REQUESTS_PER_DOMAIN/DOWNLOAD_DELAY or what the last crawl of the category chose.
+EXTENSIONS = {
+    'utils.autotune.ConcurrencyAutoTuner': 500,
+    'utils.metrics.MetricsExtension': 510,
+    'utils.profiling.ProfilingExtension': 520,
+}
+AUTOTUNE_ENABLED = True
+CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS_PER_DOMAIN = 8
+AUTOTUNE_MIN_CONCURRENCY = 1
+AUTOTUNE_MAX_CONCURRENCY = 16
+# Never tune the delay below DOWNLOAD_DELAY
+AUTOTUNE_MIN_DELAY = DOWNLOAD_DELAY
+AUTOTUNE_TARGET_LATENCY = 2.0
+AUTOTUNE_MAX_ERROR_RATE = 0.05
+AUTOTUNE_INTERVAL = 30
+AUTOTUNE_STATE_PATH = 'output/autotune_state.json'
+
+# Prometheus metrics of the crawl, see utils/metrics.py. Served on METRICS_PORT (0: not served) and/or
+# written to METRICS_TEXTFILE_PATH / pushed to METRICS_PUSHGATEWAY_URL every METRICS_INTERVAL seconds.
+METRICS_ENABLED = False
+METRICS_PORT = 0
+METRICS_TEXTFILE_PATH = None
+METRICS_PUSHGATEWAY_URL = None
+METRICS_INTERVAL = 15
+
+# Sample the crawl into output/YYYY-MM-DD/profiles/<spider>-<category>.collapsed for flamegraphs,
+# see utils/profiling.py. PROFILE_INTERVAL is the seconds between two stack samples.
+PROFILE_ENABLED = False
+PROFILE_DIR = 'output'
+PROFILE_INTERVAL = 0.01
@@ -29,8 +29,11 @@ scrapy crawl house_info -O output/2022-11-15/error_house_chintai_id2.csv \
 -a crawl_date=2022-11-15 -a category=chintai -a city=tokyo \
 --logfile log/2022-11-15-chintai-log2.txt
 """
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import scrapy
 from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 import pandas as pd
 import logging
 import os
@@ -42,156 +45,347 @@ from twisted.internet.error import TimeoutError, TCPTimedOutError
 
 sys.path.append('../')
 
-from house_info_processor.main import process_mansion_info, process_rent_info, process_unavailable_house
+from house_info_processor import extractor
+from house_info_processor import raw_page_store
+from house_info_processor.main import load_page_fingerprints
+from house_info_spider.items import HouseInfoWriteItem
+from house_info_spider.middlewares import CrawlDeferred
+from house_info_spider import retry
 import db.utils as dbutil
+import db.pool as dbpool
 from utils import utils
 from utils import constant
+from utils import http_cache
+from utils import metrics
+from utils.crawl_checkpoint import CrawlCheckpoint
 
 
 class HouseInfoSpider(scrapy.Spider):
     name = 'house_info'
-    # Allow handling 404 requests
-    handle_httpstatus_list = [404]
+    # Allow handling 404 requests, and 304 from RevalidationCacheMiddleware
+    handle_httpstatus_list = [404, 304]
     user_agent = 'Mozilla/5.0 (X11; Linux x86_64; rv:48.0) Gecko/20100101 Firefox/48.0'
 
-    def __init__(self, i, m, crawl_date, category, city, **kw):
+    def __init__(self, i, m, crawl_date, category, city, link_stream=None, **kw):
         self.house_link_file_path = i
         self.mode = m
         self.crawl_date = crawl_date
         self.category = category
         self.city = city
+        # house_list_processor.stream.HouseLinkStream feeding house_ids when m=stream
+        self.link_stream = link_stream
         super(HouseInfoSpider, self).__init__(**kw)
-        # Init database connection
-        self.cnx = None
-        self.cur = None
+        # Init database connection pool
+        self.db_pool = None
+        # Optional pool of extractor worker processes, see EXTRACT_PROCESSES setting.
+        self.extract_executor = None
+        self.raw_page_store = None
+        # {house_id: page_fingerprint} from the last crawl, see SKIP_UNCHANGED_PAGES setting.
+        self.page_fingerprints = {}
         self.new_unavailable_house_num = 0
+        self.changed_page_num = 0
+        # {fail_reason: RetryPolicy}, see RETRY_SCHEDULER_POLICIES setting.
+        self.retry_policies = {}
+        self.dead_letters = None
+        # house_ids carried over from the dead-letter store, removed from it once crawled.
+        self.dead_letter_house_ids = set()
+        # Retries waiting for their backoff delay, {request: DelayedCall}
+        self.pending_retries = {}
+        # Queued and completed house_ids of today's crawl, see CRAWL_CHECKPOINT_ENABLED setting.
+        self.crawl_checkpoint = None
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super(HouseInfoSpider, cls).from_crawler(crawler, *args, **kwargs)
         crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
         return spider
 
     def spider_opened(self, spider):
         # Connect to the database
-        self.cnx = dbutil.get_mysql_cnx()
-        self.cur = self.cnx.cursor(buffered=True)
+        self.db_pool = dbpool.get_session_pool(pool_size=self.settings.getint('DB_POOL_SIZE', 4))
+
+        # Also needed to trust revalidated pages, see parse_house_info.
+        if self.settings.getbool('SKIP_UNCHANGED_PAGES', False) or \
+                self.settings.getbool('REVALIDATION_CACHE_ENABLED', False):
+            with self.db_pool.session() as (cnx, cur):
+                self.page_fingerprints = load_page_fingerprints(self.category, cur)
+            logging.info(f'{len(self.page_fingerprints)} page fingerprints loaded.')
+
+        self.raw_page_store = raw_page_store.get_raw_page_store(
+            self.settings.get('RAW_PAGE_STORE', raw_page_store.FLAT_FILE),
+            self.settings.get('RAW_PAGE_STORE_DIR', 'output/raw_html'),
+            self.crawl_date,
+            self.category)
+
+        self.retry_policies = retry.get_retry_policies(self.settings.getdict('RETRY_SCHEDULER_POLICIES'))
+        self.dead_letters = retry.DeadLetterStore(self.settings.get('DEAD_LETTER_PATH', 'output/dead_letters.sqlite'),
+                                                  self.category)
+
+        if self.settings.getbool('CRAWL_CHECKPOINT_ENABLED', False):
+            self.crawl_checkpoint = CrawlCheckpoint(os.path.join(
+                self.settings.get('CRAWL_CHECKPOINT_DIR', 'output/checkpoints'), self.crawl_date,
+                f'{self.name}-{self.category}-{self.mode}.jsonl'))
+
+        if self.link_stream is not None:
+            self.link_stream.subscribe(self.schedule_house_ids)
+
+        num_extract_processes = self.settings.getint('EXTRACT_PROCESSES', 0)
+        if num_extract_processes > 0:
+            self.extract_executor = ProcessPoolExecutor(max_workers=num_extract_processes)
+            logging.info(f'{num_extract_processes} extractor processes started.')
 
     def spider_closed(self, spider):
         logging.info(f'Total {self.new_unavailable_house_num} houses become unavailable today.')
-        stats_df = pd.read_sql(f"""SELECT new_unavailable_house_num 
-                    FROM lifull_crawler_stats 
-                    WHERE crawl_date = '{self.crawl_date}'
-                    AND category = '{self.category}'
-                    AND city = '{self.city}'
-                    """, self.cnx)
-        if len(stats_df) != 1:
-            logging.error(f'lifull_crawler_stats fail to get old old_new_unavailable_house_num for {self.crawl_date} {self.category} {self.city}')
-            old_new_unavailable_house_num = 0
-        else:
-            old_new_unavailable_house_num = int(stats_df.loc[0].new_unavailable_house_num)
-
-        new_unavailable_house_num = old_new_unavailable_house_num + self.new_unavailable_house_num
-        insert_data = {
-            'crawl_date': self.crawl_date,
-            'category': self.category,
-            'city': self.city,
-            'new_unavailable_house_num': new_unavailable_house_num
-        }
-        dbutil.insert_table(val_map=insert_data,
-                            table_name='lifull_crawler_stats',
-                            cur=self.cur,
-                            on_duplicate_update_val_map=insert_data)
-        self.cnx.commit()
-        logging.info(f'{new_unavailable_house_num} new_unavailable_house_num updated in lifull_crawler_stats for {self.crawl_date} {self.category} {self.city}')
-
-        self.cnx.close()
+        logging.info(f'Total {self.changed_page_num} pages changed since the last crawl.')
+        with self.db_pool.session() as (cnx, cur):
+            stats_df = pd.read_sql(f"""SELECT new_unavailable_house_num, changed_page_num
+                        FROM lifull_crawler_stats 
+                        WHERE crawl_date = '{self.crawl_date}'
+                        AND category = '{self.category}'
+                        AND city = '{self.city}'
+                        """, cnx)
+            if len(stats_df) != 1:
+                logging.error(f'lifull_crawler_stats fail to get old old_new_unavailable_house_num for {self.crawl_date} {self.category} {self.city}')
+                old_new_unavailable_house_num = 0
+                old_changed_page_num = 0
+            else:
+                old_new_unavailable_house_num = int(stats_df.loc[0].new_unavailable_house_num)
+                old_changed_page_num = int(stats_df.loc[0].changed_page_num)
+
+            new_unavailable_house_num = old_new_unavailable_house_num + self.new_unavailable_house_num
+            insert_data = {
+                'crawl_date': self.crawl_date,
+                'category': self.category,
+                'city': self.city,
+                'new_unavailable_house_num': new_unavailable_house_num,
+                'changed_page_num': old_changed_page_num + self.changed_page_num
+            }
+            dbutil.insert_table(val_map=insert_data,
+                                table_name='lifull_crawler_stats',
+                                cur=cur,
+                                on_duplicate_update_val_map=insert_data)
+            cnx.commit()
+            logging.info(f'{new_unavailable_house_num} new_unavailable_house_num updated in lifull_crawler_stats for {self.crawl_date} {self.category} {self.city}')
+
+        dbpool.close_session_pool()
+
+        # Retries still waiting when the crawl stops are carried over to the next day.
+        for request, delayed_call in self.pending_retries.items():
+            delayed_call.cancel()
+            self.dead_letters.add(request.cb_kwargs['house_id'], request.meta.get('retry_fail_reason', retry.OTHER_ERROR),
+                                  request.meta.get('retry_attempts', 0), self.crawl_date)
+            self.mark_completed(request.cb_kwargs['house_id'])
+        self.dead_letters.close()
+        if self.crawl_checkpoint is not None:
+            self.crawl_checkpoint.close()
+
+        if self.extract_executor is not None:
+            self.extract_executor.shutdown()
+        self.raw_page_store.close()
 
     def start_requests(self):
-        try:
-            df = pd.read_csv(self.house_link_file_path)
-        except pd.errors.EmptyDataError:
-            df = pd.DataFrame()
-
-        if self.mode == 'original':
-            # Always retry visiting url failed from yesterday
-            failed_url_yesterday_path = f'output/{utils.get_date_str_yesterday()}/error_house{("_" + self.category) if self.category != constant.MANSION_CHUKO else ""}_id2.csv '
-            if os.path.exists(failed_url_yesterday_path):
-                failed_url_yesterday_df = pd.read_csv(failed_url_yesterday_path)
-                df = pd.concat([failed_url_yesterday_df[['house_id']], df])
-
-        if self.mode == 'error':
-            # The error_house_id csv may contain duplicates
-            df = df.drop_duplicates(subset=['house_id'])
-        logging.info(f'Total {len(df)} houses will be scrawled.')
-
-        for index, row in df.iterrows():
-            if self.category == constant.CHINTAI:
-                yield scrapy.Request(url=utils.get_lifull_chintai_url_from_house_id(row.house_id), callback=self.parse_house_info,
-                                     errback=self.errback_httpbin,
-                                     cb_kwargs={'house_id': str(row.house_id)})
-            elif self.category == constant.MANSION_CHUKO:
-                yield scrapy.Request(url=utils.get_lifull_mansion_url_from_house_id(row.house_id), callback=self.parse_house_info,
-                                     errback=self.errback_httpbin,
-                                     cb_kwargs={'house_id': str(row.house_id)})
-            elif self.category == constant.OTHER:
-                yield scrapy.Request(url=utils.get_lifull_other_url_from_house_id(row.house_id), callback=self.parse_house_info,
-                                     errback=self.errback_httpbin,
-                                     cb_kwargs={'house_id': str(row.house_id)})
-
-    def parse_house_info(self, response, house_id):
+        if self.mode == 'stream':
+            df = pd.DataFrame(columns=['house_id', 'priority'])
+        else:
+            try:
+                df = pd.read_csv(self.house_link_file_path)
+            except pd.errors.EmptyDataError:
+                df = pd.DataFrame()
+
+        if self.mode in ('original', 'stream'):
+            # Always retry visiting url failed in the previous days
+            self.dead_letter_house_ids = set(self.dead_letters.load_house_ids(
+                self.settings.getint('DEAD_LETTER_MAX_DAYS', 3)))
+            logging.info(f'{len(self.dead_letter_house_ids)} houses carried over from the dead-letter store.')
+            df = pd.concat([pd.DataFrame({'house_id': list(self.dead_letter_house_ids),
+                                          'priority': constant.CRAWL_PRIORITY_REFRESH}), df])
+
+        # The error_house_id csv and the carried over houses may contain duplicates, keep the highest priority
+        house_priorities = {}
+        if len(df) > 0:
+            priorities = df['priority'].fillna(constant.CRAWL_PRIORITY_REFRESH) if 'priority' in df.columns \
+                else [constant.CRAWL_PRIORITY_REFRESH] * len(df)
+            for house_id, priority in zip(df['house_id'], priorities):
+                house_priorities[str(house_id)] = max(int(priority), house_priorities.get(str(house_id), int(priority)))
+
+        if self.crawl_checkpoint is not None and self.crawl_checkpoint.is_resumed():
+            # Resume an interrupted crawl: add what it had queued (e.g. streamed houses), skip what it completed.
+            for house_id, priority in self.crawl_checkpoint.get_pending().items():
+                house_priorities[house_id] = max(priority, house_priorities.get(house_id, priority))
+            num_house_ids = len(house_priorities)
+            house_priorities = {k: v for k, v in house_priorities.items() if not self.crawl_checkpoint.is_completed(k)}
+            logging.info(f'Crawl resumed, {num_house_ids - len(house_priorities)} houses already completed today.')
+        if self.crawl_checkpoint is not None:
+            self.crawl_checkpoint.queue_many(house_priorities)
+        logging.info(f'Total {len(house_priorities)} houses will be scrawled.')
+
+        # Start requests are only pulled into the scheduler as it has room, so hand them over
+        # highest priority first instead of relying on the scheduler queue alone.
+        for house_id, priority in sorted(house_priorities.items(), key=lambda x: -x[1]):
+            yield self.get_house_info_request(house_id, priority)
+
+    def get_house_info_request(self, house_id, priority=constant.CRAWL_PRIORITY_REFRESH):
+        base_url = self.settings.get('LIFULL_BASE_URL', utils.LIFULL_BASE_URL)
+        if self.category == constant.CHINTAI:
+            url = utils.get_lifull_chintai_url_from_house_id(house_id, base_url)
+        elif self.category == constant.OTHER:
+            url = utils.get_lifull_other_url_from_house_id(house_id, base_url)
+        else:
+            url = utils.get_lifull_mansion_url_from_house_id(house_id, base_url)
+        return scrapy.Request(url=url, callback=self.parse_house_info,
+                              errback=self.errback_httpbin,
+                              priority=priority,
+                              cb_kwargs={'house_id': house_id})
+
+    def schedule_house_ids(self, house_priorities):
+        """
+        HouseLinkStream subscriber: crawl the house_ids handed over while the list crawl is running.
+        """
+        if self.crawl_checkpoint is not None:
+            house_priorities = {k: v for k, v in house_priorities.items() if not self.crawl_checkpoint.is_completed(k)}
+            self.crawl_checkpoint.queue_many(house_priorities)
+        for house_id, priority in house_priorities.items():
+            self.crawler.engine.crawl(self.get_house_info_request(house_id, priority))
+        logging.info(f'{len(house_priorities)} streamed houses scheduled.')
+
+    def mark_completed(self, *house_ids):
+        """
+        Record house_ids that need no more work today. Written pages are recorded by
+        HouseInfoSpiderPipeline once they are committed.
+        """
+        if self.crawl_checkpoint is not None:
+            self.crawl_checkpoint.complete_many({x: None for x in house_ids})
+
+    def spider_idle(self, spider):
+        # Keep waiting for house links until the list crawl and its processing are over.
+        if self.link_stream is not None and not self.link_stream.closed:
+            raise DontCloseSpider
+        # And for the retries still in backoff.
+        if len(self.pending_retries) > 0:
+            raise DontCloseSpider
+
+    def schedule_retry(self, request, fail_reason, attempts, policy):
+        from twisted.internet import reactor
+        delay = policy.get_delay(attempts)
+        retry_request = request.replace(dont_filter=True,
+                                        meta={**request.meta, 'retry_attempts': attempts + 1,
+                                              'retry_fail_reason': fail_reason})
+
+        def crawl_retry_request():
+            del self.pending_retries[retry_request]
+            self.crawler.engine.crawl(retry_request)
+
+        self.pending_retries[retry_request] = reactor.callLater(delay, crawl_retry_request)
+        self.crawler.stats.inc_value(f'retry_scheduler/{fail_reason}/retried', spider=self)
+        logging.info(f'{request.cb_kwargs["house_id"]} will be retried in {delay:.0f}s after {fail_reason} '
+                     f'({attempts + 1}/{policy.max_retries}).')
+
+    async def extract_house_info(self, house_id, response):
+        """
+        Build the MansionInfo/RentInfo inline, or in an extractor process when EXTRACT_PROCESSES > 0
+        so that parsing does not compete with downloads on the reactor thread.
+        """
+        with metrics.time_extraction(f'{self.category}_detail'):
+            if self.extract_executor is None:
+                return extractor.build_house_info(house_id, response, self.category)
+
+            future = self.extract_executor.submit(extractor.extract_house_info_fields,
+                                                  house_id, response.body, response.encoding, self.category)
+            fields = await asyncio.wrap_future(future)
+            return extractor.house_info_from_fields(fields, self.category)
+
+    def save_raw_page(self, house_id, response):
+        # The flat file store shares one directory across categories, so it only keeps sale pages as before.
+        if self.category == constant.CHINTAI and isinstance(self.raw_page_store, raw_page_store.FlatFileRawPageStore):
+            return
+        self.raw_page_store.put(house_id, response.body)
+        logging.info(f'{house_id} has been saved locally.')
+
+    def get_write_item(self, response, house_id, is_available, house_info=None, page_fingerprint=None):
+        return HouseInfoWriteItem(house_id=house_id, category=self.category, is_available=is_available,
+                                  house_info=house_info, page_fingerprint=page_fingerprint,
+                                  revalidation_validators=http_cache.get_pending_validators(response))
+
+    async def parse_house_info(self, response, house_id):
+        """
+        Extract the page and hand it to HouseInfoSpiderPipeline, which writes it to MySQL in the background.
+        """
         logging.info(f'Start crawling {house_id}')
+        if house_id in self.dead_letter_house_ids:
+            self.dead_letters.remove(house_id)
+            self.dead_letter_house_ids.discard(house_id)
+
+        # The validators of a page are saved once it is written, but only trust them for a house whose
+        # page is known to be written: the cache may predate a write that never committed.
+        is_unchanged = http_cache.is_unchanged(response) and house_id in self.page_fingerprints
+        if response.status == 304:
+            if not is_unchanged:
+                if response.meta.get('dont_revalidate'):
+                    # Already downloaded again without validators, crawl it on the next day instead of looping.
+                    logging.error(f'{house_id} is not modified although no validators were sent: {response.url}')
+                    self.defer_house(house_id)
+                    return []
+                logging.info(f'{house_id} is not modified but has no written page, downloading it again.')
+                return [response.request.replace(dont_filter=True, meta={**response.meta, 'dont_revalidate': True})]
+            logging.info(f'{house_id} is not modified since the last crawl.')
+            return [self.get_write_item(response, house_id, is_available=True)]
+
         if response.status == 404 or response.css('.mod-expiredInformation').get() is not None or \
                 response.css('.mod-bukkenNotFound').get() is not None or \
                 response.css('.mod-expiredMessage').get() is not None:
-            row_count = process_unavailable_house(house_id, self.category, self.cnx, self.cur)
-            if row_count > 0:
-                self.new_unavailable_house_num += 1
-                logging.info(f'{house_id} has been marked as unavailable.')
-            else:
-                logging.error(f'{house_id} fail to be marked as unavailable.')
-            return
+            return [self.get_write_item(response, house_id, is_available=False)]
+
+        # Checked after the expired checks, an expired page stays byte-identical from one crawl to the next.
+        if is_unchanged:
+            logging.info(f'{house_id} is not modified since the last crawl.')
+            return [self.get_write_item(response, house_id, is_available=True)]
 
         if self.category == constant.CHINTAI:
             if len(response.css('.mod-detailTopRent')) != 1:
                 logging.error(f'House is in wrong format: {response.url}')
-                return
-
-            # Mark it as available in `house_link` table;
-            dbutil.update_table(val_map={
-                'is_available': 1,
-                'unavailable_date': None
-            },
-                where_clause=f'house_id="{house_id}"',
-                table_name='lifull_rent_link',
-                cur=self.cur)
-            self.cnx.commit()
-
-            process_rent_info(house_id, response, self.cnx, self.cur)
+                self.mark_completed(house_id)
+                return []
         else:
             if len(response.css('.mod-detailTopSale')) != 1:
                 logging.error(f'House is in wrong format: {response.url}')
-                return
-
-            with open(f'output/raw_html/{house_id}.html', 'wb') as html_file:
-                html_file.write(response.body)
-            logging.info(f'{house_id} has been saved locally.')
-
-            # Mark it as available in `house_link` table;
-            dbutil.update_table(val_map={
-                'is_available': 1,
-                'unavailable_date': None
-            },
-                where_clause=f'house_id={house_id}',
-                table_name='lifull_house_link',
-                cur=self.cur)
-            self.cnx.commit()
-
-            process_mansion_info(house_id, response, self.category, self.cnx, self.cur)
+                self.mark_completed(house_id)
+                return []
+
+        page_fingerprint = extractor.get_page_fingerprint(response, self.category)
+        if self.page_fingerprints.get(house_id) == page_fingerprint:
+            logging.info(f'{house_id} is unchanged since the last crawl.')
+            return [self.get_write_item(response, house_id, is_available=True)]
+        self.changed_page_num += 1
+
+        self.save_raw_page(house_id, response)
+
+        house_info = await self.extract_house_info(house_id, response)
         logging.info(f'Finish processing {house_id}')
-    
+        return [self.get_write_item(response, house_id, is_available=True, house_info=house_info,
+                                    page_fingerprint=page_fingerprint)]
+
+    def defer_house(self, house_id):
+        """
+        Crawl house_id on the next day instead, used by CrawlBudgetMiddleware.
+        """
+        self.dead_letters.defer(house_id, self.crawl_date)
+        self.mark_completed(house_id)
+
+    def dead_letter_unwritten_houses(self, house_ids):
+        """
+        Crawl house_ids again on the next day, used by HouseInfoSpiderPipeline when their batch cannot be written.
+        """
+        for house_id in house_ids:
+            self.dead_letters.add(house_id, retry.WRITE_ERROR, 0, self.crawl_date)
+        self.mark_completed(*house_ids)
+        self.crawler.stats.inc_value(f'retry_scheduler/{retry.WRITE_ERROR}/dead_letter', len(house_ids), spider=self)
+
     def errback_httpbin(self, failure):
+        if failure.check(CrawlDeferred):
+            return
+
         # log all failures
         logging.error(repr(failure))
         house_id = failure.request.cb_kwargs['house_id']
@@ -218,6 +412,16 @@ class HouseInfoSpider(scrapy.Spider):
         else:
             fail_reason = 'Other'
 
+        # Retry inside this crawl while the policy of the failure class allows it.
+        attempts = failure.request.meta.get('retry_attempts', 0)
+        policy = self.retry_policies.get(fail_reason)
+        if policy is not None and attempts < policy.max_retries:
+            self.schedule_retry(failure.request, fail_reason, attempts, policy)
+            return
+
+        self.dead_letters.add(house_id, fail_reason, attempts, self.crawl_date)
+        self.mark_completed(house_id)
+        self.crawler.stats.inc_value(f'retry_scheduler/{fail_reason}/dead_letter', spider=self)
         yield {'house_id': house_id,
                'fail_reason': fail_reason}
         
\ No newline at end of file
@@ -23,100 +23,93 @@ sys.path.append('../')
 import db.utils as dbutil
 from utils import utils
 from utils import constant
+from utils import metrics
+from house_list_processor import staging
 
 
 def get_link_table_name_from_category(category):
     return 'lifull_rent_link' if category == constant.CHINTAI else 'lifull_house_link'
 
 
-def handle_possible_new_house_df(df, category, cnx):
+def get_link_update_data(row, category):
     """
-    If the house exists, update it as is_available;
-    If not, add it to `house_link` table.
+    Build the `xxx_link` columns to write for a row of the merged new/old house dataframe.
+    """
+    if category == constant.CHINTAI:
+        return {
+            'is_pr_item': row.is_pr_item_new,
+            'listing_house_name': row.listing_house_name,
+            'listing_house_rent': row.listing_house_rent_new,
+            'listing_house_manage_fee': row.listing_house_manage_fee_new,
+            'city': row.city,
+            'is_available': 1,
+            'unavailable_date': None
+        }
+    return {
+        'is_pr_item': row.is_pr_item_new,
+        'listing_house_name': row.listing_house_name,
+        'listing_house_price': row.listing_house_price_new,
+        'sale_category': row.sale_category,
+        'city': row.city,
+        'is_available': 1,
+        'unavailable_date': None
+    }
+
+
+def get_link_key_columns_from_category(category):
+    return ('house_id',) if category == constant.CHINTAI else ('house_id', 'sale_category')
+
+
+def upsert_house_df(df, category, cnx, chunk_size):
+    """
+    Upsert every row of df into `house_link` table in chunks.
+    :return: A list of (inserted_rowcount, updated_rowcount) per chunk
     """
     cur = cnx.cursor(buffered=True)
     date_today_str = utils.get_date_str_today()
-    success_added_rowcount = 0
-    success_updated_rowcount = 0
-    table_name = get_link_table_name_from_category(category)
-    for index, row in df.iterrows():
-        if category == constant.CHINTAI:
-            update_data = {
-                'is_pr_item': row.is_pr_item_new,
-                'listing_house_name': row.listing_house_name,
-                'listing_house_rent': row.listing_house_rent_new,
-                'listing_house_manage_fee': row.listing_house_manage_fee_new,
-                'city': row.city,
-                'is_available': 1,
-                'unavailable_date': None
-            }
-        else:
-            update_data = {
-                'is_pr_item': row.is_pr_item_new,
-                'listing_house_name': row.listing_house_name,
-                'listing_house_price': row.listing_house_price_new,
-                'sale_category': row.sale_category,
-                'city': row.city,
-                'is_available': 1,
-                'unavailable_date': None
-            }
-        rowcount = dbutil.insert_table(val_map={
+    rows = []
+    update_columns = None
+    for row in df.itertuples(index=False):
+        update_data = get_link_update_data(row, category)
+        update_columns = list(update_data.keys())
+        rows.append({
             'house_id': row.house_id,
             'first_available_date': date_today_str,
             **update_data
-        },
-            table_name=table_name,
-            cur=cur,
-            on_duplicate_update_val_map=update_data)
-        if rowcount == 1:
-            success_added_rowcount += 1
-        elif rowcount == 2:
-            success_updated_rowcount += 1
-
-        logging.info(f'handle_possible_new_house_df: rowcount={rowcount}, house_id:{row.house_id}')
-        # Commit the changes
-        cnx.commit()
+        })
+    return dbutil.bulk_upsert(rows=rows,
+                              table_name=get_link_table_name_from_category(category),
+                              update_columns=update_columns,
+                              cur=cur,
+                              chunk_size=chunk_size,
+                              key_columns=get_link_key_columns_from_category(category),
+                              cnx=cnx)
+
+
+def handle_possible_new_house_df(df, category, cnx, chunk_size=1000):
+    """
+    If the house exists, update it as is_available;
+    If not, add it to `house_link` table.
+    """
+    chunk_rowcounts = upsert_house_df(df, category, cnx, chunk_size)
+    success_added_rowcount = sum(x[0] for x in chunk_rowcounts)
+    success_updated_rowcount = sum(x[1] for x in chunk_rowcounts)
+    for idx, (added_rowcount, updated_rowcount) in enumerate(chunk_rowcounts):
+        logging.info(f'handle_possible_new_house_df: chunk {idx} added={added_rowcount}, updated={updated_rowcount}')
 
     return success_added_rowcount, success_updated_rowcount
 
 
-def handle_updated_house_df(df, category, cnx):
+def handle_updated_house_df(df, category, cnx, chunk_size=1000):
     """
     Update the house in `house_link` table.
     """
-    cur = cnx.cursor(buffered=True)
-    success_updated_rowcount = 0
-    table_name = get_link_table_name_from_category(category)
-    for index, row in df.iterrows():
-        if category == constant.CHINTAI:
-            update_data = {
-                'is_pr_item': row.is_pr_item_new,
-                'listing_house_name': row.listing_house_name,
-                'listing_house_rent': row.listing_house_rent_new,
-                'listing_house_manage_fee': row.listing_house_manage_fee_new,
-                'city': row.city,
-                'is_available': 1,
-                'unavailable_date': None
-            }
-        else:
-            update_data = {
-                'is_pr_item': row.is_pr_item_new,
-                'listing_house_name': row.listing_house_name,
-                'listing_house_price': row.listing_house_price_new,
-                'sale_category': row.sale_category,
-                'city': row.city,
-                'is_available': 1,
-                'unavailable_date': None
-            }
-        rowcount = dbutil.update_table(val_map=update_data,
-                                       where_clause=f'house_id="{row.house_id}"',
-                                       table_name=table_name,
-                                       cur=cur)
-        success_updated_rowcount += rowcount
-        logging.info(f'handle_updated_house_df: rowcount={rowcount}, house_id:{row.house_id}')
-
-        # Commit the changes
-        cnx.commit()
+    chunk_rowcounts = upsert_house_df(df, category, cnx, chunk_size)
+    success_updated_rowcount = sum(x[1] for x in chunk_rowcounts)
+    for idx, (added_rowcount, updated_rowcount) in enumerate(chunk_rowcounts):
+        if added_rowcount > 0:
+            logging.error(f'handle_updated_house_df: chunk {idx} added {added_rowcount} unexpected houses')
+        logging.info(f'handle_updated_house_df: chunk {idx} updated={updated_rowcount}')
 
     return success_updated_rowcount
 
@@ -184,38 +177,19 @@ def get_different_rent_slices(new_house_link_df, cnx):
     return newly_unavailable_house_df, possible_new_house_df, updated_house_df
 
 
-def main(house_links_file_path, output_file_path, strategy, crawl_date, category, city):
+def process_house_links_with_dataframe(new_house_link_df, category, cnx):
     """
-     1. Add new listed houses to `house_link` table and put them into feed
-     2. For those houses with updated price or was unavailable,
-        we merge its info to `house_link` and `house_price_history` table and put it into feed;
-     3. For remaining house, they are existing house w/o updated price, we do nothing
-     4. For those available house not showing up in the latest house_list, put them into feed;
+    Diff today's house links against the available houses in pandas and write the changes back.
 
-    :param house_links_file_path: The new house links crawled by house_list_spider
-    :param output_file_path: A csv file path to be consumed by downstream house_info_spider
+    :return: (output_house_priorities, success_added_rowcount, success_updated_available_rowcount, success_updated_rowcount)
+             where output_house_priorities is {house_id as str: crawl priority}, like the staging diff.
+             Reopened houses cannot be told apart from new ones here, they all get CRAWL_PRIORITY_NEW.
     """
-    output_house_ids = []
+    output_house_priorities = {}
     success_added_rowcount = 0
     success_updated_available_rowcount = 0
     success_updated_rowcount = 0
 
-    # Read and drop duplicated house_id
-    new_house_link_df = pd.read_csv(house_links_file_path)
-    num_duplicated_new_houses = len(
-        new_house_link_df[new_house_link_df.duplicated(['house_id'], keep=False)]['house_id'].unique())
-
-    new_house_link_df.sort_values(by=['house_id', 'is_pr_item'],
-                                  ascending=[True, False],
-                                  na_position='last',
-                                  inplace=True)
-    new_house_link_df.drop_duplicates('house_id', inplace=True)
-    logging.info(
-        f'{num_duplicated_new_houses} duplicated houses and {len(new_house_link_df)} unique houses found from {house_links_file_path}.')
-
-    # Connect to the database
-    cnx = dbutil.get_mysql_cnx()
-
     # Read in existing available house
     if category == constant.CHINTAI:
         newly_unavailable_house_df, possible_new_house_df, updated_house_df = get_different_rent_slices(
@@ -226,8 +200,8 @@ def main(house_links_file_path, output_file_path, strategy, crawl_date, category
 
     # 1. Handle newly_unavailable_house_df: simply put them into feed;
     if newly_unavailable_house_df is not None:
-        newly_unavailable_house_list = list(newly_unavailable_house_df['house_id'])
-        output_house_ids += newly_unavailable_house_list
+        newly_unavailable_house_list = [str(x) for x in newly_unavailable_house_df['house_id']]
+        output_house_priorities.update({x: constant.CRAWL_PRIORITY_MISSING for x in newly_unavailable_house_list})
         logging.info(
             f'{len(newly_unavailable_house_list)} newly unavailable houses:' + str(newly_unavailable_house_list))
 
@@ -236,15 +210,67 @@ def main(house_links_file_path, output_file_path, strategy, crawl_date, category
         success_added_rowcount, success_updated_available_rowcount = handle_possible_new_house_df(possible_new_house_df,
                                                                                                   category,
                                                                                                   cnx)
-        output_house_ids += list(possible_new_house_df['house_id'])
+        output_house_priorities.update({str(x): constant.CRAWL_PRIORITY_NEW for x in possible_new_house_df['house_id']})
 
     # 3. Handle updated_house_df
     if updated_house_df is not None:
         success_updated_rowcount = handle_updated_house_df(updated_house_df, category, cnx)
-        output_house_ids += list(updated_house_df['house_id'])
+        output_house_priorities.update({str(x): constant.CRAWL_PRIORITY_CHANGED for x in updated_house_df['house_id']})
+
+    return output_house_priorities, success_added_rowcount, success_updated_available_rowcount, success_updated_rowcount
+
+
+def dedupe_house_link_df(new_house_link_df):
+    """
+    Keep one row per house_id, preferring the PR item.
+    :return: (deduped_df, num_duplicated_houses)
+    """
+    num_duplicated_new_houses = len(
+        new_house_link_df[new_house_link_df.duplicated(['house_id'], keep=False)]['house_id'].unique())
+
+    new_house_link_df = new_house_link_df.sort_values(by=['house_id', 'is_pr_item'],
+                                                      ascending=[True, False],
+                                                      na_position='last')
+    new_house_link_df = new_house_link_df.drop_duplicates('house_id')
+    return new_house_link_df, num_duplicated_new_houses
+
+
+def write_house_ids_csv(house_priorities, output_file_path):
+    # Create the parent path if not exist
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+
+    # Write house_ids and their crawl priority to output_file_path
+    with open(output_file_path, 'w+') as f:
+        # using csv.writer method from CSV package
+        write = csv.writer(f)
+        write.writerow(['house_id', 'priority'])
+        write.writerows([[house_id, priority] for house_id, priority in house_priorities.items()])
+        logging.info(f'{len(house_priorities)} houses written to {output_file_path}')
+
+
+def process_house_link_df(new_house_link_df, output_file_path, strategy, crawl_date, category, city,
+                          diff_mode='dataframe'):
+    """
+    Diff the de-duplicated house links against the database, record the day's stats
+    and write the house_ids to crawl to output_file_path.
+
+    :return: {house_id: crawl priority} of the houses to crawl
+    """
+    # Connect to the database
+    cnx = dbutil.get_mysql_cnx()
+
+    if diff_mode == 'staging':
+        output_house_priorities, success_added_rowcount, success_updated_available_rowcount, success_updated_rowcount = \
+            staging.process_house_links_with_staging(new_house_link_df, category, cnx)
+    else:
+        output_house_priorities, success_added_rowcount, success_updated_available_rowcount, success_updated_rowcount = \
+            process_house_links_with_dataframe(new_house_link_df, category, cnx)
 
     if strategy == 'all':
-        output_house_ids = list(new_house_link_df['house_id'])
+        # Unchanged houses are a routine refresh, the others keep their priority. The csv house_ids are ints
+        # for sale categories, key them as str like the diff so that the same house is not written twice.
+        output_house_priorities = {**{str(x): constant.CRAWL_PRIORITY_REFRESH for x in new_house_link_df['house_id']},
+                                   **output_house_priorities}
 
     logging.info(f'success_added_rowcount:{success_added_rowcount}, '
                  f'success_updated_available_rowcount: {success_updated_available_rowcount}, '
@@ -268,31 +294,45 @@ def main(house_links_file_path, output_file_path, strategy, crawl_date, category
     # Close the database connection
     cnx.close()
 
-    # Create the parent path if not exist
-    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    write_house_ids_csv(output_house_priorities, output_file_path)
+    return output_house_priorities
 
-    # Write output_house_ids to output_file_path
-    with open(output_file_path, 'w+') as f:
-        # using csv.writer method from CSV package
-        write = csv.writer(f)
-        write.writerow(['house_id'])
-        write.writerows([[x] for x in output_house_ids])
-        logging.info(f'{len(output_house_ids)} houses written to {output_file_path}')
+
+def main(house_links_file_path, output_file_path, strategy, crawl_date, category, city, diff_mode='dataframe'):
+    """
+     1. Add new listed houses to `house_link` table and put them into feed
+     2. For those houses with updated price or was unavailable,
+        we merge its info to `house_link` and `house_price_history` table and put it into feed;
+     3. For remaining house, they are existing house w/o updated price, we do nothing
+     4. For those available house not showing up in the latest house_list, put them into feed;
+
+    :param house_links_file_path: The new house links crawled by house_list_spider
+    :param output_file_path: A csv file path to be consumed by downstream house_info_spider
+    :param diff_mode: 'dataframe' diffs in pandas and writes row chunks;
+                      'staging' diffs with set-based SQL over a staging table
+    """
+    # Read and drop duplicated house_id
+    new_house_link_df, num_duplicated_new_houses = dedupe_house_link_df(pd.read_csv(house_links_file_path))
+    logging.info(
+        f'{num_duplicated_new_houses} duplicated houses and {len(new_house_link_df)} unique houses found from {house_links_file_path}.')
+
+    process_house_link_df(new_house_link_df, output_file_path, strategy, crawl_date, category, city, diff_mode)
 
 
 if __name__ == "__main__":
-    usage = 'main.py -i <parent_dir_path> -o <output_file_path> -s <strategy> --logfile <log_file> --loglevel <loglevel>'
+    usage = 'main.py -i <parent_dir_path> -o <output_file_path> -s <strategy> -m <diff_mode> --logfile <log_file> --loglevel <loglevel>'
     house_links_file_path = ''
     output_file_path = ''
     strategy = 'update_only'
+    diff_mode = 'dataframe'
     log_file = ''
     loglevel = logging.INFO
     crawl_date = ''
     category = ''
     city = ''
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hi:o:s:l:",
-                                   ["ifile=", "ofile=", "strategy=", "logfile=", "loglevel=", "crawl_date=",
+        opts, args = getopt.getopt(sys.argv[1:], "hi:o:s:m:l:",
+                                   ["ifile=", "ofile=", "strategy=", "mode=", "logfile=", "loglevel=", "crawl_date=",
                                     "category=", "city="])
     except getopt.GetoptError:
         print(usage)
@@ -307,6 +347,8 @@ if __name__ == "__main__":
             output_file_path = arg
         elif opt in ("-s", "--strategy"):
             strategy = arg
+        elif opt in ("-m", "--mode"):
+            diff_mode = arg
         elif opt in ("-l", "--logfile"):
             log_file = arg
         elif opt in ("--loglevel"):
@@ -318,6 +360,7 @@ if __name__ == "__main__":
         elif opt in ("--city"):
             city = arg
     assert strategy in ('update_only', 'all')
+    assert diff_mode in ('dataframe', 'staging')
     if house_links_file_path == '' or output_file_path == '' or log_file == '' or crawl_date == '' or category == '' or city == '':
         print(usage)
         sys.exit(2)
@@ -325,6 +368,7 @@ if __name__ == "__main__":
     print('Input file is', house_links_file_path)
     print('Output file is', output_file_path)
     print('Strategy used:', strategy)
+    print('Diff mode used:', diff_mode)
     print('category:', category)
     print('city:', city)
     print('Log to file:', log_file)
@@ -334,5 +378,7 @@ if __name__ == "__main__":
                         level=loglevel,
                         filemode='w',
                         filename=log_file)
+    metrics.enable_from_env()
 
-    main(house_links_file_path, output_file_path, strategy, crawl_date, category, city)
+    main(house_links_file_path, output_file_path, strategy, crawl_date, category, city, diff_mode)
+    metrics.export(f'house_list_processor-{category}')
@@ -0,0 +1,186 @@
+"""
+Set-based version of the house_list_processor diff.
+
+The whole day's house links are bulk-loaded into a per-connection staging table, then
+classification and the `xxx_link` writes are done with a fixed number of SQL statements
+no matter how many houses are listed.
+"""
+import logging
+import math
+import sys
+
+sys.path.append('../')
+
+import db.utils as dbutil
+from utils import utils
+from utils import constant
+
+NEW = 'new'
+REOPENED = 'reopened'
+UPDATED = 'updated'
+
+MANSION_LINK_SPEC = {
+    'table_name': 'lifull_house_link',
+    'key_columns': ['house_id', 'sale_category'],
+    'value_columns': ['is_pr_item', 'listing_house_name', 'listing_house_price', 'city'],
+    'compare_columns': ['is_pr_item', 'listing_house_price'],
+    'staging_ddl': """
+        CREATE TEMPORARY TABLE lifull_house_link_staging (
+            house_id VARCHAR(64) NOT NULL,
+            sale_category VARCHAR(255) NOT NULL,
+            is_pr_item BOOLEAN NOT NULL DEFAULT FALSE,
+            listing_house_name VARCHAR(255),
+            listing_house_price FLOAT,
+            city VARCHAR(255) NOT NULL,
+            change_type VARCHAR(16),
+            PRIMARY KEY(house_id, sale_category)
+        );""",
+}
+
+RENT_LINK_SPEC = {
+    'table_name': 'lifull_rent_link',
+    'key_columns': ['house_id'],
+    'value_columns': ['is_pr_item', 'listing_house_name', 'listing_house_rent', 'listing_house_manage_fee', 'city'],
+    'compare_columns': ['is_pr_item', 'listing_house_rent', 'listing_house_manage_fee'],
+    'staging_ddl': """
+        CREATE TEMPORARY TABLE lifull_rent_link_staging (
+            house_id VARCHAR(64) NOT NULL PRIMARY KEY,
+            is_pr_item BOOLEAN NOT NULL DEFAULT FALSE,
+            listing_house_name VARCHAR(255),
+            listing_house_rent FLOAT,
+            listing_house_manage_fee FLOAT,
+            city VARCHAR(255) NOT NULL,
+            change_type VARCHAR(16)
+        );""",
+}
+
+
+def get_link_spec_from_category(category):
+    return RENT_LINK_SPEC if category == constant.CHINTAI else MANSION_LINK_SPEC
+
+
+def get_staging_table_name(spec):
+    return f"{spec['table_name']}_staging"
+
+
+def load_staging_table(new_house_link_df, spec, cur, chunk_size):
+    """
+    Create the staging table for this connection and bulk-load the de-duplicated house links into it.
+    """
+    staging_table_name = get_staging_table_name(spec)
+    cur.execute(f'DROP TEMPORARY TABLE IF EXISTS {staging_table_name};')
+    cur.execute(spec['staging_ddl'])
+
+    columns = spec['key_columns'] + spec['value_columns']
+    rows = []
+    for row in new_house_link_df[columns].itertuples(index=False):
+        # NaN prices from the list page are stored as NULL.
+        val_map = {k: None if isinstance(v, float) and math.isnan(v) else v for k, v in zip(columns, row)}
+        val_map['house_id'] = str(val_map['house_id'])
+        rows.append(val_map)
+    dbutil.bulk_upsert(rows=rows, table_name=staging_table_name, update_columns=[], cur=cur, chunk_size=chunk_size)
+    logging.info(f'{len(rows)} houses loaded into {staging_table_name}.')
+
+
+def get_join_clause(spec, left='s', right='l'):
+    return ' AND '.join([f'{left}.{k}={right}.{k}' for k in spec['key_columns']])
+
+
+def get_category_clause(spec, alias='l'):
+    return f'AND {alias}.sale_category=%s' if 'sale_category' in spec['key_columns'] else ''
+
+
+def classify_staging_table(spec, cur):
+    """
+    Tag each staged house as new, reopened (was unavailable), updated (listing changed) or NULL (unchanged).
+    :return: {change_type: num_houses}
+    """
+    staging_table_name = get_staging_table_name(spec)
+    changed_clause = ' OR '.join([f'NOT (s.{c} <=> l.{c})' for c in spec['compare_columns']])
+    cur.execute(f"""
+        UPDATE {staging_table_name} s
+        LEFT JOIN {spec['table_name']} l ON {get_join_clause(spec)}
+        SET s.change_type = CASE
+            WHEN l.house_id IS NULL THEN '{NEW}'
+            WHEN NOT l.is_available THEN '{REOPENED}'
+            WHEN {changed_clause} THEN '{UPDATED}'
+            ELSE NULL
+        END;""")
+
+    cur.execute(f'SELECT change_type, COUNT(*) FROM {staging_table_name} '
+                f'WHERE change_type IS NOT NULL GROUP BY change_type;')
+    return {change_type: num for change_type, num in cur.fetchall()}
+
+
+def get_newly_unavailable_house_ids(spec, category, cur):
+    """
+    Houses still available in `xxx_link` table but missing from today's house list.
+    """
+    cur.execute(f"""
+        SELECT l.house_id FROM {spec['table_name']} l
+        LEFT JOIN {get_staging_table_name(spec)} s ON {get_join_clause(spec)}
+        WHERE l.is_available {get_category_clause(spec)} AND s.house_id IS NULL;""",
+                (category,) if 'sale_category' in spec['key_columns'] else ())
+    return [str(x[0]) for x in cur.fetchall()]
+
+
+def apply_staging_table(spec, cur):
+    """
+    Insert new houses and merge reopened/updated houses into `xxx_link` table.
+    :return: (inserted_rowcount, updated_rowcount)
+    """
+    staging_table_name = get_staging_table_name(spec)
+    columns = spec['key_columns'] + spec['value_columns']
+    cur.execute(f"""
+        INSERT INTO {spec['table_name']} ({','.join(columns)}, is_available, first_available_date, unavailable_date)
+        SELECT {','.join(columns)}, 1, %s, NULL FROM {staging_table_name}
+        WHERE change_type='{NEW}';""", (utils.get_date_str_today(),))
+    inserted_rowcount = cur.rowcount
+
+    set_clause = ','.join([f'l.{c}=s.{c}' for c in spec['value_columns']])
+    cur.execute(f"""
+        UPDATE {spec['table_name']} l
+        JOIN {staging_table_name} s ON {get_join_clause(spec)}
+        SET {set_clause}, l.is_available=1, l.unavailable_date=NULL
+        WHERE s.change_type IN ('{REOPENED}', '{UPDATED}');""")
+    updated_rowcount = cur.rowcount
+    return inserted_rowcount, updated_rowcount
+
+
+def get_changed_house_priorities(spec, cur):
+    """
+    :return: {house_id: crawl priority} of the new, reopened and updated houses
+    """
+    cur.execute(f'SELECT house_id, change_type FROM {get_staging_table_name(spec)} WHERE change_type IS NOT NULL;')
+    return {str(house_id): constant.CRAWL_PRIORITY_NEW if change_type == NEW else constant.CRAWL_PRIORITY_CHANGED
+            for house_id, change_type in cur.fetchall()}
+
+
+def process_house_links_with_staging(new_house_link_df, category, cnx, chunk_size=5000):
+    """
+    Set-based equivalent of the dataframe diff in main.py.
+
+    :return: (output_house_priorities, success_added_rowcount, success_updated_available_rowcount, success_updated_rowcount)
+    """
+    spec = get_link_spec_from_category(category)
+    cur = cnx.cursor(buffered=True)
+
+    load_staging_table(new_house_link_df, spec, cur, chunk_size)
+    change_type_counts = classify_staging_table(spec, cur)
+    logging.info(f'Staging classification: {change_type_counts}')
+
+    newly_unavailable_house_ids = get_newly_unavailable_house_ids(spec, category, cur)
+    logging.info(f'{len(newly_unavailable_house_ids)} newly unavailable houses:' + str(newly_unavailable_house_ids))
+
+    inserted_rowcount, updated_rowcount = apply_staging_table(spec, cur)
+    cnx.commit()
+    logging.info(f'{inserted_rowcount} houses inserted and {updated_rowcount} houses updated in {spec["table_name"]}.')
+
+    output_house_priorities = {x: constant.CRAWL_PRIORITY_MISSING for x in newly_unavailable_house_ids}
+    output_house_priorities.update(get_changed_house_priorities(spec, cur))
+    cur.execute(f'DROP TEMPORARY TABLE IF EXISTS {get_staging_table_name(spec)};')
+
+    return (output_house_priorities,
+            change_type_counts.get(NEW, 0),
+            change_type_counts.get(REOPENED, 0),
+            change_type_counts.get(UPDATED, 0))
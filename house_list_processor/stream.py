@@ -0,0 +1,179 @@
+"""
+Stream house links from house_list_spider straight to house_info_spider, without the csv hop.
+
+HouseLinkStream is shared by both spiders inside one process (see houspider_runner --stream):
+every list item is de-duplicated by house_id on arrival (PR items preferred, like the sort in
+main.dedupe_house_link_df) and diffed against the in-memory available houses, so new and
+updated houses are handed to the info spider while list pages are still being fetched.
+Once the list crawl is over, finish() runs the usual diff/writes of main.process_house_link_df
+on the collected links and the remaining house_ids (e.g. newly unavailable houses) are handed over.
+Every house_id comes with its crawl priority (utils/constant.py CRAWL_PRIORITY_XXX).
+
+New and reopened houses have no available `xxx_link` row until finish() writes it, so their pages
+must not be written before (see is_link_pending): the diff would count them as already available,
+and their page fingerprints would be lost.
+
+add/close run on the reactor thread, load/finish are blocking and run in a thread.
+"""
+import logging
+import sys
+
+import pandas as pd
+
+sys.path.append('../')
+
+import db.utils as dbutil
+from house_list_processor.main import dedupe_house_link_df, process_house_link_df
+from utils import constant
+
+MANSION_LINK_COLUMNS = ['house_id', 'is_pr_item', 'listing_house_name', 'listing_house_price', 'sale_category', 'city']
+RENT_LINK_COLUMNS = ['house_id', 'is_pr_item', 'listing_house_name', 'listing_house_rent', 'listing_house_manage_fee',
+                     'city']
+
+
+class HouseLinkStream:
+    def __init__(self, category, crawl_date, city, output_file_path, strategy='update_only', diff_mode='dataframe'):
+        self.category = category
+        self.crawl_date = crawl_date
+        self.city = city
+        self.output_file_path = output_file_path
+        self.strategy = strategy
+        self.diff_mode = diff_mode
+        # house_id -> compared values of the available houses in `xxx_link`
+        self.available_houses = {}
+        # house_ids of the unavailable houses in `xxx_link`, handed over as reopened rather than new
+        self.unavailable_house_ids = set()
+        # New and reopened house_ids handed over before finish() wrote their `xxx_link` row
+        self.link_pending_house_ids = set()
+        # house_id -> list item, one per house
+        self.house_links = {}
+        self.emitted_house_ids = set()
+        self.pending_house_priorities = {}
+        self.subscribers = []
+        self.close_subscribers = []
+        self.closed = False
+        self.failure = None
+
+    def get_link_columns(self):
+        return RENT_LINK_COLUMNS if self.category == constant.CHINTAI else MANSION_LINK_COLUMNS
+
+    def get_compare_columns(self):
+        if self.category == constant.CHINTAI:
+            return ['is_pr_item', 'listing_house_rent', 'listing_house_manage_fee']
+        return ['is_pr_item', 'listing_house_price']
+
+    def load(self):
+        """
+        Read the available houses once before the list crawl starts.
+        """
+        compare_columns = self.get_compare_columns()
+        cnx = dbutil.get_mysql_cnx()
+        cur = cnx.cursor()
+        if self.category == constant.CHINTAI:
+            cur.execute(f'SELECT house_id, {",".join(compare_columns)} FROM lifull_rent_link WHERE is_available')
+        else:
+            cur.execute(f'SELECT house_id, {",".join(compare_columns)} FROM lifull_house_link '
+                        f'WHERE is_available AND sale_category=%s', (self.category,))
+        self.available_houses = {str(row[0]): self.normalize_values(row[1:]) for row in cur.fetchall()}
+        if self.category == constant.CHINTAI:
+            cur.execute('SELECT house_id FROM lifull_rent_link WHERE NOT is_available')
+        else:
+            cur.execute('SELECT house_id FROM lifull_house_link WHERE NOT is_available AND sale_category=%s',
+                        (self.category,))
+        self.unavailable_house_ids = {str(row[0]) for row in cur.fetchall()}
+        cnx.close()
+        logging.info(f'{len(self.available_houses)} available and {len(self.unavailable_house_ids)} unavailable '
+                     f'{self.category} houses loaded.')
+
+    @staticmethod
+    def normalize_values(values):
+        return tuple(None if x is None else (bool(x) if idx == 0 else float(x)) for idx, x in enumerate(values))
+
+    def get_crawl_priority(self, house_link):
+        """
+        Same rule as the staging diff: new and reopened houses, and available houses whose PR flag or price changed.
+        Houses with a missing value are left to the final diff.
+        :return: The crawl priority, None if the house does not need to be crawled now
+        """
+        house_id = str(house_link['house_id'])
+        old_values = self.available_houses.get(house_id)
+        if old_values is None:
+            return constant.CRAWL_PRIORITY_CHANGED if house_id in self.unavailable_house_ids \
+                else constant.CRAWL_PRIORITY_NEW
+        new_values = self.normalize_values([house_link.get(x) for x in self.get_compare_columns()])
+        if None not in old_values and None not in new_values and new_values != old_values:
+            return constant.CRAWL_PRIORITY_CHANGED
+        return constant.CRAWL_PRIORITY_REFRESH if self.strategy == 'all' else None
+
+    def add(self, house_link):
+        house_id = str(house_link['house_id'])
+        old_house_link = self.house_links.get(house_id)
+        if old_house_link is not None and (old_house_link['is_pr_item'] or not house_link['is_pr_item']):
+            return
+        self.house_links[house_id] = house_link
+        priority = self.get_crawl_priority(house_link)
+        if priority is not None:
+            if house_id not in self.available_houses:
+                self.link_pending_house_ids.add(house_id)
+            self.emit({house_id: priority})
+
+    def is_link_pending(self, house_id):
+        """
+        :return: Whether house_id was handed over as a new or reopened house whose `xxx_link` row is not written yet
+        """
+        return not self.closed and house_id in self.link_pending_house_ids
+
+    def emit(self, house_priorities):
+        house_priorities = {k: v for k, v in house_priorities.items() if k not in self.emitted_house_ids}
+        if len(house_priorities) == 0:
+            return
+        self.emitted_house_ids.update(house_priorities.keys())
+        if len(self.subscribers) == 0:
+            self.pending_house_priorities.update(house_priorities)
+            return
+        for subscriber in self.subscribers:
+            subscriber(house_priorities)
+
+    def subscribe(self, subscriber):
+        """
+        :param subscriber: Called with {house_id: crawl priority} of the houses to crawl, on the reactor thread
+        """
+        self.subscribers.append(subscriber)
+        if len(self.pending_house_priorities) > 0:
+            pending_house_priorities = self.pending_house_priorities
+            self.pending_house_priorities = {}
+            subscriber(pending_house_priorities)
+
+    def subscribe_close(self, subscriber):
+        """
+        :param subscriber: Called once the stream is closed and finish() wrote the links, on the reactor thread
+        """
+        if self.closed:
+            subscriber()
+        else:
+            self.close_subscribers.append(subscriber)
+
+    def get_house_link_df(self):
+        return pd.DataFrame(list(self.house_links.values()), columns=self.get_link_columns())
+
+    def finish(self):
+        """
+        Write the collected links to the database like house_list_processor/main.py does.
+        :return: {house_id: crawl priority} of all houses to crawl
+        """
+        new_house_link_df, num_duplicated_new_houses = dedupe_house_link_df(self.get_house_link_df())
+        logging.info(f'{len(new_house_link_df)} unique {self.category} houses streamed, '
+                     f'{len(self.emitted_house_ids)} handed to house_info_spider before the list crawl finished.')
+        output_house_priorities = process_house_link_df(new_house_link_df, self.output_file_path, self.strategy,
+                                                        self.crawl_date, self.category, self.city, self.diff_mode)
+        return {str(k): v for k, v in output_house_priorities.items()}
+
+    def close(self, house_priorities=None, failure=None):
+        if self.closed:
+            return
+        if house_priorities is not None:
+            self.emit(house_priorities)
+        self.failure = failure
+        self.closed = True
+        for subscriber in self.close_subscribers:
+            subscriber()
@@ -7,6 +7,12 @@ from scrapy import signals
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
+import sys
+
+sys.path.append('../')
+
+# Shared by both spiders, enabled with REVALIDATION_CACHE_ENABLED.
+from utils.http_cache import RevalidationCacheMiddleware
 
 
 class HouseListSpiderSpiderMiddleware:
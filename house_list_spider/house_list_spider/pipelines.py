@@ -4,6 +4,8 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+from twisted.internet.threads import deferToThread
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
@@ -11,3 +13,25 @@ from itemadapter import ItemAdapter
 class HouseListSpiderPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class HouseLinkStreamPipeline:
+    """
+    Hand every house link to the spider's HouseLinkStream (house_list_processor/stream.py) when it has one.
+    Items still reach the feed export, the csv is just not read back any more.
+    """
+
+    def process_item(self, item, spider):
+        link_stream = getattr(spider, 'link_stream', None)
+        if link_stream is not None:
+            link_stream.add(dict(item))
+        return item
+
+    def close_spider(self, spider):
+        link_stream = getattr(spider, 'link_stream', None)
+        if link_stream is None:
+            return None
+        # The list processing writes are blocking, run them off the reactor thread.
+        d = deferToThread(link_stream.finish)
+        d.addCallbacks(link_stream.close, lambda failure: link_stream.close(failure=failure))
+        return d
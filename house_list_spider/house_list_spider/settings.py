@@ -19,6 +19,9 @@ NEWSPIDER_MODULE = 'house_list_spider.spiders'
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
+# Site to crawl, set to e.g. http://localhost:8080 to crawl mock_homes/server.py instead
+LIFULL_BASE_URL = 'https://www.homes.co.jp'
+
 LOG_FILE = 'log/log.txt'
 LOG_FILE_APPEND = False
 LOG_LEVEL = 'INFO'
@@ -57,6 +60,10 @@ LOG_LEVEL = 'INFO'
 #DOWNLOADER_MIDDLEWARES = {
 #    'house_list_spider.middlewares.HouseListSpiderDownloaderMiddleware': 543,
 #}
+# Runs after HttpCompressionMiddleware (590) has decompressed the body it hashes.
+DOWNLOADER_MIDDLEWARES = {
+    'house_list_spider.middlewares.RevalidationCacheMiddleware': 580,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -69,6 +76,10 @@ LOG_LEVEL = 'INFO'
 #ITEM_PIPELINES = {
 #    'house_list_spider.pipelines.HouseListSpiderPipeline': 300,
 #}
+# Only does something when the spider is given a link_stream, see houspider_runner --stream.
+ITEM_PIPELINES = {
+    'house_list_spider.pipelines.HouseLinkStreamPipeline': 300,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -95,7 +106,51 @@ LOG_LEVEL = 'INFO'
 REQUEST_FINGERPRINTER_IMPLEMENTATION = '2.7'
 TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
 
-# AUTOTHROTTLE Settings
-AUTOTHROTTLE_ENABLED = True
+# AUTOTHROTTLE Settings, replaced by ConcurrencyAutoTuner below
+AUTOTHROTTLE_ENABLED = False
 AUTOTHROTTLE_TARGET_CONCURRENCY = 2.0
 DOWNLOAD_DELAY = 0.25
+
+# Conditional requests with validators remembered from the last crawl, see utils/http_cache.py.
+REVALIDATION_CACHE_ENABLED = True
+REVALIDATION_CACHE_PATH = 'output/revalidation_cache.sqlite'
+# Keep list page bodies so a 304 can still be parsed.
+REVALIDATION_CACHE_STORE_BODY = True
+
+# Record queued/completed work in output/checkpoints/YYYY-MM-DD/, so a crawl interrupted
+# on the same day resumes where it stopped, see utils/crawl_checkpoint.py.
+CRAWL_CHECKPOINT_ENABLED = True
+CRAWL_CHECKPOINT_DIR = 'output/checkpoints'
+
+# Concurrency and delay per host are tuned from latency and errors by utils/autotune.py,
+# starting from CONCURRENT_REQUESTS_PER_DOMAIN/DOWNLOAD_DELAY or what the last crawl of the category chose.
+EXTENSIONS = {
+    'utils.autotune.ConcurrencyAutoTuner': 500,
+    'utils.metrics.MetricsExtension': 510,
+    'utils.profiling.ProfilingExtension': 520,
+}
+AUTOTUNE_ENABLED = True
+CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
+AUTOTUNE_MIN_CONCURRENCY = 1
+AUTOTUNE_MAX_CONCURRENCY = 8
+# Never tune the delay below DOWNLOAD_DELAY
+AUTOTUNE_MIN_DELAY = DOWNLOAD_DELAY
+AUTOTUNE_TARGET_LATENCY = 2.0
+AUTOTUNE_MAX_ERROR_RATE = 0.05
+AUTOTUNE_INTERVAL = 30
+AUTOTUNE_STATE_PATH = 'output/autotune_state.json'
+
+# Prometheus metrics of the crawl, see utils/metrics.py. Served on METRICS_PORT (0: not served) and/or
+# written to METRICS_TEXTFILE_PATH / pushed to METRICS_PUSHGATEWAY_URL every METRICS_INTERVAL seconds.
+METRICS_ENABLED = False
+METRICS_PORT = 0
+METRICS_TEXTFILE_PATH = None
+METRICS_PUSHGATEWAY_URL = None
+METRICS_INTERVAL = 15
+
+# Sample the crawl into output/YYYY-MM-DD/profiles/<spider>-<category>.collapsed for flamegraphs,
+# see utils/profiling.py. PROFILE_INTERVAL is the seconds between two stack samples.
+PROFILE_ENABLED = False
+PROFILE_DIR = 'output'
+PROFILE_INTERVAL = 0.01
@@ -0,0 +1,187 @@
+"""
+python3 -m house_list_spider.sharding -o output/2022-11-14/house_chintai_links.csv \
+-e output/2022-11-14/error_chintai_list_urls.csv --logfile log/2022-11-14-chintai-log.txt \
+--crawl_date 2022-11-14 --category chintai -n 4
+
+Crawl the list pages of one category with N local `scrapy crawl house_list` worker processes.
+
+The crawl is split into shards: one per ward (cond[city] 13101..13123) for chintai, and one per
+page residue class (page_index % num_page_shards) for the other categories. Every shard writes
+its own house links/error urls/log under `<output dir>/shards/`, and once all of them are over the
+shards are merged into the usual house links csv, de-duplicated by house_id like
+house_list_processor does. A failed shard (non-zero exit or failed list pages) is re-run on its own;
+its crawl checkpoint replays the list pages it already completed.
+"""
+import concurrent.futures
+import getopt
+import logging
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+sys.path.append('../')
+
+from house_list_processor.main import dedupe_house_link_df
+from utils import constant
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHINTAI_WARDS = constant.TOKYO_23_WARD_CODES
+
+
+def get_shards(category, num_page_shards):
+    """
+    :return: {shard_name: spider args of the shard}
+    """
+    if category == constant.CHINTAI:
+        return {f'ward{x}': {'wards': x} for x in CHINTAI_WARDS}
+    return {f'page{idx}of{num_page_shards}': {'page_shard': f'{idx}/{num_page_shards}'}
+            for idx in range(num_page_shards)}
+
+
+def get_shard_paths(output_file_path, error_list_urls_path, log_file, shard_name):
+    shard_dir = os.path.join(os.path.dirname(os.path.abspath(output_file_path)), 'shards')
+    return {
+        'house_links': os.path.join(shard_dir, f'{shard_name}-{os.path.basename(output_file_path)}'),
+        'error_list_urls': os.path.join(shard_dir, f'{shard_name}-{os.path.basename(error_list_urls_path)}'),
+        'log': os.path.join(os.path.dirname(os.path.abspath(log_file)), f'{shard_name}-{os.path.basename(log_file)}'),
+    }
+
+
+def crawl_shard(category, crawl_date, shard_name, spider_args, shard_paths, base_url=None):
+    """
+    Run one shard in its own `scrapy crawl` process.
+    :return: True if the shard crawled every list page
+    """
+    for path in shard_paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A rerun only writes the error urls that failed again.
+    if os.path.exists(shard_paths['error_list_urls']):
+        os.remove(shard_paths['error_list_urls'])
+    state_dir = os.path.join(PROJECT_DIR, 'output', 'shards', f'{category}-{shard_name}')
+    cmd = ['scrapy', 'crawl', 'house_list',
+           '-O', shard_paths['house_links'],
+           '-a', f'error_list_urls_path={shard_paths["error_list_urls"]}',
+           '-a', f'category={category}',
+           '-a', f'crawl_date={crawl_date}',
+           # Shards must not write the same sqlite/json files at the same time.
+           '-s', f'REVALIDATION_CACHE_PATH={os.path.join(state_dir, "revalidation_cache.sqlite")}',
+           '-s', f'AUTOTUNE_STATE_PATH={os.path.join(state_dir, "autotune_state.json")}',
+           '--logfile', shard_paths['log']]
+    for key, value in spider_args.items():
+        cmd += ['-a', f'{key}={value}']
+    if base_url is not None:
+        cmd += ['-s', f'LIFULL_BASE_URL={base_url}']
+    returncode = subprocess.run(cmd, cwd=PROJECT_DIR).returncode
+    if returncode != 0:
+        logging.error(f'Shard {category} {shard_name} exited with {returncode}, see {shard_paths["log"]}')
+        return False
+    if os.path.exists(shard_paths['error_list_urls']):
+        logging.error(f'Shard {category} {shard_name} has failed list pages in {shard_paths["error_list_urls"]}')
+        return False
+    return True
+
+
+def merge_shards(all_shard_paths, output_file_path, error_list_urls_path):
+    house_link_dfs = [pd.read_csv(x['house_links']) for x in all_shard_paths
+                      if os.path.exists(x['house_links']) and os.path.getsize(x['house_links']) > 0]
+    if len(house_link_dfs) == 0:
+        raise RuntimeError(f'No house links found in any shard of {output_file_path}')
+    house_link_df, num_duplicated_houses = dedupe_house_link_df(pd.concat(house_link_dfs, ignore_index=True))
+    house_link_df.to_csv(output_file_path, index=False)
+    logging.info(f'{len(house_link_dfs)} shards merged into {output_file_path}: {len(house_link_df)} unique houses, '
+                 f'{num_duplicated_houses} duplicated.')
+
+    error_url_dfs = [pd.read_csv(x['error_list_urls']) for x in all_shard_paths if os.path.exists(x['error_list_urls'])]
+    if os.path.exists(error_list_urls_path):
+        os.remove(error_list_urls_path)
+    if len(error_url_dfs) > 0:
+        # Same file as HouseListSpider.spider_closed writes, only when list pages failed.
+        error_url_df = pd.concat(error_url_dfs, ignore_index=True)
+        error_url_df.to_csv(error_list_urls_path, index=False)
+        logging.info(f'{len(error_url_df)} urls written to {error_list_urls_path}')
+
+
+def main(output_file_path, error_list_urls_path, log_file, crawl_date, category, num_workers=4,
+         num_page_shards=None, max_shard_retries=2, base_url=None):
+    """
+    :param num_workers: Number of shards crawled at the same time
+    :param num_page_shards: Number of page shards of the non-chintai categories, num_workers by default
+    :param max_shard_retries: Reruns of a failed shard after its first attempt
+    :param base_url: LIFULL_BASE_URL of the shards, the project setting by default
+    :return: True if every shard crawled every list page
+    """
+    shards = get_shards(category, num_page_shards or num_workers)
+    all_shard_paths = {x: get_shard_paths(output_file_path, error_list_urls_path, log_file, x) for x in shards}
+    pending_shard_names = list(shards)
+    for attempt in range(max_shard_retries + 1):
+        if attempt > 0:
+            logging.info(f'Retry {len(pending_shard_names)} failed {category} shards: {pending_shard_names}')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = dict(zip(pending_shard_names, executor.map(
+                lambda x: crawl_shard(category, crawl_date, x, shards[x], all_shard_paths[x], base_url), pending_shard_names)))
+        pending_shard_names = [x for x, is_success in results.items() if not is_success]
+        if len(pending_shard_names) == 0:
+            break
+    merge_shards(list(all_shard_paths.values()), output_file_path, error_list_urls_path)
+    if len(pending_shard_names) > 0:
+        logging.error(f'{len(pending_shard_names)} {category} shards still failing: {pending_shard_names}')
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    usage = 'sharding.py -o <output_file_path> -e <error_list_urls_path> --logfile <log_file> ' \
+            '--crawl_date <crawl_date> --category <category> -n <num_workers> --page_shards <num_page_shards> ' \
+            '--retries <max_shard_retries>'
+    output_file_path = ''
+    error_list_urls_path = ''
+    log_file = ''
+    crawl_date = ''
+    category = ''
+    num_workers = 4
+    num_page_shards = None
+    max_shard_retries = 2
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ho:e:l:n:",
+                                   ["ofile=", "error_list_urls_path=", "logfile=", "crawl_date=", "category=",
+                                    "workers=", "page_shards=", "retries="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-o", "--ofile"):
+            output_file_path = arg
+        elif opt in ("-e", "--error_list_urls_path"):
+            error_list_urls_path = arg
+        elif opt in ("-l", "--logfile"):
+            log_file = arg
+        elif opt in ("--crawl_date"):
+            crawl_date = arg
+        elif opt in ("--category"):
+            category = arg
+        elif opt in ("-n", "--workers"):
+            num_workers = int(arg)
+        elif opt in ("--page_shards"):
+            num_page_shards = int(arg)
+        elif opt in ("--retries"):
+            max_shard_retries = int(arg)
+    if output_file_path == '' or error_list_urls_path == '' or log_file == '' or crawl_date == '' or category == '':
+        print(usage)
+        sys.exit(2)
+    assert category in (constant.MANSION_CHUKO, constant.OTHER, constant.CHINTAI)
+
+    os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO,
+                        filemode='w',
+                        filename=log_file)
+
+    is_success = main(output_file_path, error_list_urls_path, log_file, crawl_date, category, num_workers,
+                      num_page_shards, max_shard_retries)
+    sys.exit(0 if is_success else 1)
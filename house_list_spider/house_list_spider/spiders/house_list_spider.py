@@ -23,6 +23,9 @@ sys.path.append('../')
 
 from utils import utils
 from utils import constant
+from utils import metrics
+from utils import text_parsers
+from utils.crawl_checkpoint import CrawlCheckpoint
 
 
 class HouseListSpider(scrapy.Spider):
@@ -35,7 +38,7 @@ class HouseListSpider(scrapy.Spider):
 
     # We are only interested in the 23 districts for rent items.
     chintai_form_data = {
-        **{f'cond[city][{idx}]': str(idx) for idx in range(13101, 13124)},
+        **{f'cond[city][{x}]': x for x in constant.TOKYO_23_WARD_CODES},
         "cond[monthmoneyroom]": "0",
         "cond[monthmoneyroomh]": "0",
         "cond[housearea]": "0",
@@ -46,19 +49,44 @@ class HouseListSpider(scrapy.Spider):
         "bukken_attr[pref]": "13",
     }
 
-    def __init__(self, error_list_urls_path, category, **kw):
+    def __init__(self, error_list_urls_path, category, crawl_date=None, page_shard=None, wards=None, **kw):
+        """
+        :param page_shard: 'i/n' to only crawl the list pages with page_index % n == i, see sharding.py
+        :param wards: Comma separated ward codes to crawl instead of the 23 districts, chintai only
+        """
         self.error_list_urls_path = error_list_urls_path
         self.category = category
+        self.crawl_date = crawl_date if crawl_date is not None else utils.get_date_str_today()
+        self.page_shard = tuple(int(x) for x in page_shard.split('/')) if page_shard else None
+        self.wards = wards.split(',') if wards else None
+        # Tells the checkpoints of the shards of one category apart
+        self.shard_name = ''
+        if self.page_shard is not None:
+            self.shard_name += f'-page{self.page_shard[0]}of{self.page_shard[1]}'
+        if self.wards is not None:
+            self.shard_name += f'-ward{"_".join(self.wards)}'
         super(HouseListSpider, self).__init__(**kw)
         self.failed_pages_list = []
+        # Completed list pages and their items, see CRAWL_CHECKPOINT_ENABLED setting.
+        self.crawl_checkpoint = None
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super(HouseListSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
         return spider
 
+    def spider_opened(self, spider):
+        if self.settings.getbool('CRAWL_CHECKPOINT_ENABLED', False):
+            self.crawl_checkpoint = CrawlCheckpoint(os.path.join(
+                self.settings.get('CRAWL_CHECKPOINT_DIR', 'output/checkpoints'), self.crawl_date,
+                f'{self.name}-{self.category}{self.shard_name}.jsonl'))
+
     def spider_closed(self, spider):
+        if self.crawl_checkpoint is not None:
+            self.crawl_checkpoint.close()
+
         if len(self.failed_pages_list) > 0:
             logging.error(f'These {len(self.failed_pages_list)} urls are not crawled: {self.failed_pages_list}')
             # Create the parent path if not exist
@@ -72,37 +100,73 @@ class HouseListSpider(scrapy.Spider):
                 write.writerows([[x] for x in self.failed_pages_list])
                 logging.info(f'{len(self.failed_pages_list)} urls written to {self.error_list_urls_path}')
 
+    def get_chintai_form_data(self):
+        if self.wards is None:
+            return self.chintai_form_data
+        return {**{k: v for k, v in self.chintai_form_data.items() if not k.startswith('cond[city]')},
+                **{f'cond[city][{x}]': x for x in self.wards}}
+
     def start_requests(self):
+        base_url = self.settings.get('LIFULL_BASE_URL', utils.LIFULL_BASE_URL)
         if self.category == constant.MANSION_CHUKO:
-            yield scrapy.Request(url=f'https://www.homes.co.jp/mansion/chuko/tokyo/list', callback=self.fanout_list_page)
+            yield scrapy.Request(url=f'{base_url}/mansion/chuko/tokyo/list', callback=self.fanout_list_page)
         elif self.category == constant.OTHER:
-            yield scrapy.FormRequest(url=f'https://www.homes.co.jp/mansion/tokyo/list/',
+            yield scrapy.FormRequest(url=f'{base_url}/mansion/tokyo/list/',
                                      callback=self.fanout_list_page,
                                      method="POST", formdata=self.other_form_data)
         elif self.category == constant.CHINTAI:
-            yield scrapy.FormRequest(url=f'https://www.homes.co.jp/chintai/tokyo/list/',
+            yield scrapy.FormRequest(url=f'{base_url}/chintai/tokyo/list/',
                                      callback=self.fanout_list_page,
-                                     method="POST", formdata=self.chintai_form_data)
+                                     method="POST", formdata=self.get_chintai_form_data())
 
     # Step 1. Parse the 1st house listing page
     def fanout_list_page(self, response):
         total_num_house = utils.get_int_from_text(response.css('.totalNum::text').get())
         num_pages = utils.get_int_from_text(response.css('.lastPage>span::text').get())
         logging.info(f'Total {total_num_house} houses and {num_pages} pages found.')
-        for page_index in range(num_pages):
+        page_urls = [f'{response.url}?page={page_index + 1}' for page_index in range(num_pages)
+                     if self.page_shard is None or page_index % self.page_shard[1] == self.page_shard[0]]
+        if self.crawl_checkpoint is not None:
+            self.crawl_checkpoint.queue_many({x: None for x in page_urls})
+
+        num_resumed_pages = 0
+        for page_url in page_urls:
+            # Pages finished by an interrupted run are not downloaded again, their items are replayed.
+            if self.crawl_checkpoint is not None and self.crawl_checkpoint.is_completed(page_url):
+                num_resumed_pages += 1
+                yield from self.crawl_checkpoint.completed[page_url]
+                continue
+
             if self.category == constant.CHINTAI:
-                yield scrapy.FormRequest(url=f'{response.url}?page={page_index + 1}',
-                                         callback=self.parse_chintai_list_page,
-                                         method="POST", formdata=self.chintai_form_data,
-                                         errback=self.errback_httpbin)
+                yield scrapy.FormRequest(url=page_url,
+                                         callback=self.parse_list_page,
+                                         method="POST", formdata=self.get_chintai_form_data(),
+                                         errback=self.errback_httpbin,
+                                         cb_kwargs={'page_url': page_url})
             elif self.category == constant.OTHER:
-                yield scrapy.FormRequest(url=f'{response.url}?page={page_index + 1}',
-                                         callback=self.parse_other_list_page,
+                yield scrapy.FormRequest(url=page_url,
+                                         callback=self.parse_list_page,
                                          method="POST", formdata=self.other_form_data,
-                                         errback=self.errback_httpbin)
+                                         errback=self.errback_httpbin,
+                                         cb_kwargs={'page_url': page_url})
             elif self.category == constant.MANSION_CHUKO:
-                yield scrapy.Request(url=f'{response.url}?page={page_index + 1}', callback=self.parse_mansion_list_page,
-                                     errback=self.errback_httpbin)
+                yield scrapy.Request(url=page_url, callback=self.parse_list_page,
+                                     errback=self.errback_httpbin,
+                                     cb_kwargs={'page_url': page_url})
+        if num_resumed_pages > 0:
+            logging.info(f'{num_resumed_pages} pages resumed from the crawl checkpoint.')
+
+    def parse_list_page(self, response, page_url):
+        with metrics.time_extraction(f'{self.category}_list'):
+            if self.category == constant.CHINTAI:
+                items = list(self.parse_chintai_list_page(response))
+            elif self.category == constant.OTHER:
+                items = list(self.parse_other_list_page(response))
+            else:
+                items = list(self.parse_mansion_list_page(response))
+        if self.crawl_checkpoint is not None:
+            self.crawl_checkpoint.complete_many({page_url: items})
+        yield from items
 
     # Step 2. Parse each house listing page and extract house_id
     def parse_mansion_list_page(self, response):
@@ -128,7 +192,7 @@ class HouseListSpider(scrapy.Spider):
                 for house_item in house_item_list:
                     house_link_list.append(house_item.css('.detail>a::attr("href")').get())
                     house_listing_price_list.append(
-                        utils.get_float_from_text(house_item.css('.priceLabel>span.num::text').get()))
+                        text_parsers.parse_price(house_item.css('.priceLabel>span.num::text').get()))
             # Otherwise it only has one house_link -- most likely a PR item
             else:
                 if len(house.css('a.detailLink::attr("href")')) > 0:
@@ -138,7 +202,7 @@ class HouseListSpider(scrapy.Spider):
                     continue
                 if len(house.css('.price>span.num::text')) > 0:
                     house_listing_price_list.append(
-                        utils.get_float_from_text(house.css('.price>span.num::text').get()))
+                        text_parsers.parse_price(house.css('.price>span.num::text').get()))
                 else:
                     house_listing_price_list.append(None)
                     logging.error(f'house_price can not be found for {listing_house_name}.')
@@ -186,7 +250,7 @@ class HouseListSpider(scrapy.Spider):
                 for house_item in house_item_list:
                     house_link_list.append(house_item.css('.detail>a::attr("href")').get())
                     house_listing_price_list.append(
-                        utils.get_float_from_text(house_item.css('.priceLabel>span.num::text').get()))
+                        text_parsers.parse_price(house_item.css('.priceLabel>span.num::text').get()))
             # Otherwise it only has one house_link -- most likely a PR item
             else:
                 if len(house.css('a.detailLink::attr("href")')) > 0:
@@ -196,7 +260,7 @@ class HouseListSpider(scrapy.Spider):
                     continue
                 if len(house.css('.price>span.num::text')) > 0:
                     house_listing_price_list.append(
-                        utils.get_float_from_text(house.css('.price>span.num::text').get()))
+                        text_parsers.parse_price(house.css('.price>span.num::text').get()))
                 else:
                     house_listing_price_list.append(None)
                     logging.error(f'house_price can not be found for {listing_house_name}.')
@@ -248,11 +312,11 @@ class HouseListSpider(scrapy.Spider):
                 for house_item in house_item_list:
                     house_link_list.append(house_item.css('.detail>a::attr("href")').get())
                     listing_house_rent_list.append(
-                        utils.get_float_from_text(house_item.css('.priceLabel>span.num::text').get()))
+                        text_parsers.parse_price(house_item.css('.priceLabel>span.num::text').get()))
                     tmp_l = house_item.css('.price::text').getall()
                     if len(tmp_l) != 2:
                         logging.error(f'Manage fee error format for {listing_house_name}.')
-                    listing_house_manage_fee_list.append(utils.get_float_from_text(tmp_l[0]))
+                    listing_house_manage_fee_list.append(text_parsers.parse_yen(tmp_l[0]))
             # Otherwise it only has one house_link -- most likely a PR item
             else:
                 if len(house.css('a.detailLink::attr("href")')) > 0:
@@ -262,9 +326,9 @@ class HouseListSpider(scrapy.Spider):
                     continue
                 if len(house.css('.price>span.num::text')) > 0 and len(house.css('td.price::text')) > 0:
                     listing_house_rent_list.append(
-                        utils.get_float_from_text(house.css('.price>span.num::text').get()))
+                        text_parsers.parse_price(house.css('.price>span.num::text').get()))
                     listing_house_manage_fee_list.append(
-                        utils.get_float_from_text(house.css('td.price::text').get()))
+                        text_parsers.parse_yen(house.css('td.price::text').get()))
                 else:
                     listing_house_rent_list.append(None)
                     listing_house_manage_fee_list.append(None)
@@ -0,0 +1,401 @@
+"""
+python3 ./main.py --crawl_date 2022-11-15 --city tokyo
+
+python3 ./main.py --crawl_date 2022-11-15 --city tokyo --categories chintai,other --resume
+
+python3 ./main.py --crawl_date 2022-11-15 --city tokyo --stream
+
+python3 ./main.py --crawl_date 2022-11-15 --city tokyo --list_workers 4
+
+python3 ./main.py --crawl_date 2022-11-15 --city tokyo --categories chintai --profile
+
+Run the whole daily crawl in one process instead of the per-category shell scripts:
+
+    list crawl -> list processing -> info crawl   (per category, categories run concurrently)
+    -> summary/alert emails                        (once every category is done)
+
+Failed detail pages are retried inside the info crawl, see house_info_spider/retry.py.
+
+All spiders share one CrawlerProcess/reactor, so scrapy, pandas and the MySQL pool are only
+set up once. Blocking stages (list processing, emails) run in the reactor thread pool.
+Every stage is timed and recorded in `output/YYYY-MM-DD/pipeline_state.json`; with --resume
+the stages already done for that date are skipped, so a failed run restarts at the failed stage.
+
+With --stream the three stages become one `list_stream` stage: list items go through
+house_list_processor/stream.py straight to a concurrently running info spider, so detail pages
+are crawled while list pages are still being fetched.
+
+With --list_workers N the list crawl of every category is split into shards crawled by N worker
+processes, see house_list_spider/sharding.py. It does not apply to --stream.
+
+With --base_url http://localhost:8080 both spiders crawl mock_homes/server.py instead of homes.co.jp.
+
+With --profile every stage is sampled into flamegraph-ready files in `output/YYYY-MM-DD/profiles/`,
+and the stages run on a pool thread are also run under cProfile, see utils/profiling.py.
+The list shard processes of --list_workers are not profiled.
+"""
+import getopt
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOUSE_LIST_SPIDER_DIR = os.path.join(ROOT_DIR, 'house_list_spider')
+HOUSE_LIST_PROCESSOR_DIR = os.path.join(ROOT_DIR, 'house_list_processor')
+HOUSE_INFO_SPIDER_DIR = os.path.join(ROOT_DIR, 'house_info_spider')
+RUNNER_DIR = os.path.join(ROOT_DIR, 'houspider_runner')
+
+# The scrapy projects must win over the same-named outer folders found from ROOT_DIR.
+sys.path.insert(0, HOUSE_INFO_SPIDER_DIR)
+sys.path.insert(0, HOUSE_LIST_SPIDER_DIR)
+sys.path.append('../')
+
+TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
+from scrapy.utils.reactor import install_reactor
+
+install_reactor(TWISTED_REACTOR)
+
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.settings import Settings
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThread
+from twisted.python.failure import Failure
+
+from house_list_spider.spiders.house_list_spider import HouseListSpider
+from house_list_spider import sharding
+from house_info_spider.spiders.house_info_spider import HouseInfoSpider
+from house_list_processor import main as house_list_processor
+from house_list_processor.stream import HouseLinkStream
+from email_monitoring import send_email
+from utils import utils
+from utils import constant
+from utils import profiling
+
+LIST_CRAWL = 'list_crawl'
+LIST_PROCESS = 'list_process'
+INFO_CRAWL = 'info_crawl'
+LIST_STREAM = 'list_stream'
+EMAIL = 'email'
+CATEGORY_STAGES = [LIST_CRAWL, LIST_PROCESS, INFO_CRAWL]
+STREAM_CATEGORY_STAGES = [LIST_STREAM]
+
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def get_file_infix_from_category(category):
+    # Same file names as the old shell scripts: house_links.csv, house_other_links.csv, house_chintai_links.csv...
+    return '' if category == constant.MANSION_CHUKO else f'_{category}'
+
+
+def get_category_paths(crawl_date, category):
+    infix = get_file_infix_from_category(category)
+    list_output_dir = os.path.join(HOUSE_LIST_SPIDER_DIR, 'output', crawl_date)
+    info_output_dir = os.path.join(HOUSE_INFO_SPIDER_DIR, 'output', crawl_date)
+    return {
+        'house_links': os.path.join(list_output_dir, f'house{infix}_links.csv'),
+        'error_list_urls': os.path.join(list_output_dir, f'error{infix}_list_urls.csv'),
+        'house_id_to_crawl': os.path.join(HOUSE_LIST_PROCESSOR_DIR, 'output', crawl_date, f'house{infix}_id_to_crawl.csv'),
+        'error_house_id': os.path.join(info_output_dir, f'error_house{infix}_id.csv'),
+    }
+
+
+def get_profile_name(stage_key):
+    # chintai:info_crawl -> chintai-info_crawl, ':' is not allowed in Windows file names.
+    return stage_key.replace(':', '-')
+
+
+class PipelineState:
+    """
+    Stage results of one crawl_date, saved after every stage so that a later run can resume.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.stages = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.stages = json.load(f).get('stages', {})
+
+    def is_done(self, stage_key):
+        return self.stages.get(stage_key, {}).get('status') == DONE
+
+    def get_failed_stages(self):
+        """
+        :return: {stage_key: stage} of the failed stages and of the ones skipped because of them
+        """
+        return {k: v for k, v in self.stages.items() if v['status'] in (FAILED, SKIPPED)}
+
+    def record(self, stage_key, status, seconds=None, error=None):
+        self.stages[stage_key] = {'status': status, 'seconds': seconds, 'error': error}
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump({'stages': self.stages}, f, indent=2)
+
+
+class HouspiderRunner:
+    def __init__(self, crawl_date, categories, city, strategy, diff_mode, resume, log_file, stream=False,
+                 list_workers=1, base_url=None, profile=False):
+        self.crawl_date = crawl_date
+        self.categories = categories
+        self.city = city
+        self.strategy = strategy
+        self.diff_mode = diff_mode
+        self.log_file = log_file
+        self.stream = stream
+        self.list_workers = list_workers
+        self.base_url = base_url
+        self.profile_dir = os.path.join(RUNNER_DIR, 'output', crawl_date, 'profiles') if profile else None
+        self.state = PipelineState(os.path.join(RUNNER_DIR, 'output', crawl_date, 'pipeline_state.json'))
+        if not resume:
+            self.state.stages = {}
+        self.process = CrawlerProcess(self.get_process_settings())
+        self.exit_code = 0
+
+    def get_process_settings(self):
+        settings = Settings()
+        settings.set('TWISTED_REACTOR', TWISTED_REACTOR)
+        settings.set('LOG_FILE', self.log_file)
+        settings.set('LOG_FILE_APPEND', False)
+        settings.set('LOG_LEVEL', 'INFO')
+        return settings
+
+    def get_crawler_settings(self, settings_module, project_dir, category, feed_path):
+        """
+        Project settings with every relative path made absolute, since all spiders share one working directory.
+        """
+        settings = Settings()
+        settings.setmodule(settings_module, priority='project')
+        settings.set('LOG_FILE', self.log_file)
+        # Each crawler re-installs the log handler, it must not truncate what the others wrote.
+        settings.set('LOG_FILE_APPEND', True)
+        settings.set('FEEDS', {feed_path: {'format': 'csv', 'overwrite': True}})
+        if self.base_url is not None:
+            settings.set('LIFULL_BASE_URL', self.base_url)
+        # One sqlite file per category, the categories crawl concurrently.
+        settings.set('REVALIDATION_CACHE_PATH',
+                     os.path.join(project_dir, 'output', f'revalidation_cache_{category}.sqlite'))
+        for path_setting in ('RAW_PAGE_STORE_DIR', 'DEAD_LETTER_PATH', 'CRAWL_CHECKPOINT_DIR', 'AUTOTUNE_STATE_PATH'):
+            if settings.get(path_setting) is not None:
+                settings.set(path_setting, os.path.join(project_dir, settings.get(path_setting)))
+        return settings
+
+    @defer.inlineCallbacks
+    def crawl(self, spidercls, settings, **spider_kwargs):
+        crawler = Crawler(spidercls, settings)
+        yield self.process.crawl(crawler, **spider_kwargs)
+        finish_reason = crawler.stats.get_value('finish_reason')
+        if finish_reason != 'finished':
+            raise RuntimeError(f'{spidercls.name} finished with {finish_reason}')
+
+    @defer.inlineCallbacks
+    def crawl_house_list_sharded(self, category, paths):
+        is_success = yield deferToThread(sharding.main, paths['house_links'], paths['error_list_urls'], self.log_file,
+                                         self.crawl_date, category, self.list_workers, base_url=self.base_url)
+        if not is_success:
+            raise RuntimeError(f'{category} list shards failed, see {paths["error_list_urls"]}')
+
+    def crawl_house_list(self, category, paths):
+        if self.list_workers > 1:
+            return self.crawl_house_list_sharded(category, paths)
+        settings = self.get_crawler_settings('house_list_spider.settings', HOUSE_LIST_SPIDER_DIR, category,
+                                             paths['house_links'])
+        return self.crawl(HouseListSpider, settings,
+                          error_list_urls_path=paths['error_list_urls'],
+                          category=category,
+                          crawl_date=self.crawl_date)
+
+    def defer_to_thread(self, stage_key, fn, *args):
+        if self.profile_dir is None:
+            return deferToThread(fn, *args)
+        return deferToThread(profiling.profile_call, get_profile_name(stage_key), self.profile_dir, fn, *args)
+
+    def process_house_list(self, category, paths):
+        return self.defer_to_thread(f'{category}:{LIST_PROCESS}', house_list_processor.main,
+                                    paths['house_links'], paths['house_id_to_crawl'], self.strategy,
+                                    self.crawl_date, category, self.city, self.diff_mode)
+
+    def crawl_house_info(self, category, paths):
+        settings = self.get_crawler_settings('house_info_spider.settings', HOUSE_INFO_SPIDER_DIR, category,
+                                             paths['error_house_id'])
+        return self.crawl(HouseInfoSpider, settings,
+                          i=paths['house_id_to_crawl'], m='original',
+                          crawl_date=self.crawl_date, category=category, city=self.city)
+
+    @defer.inlineCallbacks
+    def stream_house_list(self, category, paths):
+        """
+        Run the list and info spiders side by side, connected by a HouseLinkStream.
+        """
+        link_stream = HouseLinkStream(category, self.crawl_date, self.city, paths['house_id_to_crawl'],
+                                      self.strategy, self.diff_mode)
+        yield deferToThread(link_stream.load)
+
+        def close_link_stream(result):
+            # A list crawl that never reached close_spider must not leave the info spider waiting.
+            link_stream.close(failure=result if isinstance(result, Failure) else None)
+            return result
+
+        list_settings = self.get_crawler_settings('house_list_spider.settings', HOUSE_LIST_SPIDER_DIR, category,
+                                                  paths['house_links'])
+        list_d = self.crawl(HouseListSpider, list_settings,
+                            error_list_urls_path=paths['error_list_urls'],
+                            category=category,
+                            crawl_date=self.crawl_date,
+                            link_stream=link_stream)
+        list_d.addBoth(close_link_stream)
+        info_settings = self.get_crawler_settings('house_info_spider.settings', HOUSE_INFO_SPIDER_DIR, category,
+                                                  paths['error_house_id'])
+        info_d = self.crawl(HouseInfoSpider, info_settings,
+                            i=paths['house_id_to_crawl'], m='stream',
+                            crawl_date=self.crawl_date, category=category, city=self.city,
+                            link_stream=link_stream)
+        results = yield defer.DeferredList([list_d, info_d], consumeErrors=True)
+        for is_success, result in results:
+            if not is_success:
+                result.raiseException()
+        if link_stream.failure is not None:
+            link_stream.failure.raiseException()
+
+    def send_emails(self):
+        send_email.main('summary', self.crawl_date)
+        send_email.main('alert', self.crawl_date, self.state.get_failed_stages())
+
+    @defer.inlineCallbacks
+    def run_stage(self, stage_key, stage_fn, *args):
+        """
+        :return: True if the stage is done, either now or by an earlier run
+        """
+        if self.state.is_done(stage_key):
+            logging.info(f'{stage_key} already done, skipped.')
+            return True
+        logging.info(f'{stage_key} started.')
+        profile = None
+        if self.profile_dir is not None:
+            profile = profiling.StageProfile(get_profile_name(stage_key), self.profile_dir).start()
+        start_time = time.time()
+        try:
+            yield stage_fn(*args)
+        except Exception as e:
+            elapsed = time.time() - start_time
+            logging.exception(f'{stage_key} failed after {elapsed:.1f}s')
+            self.state.record(stage_key, FAILED, round(elapsed, 1), repr(e))
+            self.exit_code = 1
+            return False
+        finally:
+            if profile is not None:
+                profile.stop()
+        elapsed = time.time() - start_time
+        logging.info(f'{stage_key} finished in {elapsed:.1f}s.')
+        self.state.record(stage_key, DONE, round(elapsed, 1))
+        return True
+
+    @defer.inlineCallbacks
+    def run_category(self, category):
+        paths = get_category_paths(self.crawl_date, category)
+        stage_fns = {
+            LIST_CRAWL: self.crawl_house_list,
+            LIST_PROCESS: self.process_house_list,
+            INFO_CRAWL: self.crawl_house_info,
+            LIST_STREAM: self.stream_house_list,
+        }
+        stages = STREAM_CATEGORY_STAGES if self.stream else CATEGORY_STAGES
+        for idx, stage in enumerate(stages):
+            is_done = yield self.run_stage(f'{category}:{stage}', stage_fns[stage], category, paths)
+            if not is_done:
+                # Later stages depend on this one's output.
+                for skipped_stage in stages[idx + 1:]:
+                    self.state.record(f'{category}:{skipped_stage}', SKIPPED)
+                return
+
+    @defer.inlineCallbacks
+    def run_all(self):
+        start_time = time.time()
+        try:
+            yield defer.DeferredList([self.run_category(category) for category in self.categories])
+            # The alert email also reports the failed stages, so always send it.
+            yield self.run_stage(EMAIL, self.defer_to_thread, EMAIL, self.send_emails)
+            logging.info(f'Pipeline for {self.crawl_date} finished in {time.time() - start_time:.1f}s: '
+                         f'{json.dumps(self.state.stages)}')
+        finally:
+            reactor.stop()
+
+    def run(self):
+        reactor.callWhenRunning(self.run_all)
+        self.process.start(stop_after_crawl=False)
+        return self.exit_code
+
+
+if __name__ == "__main__":
+    usage = 'main.py --crawl_date <crawl_date> --city <city> --categories <category,...> -s <strategy> -m <diff_mode> ' \
+            '--logfile <log_file> --resume --stream --list_workers <num_workers> ' \
+            '--base_url <base_url> --profile'
+    crawl_date = utils.get_date_str_today()
+    categories = [constant.CHINTAI, constant.OTHER, constant.MANSION_CHUKO]
+    city = 'tokyo'
+    strategy = 'update_only'
+    diff_mode = 'dataframe'
+    log_file = ''
+    resume = False
+    stream = False
+    list_workers = 1
+    base_url = None
+    profile = False
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hs:m:l:",
+                                   ["crawl_date=", "city=", "categories=", "strategy=", "mode=", "logfile=",
+                                    "resume", "stream", "list_workers=", "base_url=", "profile"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("--crawl_date"):
+            crawl_date = arg
+        elif opt in ("--city"):
+            city = arg
+        elif opt in ("--categories"):
+            categories = arg.split(',')
+        elif opt in ("-s", "--strategy"):
+            strategy = arg
+        elif opt in ("-m", "--mode"):
+            diff_mode = arg
+        elif opt in ("-l", "--logfile"):
+            log_file = arg
+        elif opt in ("--resume"):
+            resume = True
+        elif opt in ("--stream"):
+            stream = True
+        elif opt in ("--list_workers"):
+            list_workers = int(arg)
+        elif opt in ("--base_url"):
+            base_url = arg
+        elif opt in ("--profile"):
+            profile = True
+    assert strategy in ('update_only', 'all')
+    assert diff_mode in ('dataframe', 'staging')
+    assert all(x in (constant.MANSION_CHUKO, constant.OTHER, constant.CHINTAI) for x in categories)
+    if log_file == '':
+        log_file = os.path.join(RUNNER_DIR, 'log', f'{crawl_date}-log.txt')
+    os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+
+    print('Crawl_date:', crawl_date)
+    print('Categories:', categories)
+    print('city:', city)
+    print('Strategy used:', strategy)
+    print('Diff mode used:', diff_mode)
+    print('Resume:', resume)
+    print('Stream:', stream)
+    print('List workers:', list_workers)
+    print('Base url:', base_url or 'default')
+    print('Profile:', profile)
+    print('Log to file:', log_file)
+
+    sys.exit(HouspiderRunner(crawl_date, categories, city, strategy, diff_mode, resume, log_file, stream,
+                             list_workers, base_url, profile).run())
@@ -0,0 +1,11 @@
+#!/usr/bin/bash
+export PATH="/home/ubuntu/.autojump/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/usr/games:/usr/local/games:/snap/bin:/home/ubuntu/.local/bin"
+
+today=$(TZ=America/Los_Angeles date '+%Y-%m-%d')
+
+# Run list crawl -> list processing -> info crawl for every category, then send the emails.
+# Re-run with --resume to continue from the stage that failed.
+cd /home/ubuntu/houspiders/houspider_runner
+python3 ./main.py --crawl_date ${today} --city tokyo \
+--categories chintai,other,mansion_chuko \
+--logfile log/${today}-log.txt
@@ -0,0 +1,428 @@
+"""
+python3 ./server.py --port 8080 --listings 20000 --day 0 --churn 0.02 --price_change 0.05 \
+--latency_ms 200 --jitter_ms 100 --error_rate 0.01 --throttle_rate 0.005 --logfile log/mock_homes.txt
+
+python3 ./server.py --port 8080 --fixture_dir ../parser_benchmark/fixtures
+
+Local stand-in for www.homes.co.jp, to load-test the whole crawl (list spider, list processor,
+info spider and the MySQL write path) on one box. Point the spiders at it with
+`-s LIFULL_BASE_URL=http://localhost:8080` (or `houspider_runner/main.py --base_url`).
+
+Every category has `--listings` houses alive on a given day. From one day to the next `--churn` of
+them are delisted and as many new ones are listed, and `--price_change` of the alive ones change price,
+so consecutive "days" exercise the new/updated/unavailable paths of house_list_processor.
+The day is `--day` at start and can be moved with `GET /_mock/day?day=N`; `GET /_mock/stats` returns
+the served requests per route and status.
+
+Served pages:
+
+- list pages: GET /mansion/chuko/tokyo/list, POST /mansion/tokyo/list/ (other) and
+  POST /chintai/tokyo/list/ (filtered by the cond[city][...] wards), `?page=N`;
+- detail pages: /mansion/b-ID/, /other/b-ID/, /chintai/b-ID/, /chintai/room/ID. Delisted houses get
+  a 404, a `.mod-expiredInformation` or a `.mod-bukkenNotFound` page, unknown ones a 404.
+
+Detail pages are generated, or taken from the parser_benchmark corpus with --fixture_dir
+(its `mansion`/`rent` pages, picked by house_id, served as is).
+Every response is delayed by `--latency_ms` +- `--jitter_ms`, and fails with a 503 (`--error_rate`)
+or a 429 (`--throttle_rate`).
+"""
+import getopt
+import json
+import logging
+import os
+import random
+import re
+import sys
+import zlib
+from collections import Counter
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+sys.path.append('../')
+
+from utils import constant
+
+CHINTAI_WARDS = constant.TOKYO_23_WARD_CODES
+# Keeps the house_ids of the categories apart
+CATEGORY_ID_OFFSETS = {
+    constant.MANSION_CHUKO: 1000000000,
+    constant.OTHER: 2000000000,
+    constant.CHINTAI: 3000000000,
+}
+
+LIST_PATHS = {
+    '/mansion/chuko/tokyo/list': constant.MANSION_CHUKO,
+    '/mansion/tokyo/list': constant.OTHER,
+    '/chintai/tokyo/list': constant.CHINTAI,
+}
+DETAIL_PATH_PATTERN = re.compile(r'^/(mansion|other|chintai)/(?:b-|room/)(\d+)/?$')
+DETAIL_CATEGORIES = {'mansion': constant.MANSION_CHUKO, 'other': constant.OTHER, 'chintai': constant.CHINTAI}
+
+EXPIRED_PAGE = '<html><body><div class="mod-expiredInformation">掲載が終了しました</div></body></html>'
+NOT_FOUND_PAGE = '<html><body><div class="mod-bukkenNotFound">物件が見つかりません</div></body></html>'
+
+LIST_PAGE_TEMPLATE = '''<html><body>
+<div class="totalNum">{total_num}件</div>
+<div class="lastPage"><span>{num_pages}</span></div>
+{houses}
+</body></html>'''
+
+SALE_LIST_HOUSE_TEMPLATE = '''<div class="moduleInner">{pr_icon}
+<h3 class="bukkenName">{name}</h3>
+<a class="detailLink" href="/{path}/b-{house_id}/"></a>
+<div class="price"><span class="num">{price}</span>万円</div>
+</div>'''
+
+RENT_LIST_HOUSE_TEMPLATE = '''<div class="moduleInner">{pr_icon}
+<h3 class="bukkenName">{name}</h3>
+<a class="detailLink" href="/chintai/b-{house_id}/"></a>
+<table><tr><td class="price">{manage_fee}円 / <span class="num">{rent}</span>万円</td></tr></table>
+</div>'''
+
+SALE_DETAIL_TEMPLATE = '''<html><body>
+<div class="mod-buildingName"><span class="bukkenName">{name}</span><span class="bukkenRoom">{room}号室</span></div>
+<div class="mod-detailTopSale">
+<p id="chk-bkc-moneyroom"><span class="num"><span>{price}</span></span>万円</p>
+<p id="chk-bkc-fulladdress">東京都{district}{block}丁目</p>
+<p id="chk-bkc-moneykyoueki">{manage_fee}円</p>
+<p id="chk-bkc-moneyshuuzen">{repair_fee}円</p>
+<div id="chk-bkc-fulltraffic"><p>JR山手線 {station}駅 徒歩{walk}分</p></div>
+<p id="chk-bkc-kenchikudate">{build_year}年{build_month}月 (築{age}年)</p>
+<p id="chk-bkc-housearea">{house_area}m²</p>
+<p id="chk-bkc-balconyarea">{balcony_area}m²</p>
+<p id="chk-bkc-marodi">{floor_plan}</p>
+<p id="chk-bkh-newdate">{register_date}</p>
+</div>
+<div class="mod-bukkenSpecDetail">
+<p id="chk-bkd-allunit">{unit_num}戸</p>
+<p id="chk-bkd-housekai">{floor}階 / {total_floor}階建</p>
+<p id="chk-bkd-housekouzou">RC</p>
+<p id="chk-bkd-landright">所有権</p>
+<p id="chk-bkd-landkokudoho">不要</p>
+<p id="chk-bkd-management">全部委託</p>
+<div id="chk-bkd-genkyo"><span class="genkyoText">空家</span></div>
+<p id="chk-bkd-taiyou">仲介</p>
+</div>
+<div class="mod-bukkenNotes"><table>
+<tr><th>設備・サービス</th><td><ul class="normalEquipment"><li>エレベーター</li><li>オートロック</li></ul></td></tr>
+<tr><th>物件の状況</th><td>リフォーム済</td></tr>
+<tr><th>備考</th><td id="chk-bkf-biko">house_id {house_id}</td></tr>
+</table></div>
+</body></html>'''
+
+RENT_DETAIL_TEMPLATE = '''<html><body>
+<div class="mod-detailTopRent">
+<span class="bukkenName">{name}</span><span class="bukkenRoom">{room}号室</span>
+<div class="price"><span id="chk-bkc-moneyroom"><span class="num"><span>{rent}</span></span>万円 ({manage_fee}円)</span></div>
+<p id="chk-bkc-moneyshikirei">1ヶ月 / 1ヶ月</p>
+<p id="chk-bkc-moneyhoshoukyaku">- / -</p>
+<p id="chk-bkc-fulladdress">東京都{district}{block}丁目</p>
+<div id="chk-bkc-fulltraffic"><p>JR山手線 {station}駅 徒歩{walk}分</p></div>
+<p id="chk-bkc-kenchikudate">{build_year}年{build_month}月 (築{age}年)</p>
+<p id="chk-bkc-housearea">{house_area}m²</p>
+<p id="chk-bkc-balconyarea">{balcony_area}m²</p>
+<p id="chk-bkc-marodi">{floor_plan}</p>
+</div>
+<div class="mod-bukkenSpecDetail">
+<p id="chk-bkd-housekouzou">RC</p>
+<p id="chk-bkd-housekai">{floor}階 / {total_floor}階建</p>
+<p id="chk-bkd-conterm">2年</p>
+<p id="chk-bkd-guaranteecom">利用必須</p>
+<p id="chk-bkd-insurance">要</p>
+<p id="chk-bkd-genkyo">空家</p>
+<div id="chk-bkd-usable"><div class="spec">即入居可</div></div>
+<p id="chk-bkd-taiyou">仲介</p>
+<p id="chk-bkd-newdate">{register_date}</p>
+</div>
+<div class="mod-bukkenNotes"><table>
+<tr><th>設備・サービス</th><td><ul class="normalEquipment"><li>エレベーター</li><li>バス・トイレ別</li></ul></td></tr>
+<tr><th>入居条件</th><td>二人入居可</td></tr>
+<tr><th>備考</th><td id="chk-bkf-biko">house_id {house_id}</td></tr>
+</table></div>
+</body></html>'''
+
+
+def get_fraction(*keys):
+    """
+    :return: A deterministic pseudo random number in [0, 1) for the keys
+    """
+    return zlib.crc32(':'.join(str(x) for x in keys).encode('utf-8')) / 2 ** 32
+
+
+class MockListings:
+    """
+    The houses of one category: on day d the alive ones are the indexes [d * k, d * k + num_listings)
+    with k = num_listings * churn, so every day the k oldest are delisted and k new ones listed.
+    """
+
+    def __init__(self, category, num_listings, churn, price_change, pr_rate=0.02):
+        self.category = category
+        self.num_listings = num_listings
+        self.num_daily_changes = int(num_listings * churn)
+        self.price_change = price_change
+        self.pr_rate = pr_rate
+        self.id_offset = CATEGORY_ID_OFFSETS[category]
+
+    def get_alive_indexes(self, day):
+        start = day * self.num_daily_changes
+        return range(start, start + self.num_listings)
+
+    def get_index(self, house_id):
+        return int(house_id) - self.id_offset
+
+    def get_house_id(self, index):
+        return self.id_offset + index
+
+    def get_status(self, index, day):
+        """
+        :return: 'alive', 'delisted' or 'unknown'
+        """
+        alive_indexes = self.get_alive_indexes(day)
+        if index in alive_indexes:
+            return 'alive'
+        if 0 <= index < alive_indexes.start:
+            return 'delisted'
+        return 'unknown'
+
+    def get_ward(self, index):
+        return CHINTAI_WARDS[int(get_fraction(self.category, index, 'ward') * len(CHINTAI_WARDS))]
+
+    def get_price_factor(self, index, day):
+        # Every price change on the way to `day` is a 1% cut, like most listings do.
+        num_changes = sum(1 for x in range(1, day + 1) if get_fraction(self.category, index, x) < self.price_change)
+        return 0.99 ** num_changes
+
+    def get_house(self, index, day):
+        fraction = get_fraction(self.category, index)
+        price_factor = self.get_price_factor(index, day)
+        district = constant.TOKYO_DISTRICTS[int(get_fraction(self.category, index, 'district')
+                                                * len(constant.TOKYO_DISTRICTS))]
+        build_year = 1980 + int(fraction * 42)
+        return {
+            'house_id': self.get_house_id(index),
+            'name': f'モックレジデンス{index}',
+            'room': 101 + int(fraction * 1000),
+            'is_pr_item': get_fraction(self.category, index, 'pr') < self.pr_rate,
+            'price': round((1500 + fraction * 13500) * price_factor),
+            'rent': round((5 + fraction * 45) * price_factor, 1),
+            'manage_fee': 1000 * int(fraction * 30),
+            'repair_fee': 500 * int(fraction * 40),
+            'district': district,
+            'block': 1 + int(fraction * 5),
+            'station': district.rstrip('区'),
+            'walk': 1 + int(fraction * 20),
+            'build_year': build_year,
+            'build_month': 1 + int(fraction * 12),
+            'age': 2022 - build_year,
+            'house_area': round(20 + fraction * 80, 2),
+            'balcony_area': round(fraction * 15, 2),
+            'floor_plan': ['1K', '1LDK', '2LDK', '3LDK'][int(fraction * 4)],
+            'register_date': f'2022/{1 + int(fraction * 12):02d}/01',
+            'unit_num': 20 + int(fraction * 300),
+            'floor': 1 + int(fraction * 10),
+            'total_floor': 11 + int(fraction * 20),
+        }
+
+
+class MockHomesResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, listings, day, page_size, latency, jitter, error_rate, throttle_rate, fixture_pages):
+        super().__init__()
+        self.listings = listings
+        self.day = day
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        # 'mansion'/'rent' -> [page body]
+        self.fixture_pages = fixture_pages
+        self.stats = Counter()
+
+    def render(self, request):
+        delay = max(0.0, random.gauss(self.latency, self.jitter)) if self.latency > 0 else 0
+        reactor.callLater(delay, self.respond, request)
+        return server.NOT_DONE_YET
+
+    def respond(self, request):
+        path = request.path.decode('utf-8')
+        route, status, body = self.route(request, path)
+        self.stats[f'{route} {status}'] += 1
+        request.setResponseCode(status)
+        request.setHeader(b'content-type', b'text/html; charset=utf-8' if route != 'admin'
+                          else b'application/json')
+        request.write(body.encode('utf-8'))
+        request.finish()
+
+    def route(self, request, path):
+        """
+        :return: (route name, status, body)
+        """
+        if path.startswith('/_mock/'):
+            return 'admin', 200, self.render_admin(request, path)
+        if path == '/robots.txt':
+            return 'robots', 200, 'User-agent: *\nAllow: /\n'
+
+        fraction = random.random()
+        if fraction < self.error_rate:
+            return 'error', 503, 'Service Unavailable'
+        if fraction < self.error_rate + self.throttle_rate:
+            return 'throttle', 429, 'Too Many Requests'
+
+        category = LIST_PATHS.get(path.rstrip('/'))
+        if category is not None:
+            return f'list:{category}', 200, self.render_list_page(request, category)
+        match = DETAIL_PATH_PATTERN.match(path)
+        if match is not None:
+            category = DETAIL_CATEGORIES[match.group(1)]
+            status, body = self.render_detail_page(category, match.group(2))
+            return f'detail:{category}', status, body
+        return 'unknown', 404, 'Not Found'
+
+    def render_admin(self, request, path):
+        if path == '/_mock/day':
+            if b'day' in request.args:
+                self.day = int(request.args[b'day'][0])
+                logging.info(f'Day moved to {self.day}.')
+            return json.dumps({'day': self.day})
+        return json.dumps({'day': self.day, 'requests': dict(self.stats)}, indent=2)
+
+    def get_requested_wards(self, request):
+        wards = [x.decode('utf-8') for key, values in request.args.items()
+                 if key.decode('utf-8').startswith('cond[city]') for x in values]
+        return set(wards) if len(wards) > 0 else None
+
+    def render_list_page(self, request, category):
+        listings = self.listings[category]
+        indexes = listings.get_alive_indexes(self.day)
+        if category == constant.CHINTAI:
+            wards = self.get_requested_wards(request)
+            if wards is not None and len(wards) < len(CHINTAI_WARDS):
+                indexes = [x for x in indexes if listings.get_ward(x) in wards]
+        num_pages = max(1, (len(indexes) + self.page_size - 1) // self.page_size)
+        page = int(request.args.get(b'page', [b'1'])[0])
+        page_indexes = indexes[(page - 1) * self.page_size:page * self.page_size]
+        houses = []
+        for index in page_indexes:
+            house = listings.get_house(index, self.day)
+            pr_icon = '<span class="icon">PR</span>' if house['is_pr_item'] else ''
+            if category == constant.CHINTAI:
+                houses.append(RENT_LIST_HOUSE_TEMPLATE.format(pr_icon=pr_icon, **house))
+            else:
+                path = 'mansion' if category == constant.MANSION_CHUKO else 'other'
+                houses.append(SALE_LIST_HOUSE_TEMPLATE.format(pr_icon=pr_icon, path=path, **house))
+        return LIST_PAGE_TEMPLATE.format(total_num=len(indexes), num_pages=num_pages, houses='\n'.join(houses))
+
+    def render_detail_page(self, category, house_id):
+        """
+        :return: (status, body)
+        """
+        listings = self.listings[category]
+        index = listings.get_index(house_id)
+        status = listings.get_status(index, self.day)
+        if status == 'unknown':
+            return 404, 'Not Found'
+        if status == 'delisted':
+            fraction = get_fraction(category, index, 'expired')
+            if fraction < 0.4:
+                return 404, 'Not Found'
+            return 200, EXPIRED_PAGE if fraction < 0.8 else NOT_FOUND_PAGE
+
+        kind = 'rent' if category == constant.CHINTAI else 'mansion'
+        fixture_pages = self.fixture_pages.get(kind, [])
+        if len(fixture_pages) > 0:
+            return 200, fixture_pages[index % len(fixture_pages)]
+        template = RENT_DETAIL_TEMPLATE if category == constant.CHINTAI else SALE_DETAIL_TEMPLATE
+        return 200, template.format(**listings.get_house(index, self.day))
+
+
+def read_fixture_pages(fixture_dir):
+    """
+    :return: {'mansion'/'rent': [page body]} of the parser_benchmark corpus
+    """
+    fixture_pages = {}
+    with open(os.path.join(fixture_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    for page in manifest:
+        if page['kind'] not in ('mansion', 'rent'):
+            continue
+        with open(os.path.join(fixture_dir, page['kind'], f'{page["name"]}.html'), encoding='utf-8') as f:
+            fixture_pages.setdefault(page['kind'], []).append(f.read())
+    return fixture_pages
+
+
+if __name__ == "__main__":
+    usage = 'server.py --port <port> --listings <num_listings> --day <day> --churn <churn> ' \
+            '--price_change <price_change> --page_size <page_size> --latency_ms <ms> --jitter_ms <ms> ' \
+            '--error_rate <rate> --throttle_rate <rate> --fixture_dir <dir> --logfile <log_file>'
+    port = 8080
+    num_listings = 20000
+    day = 0
+    churn = 0.02
+    price_change = 0.05
+    page_size = 30
+    latency_ms = 0
+    jitter_ms = 0
+    error_rate = 0
+    throttle_rate = 0
+    fixture_dir = ''
+    log_file = ''
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp:l:",
+                                   ["port=", "listings=", "day=", "churn=", "price_change=", "page_size=",
+                                    "latency_ms=", "jitter_ms=", "error_rate=", "throttle_rate=", "fixture_dir=",
+                                    "logfile="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-p", "--port"):
+            port = int(arg)
+        elif opt in ("--listings"):
+            num_listings = int(arg)
+        elif opt in ("--day"):
+            day = int(arg)
+        elif opt in ("--churn"):
+            churn = float(arg)
+        elif opt in ("--price_change"):
+            price_change = float(arg)
+        elif opt in ("--page_size"):
+            page_size = int(arg)
+        elif opt in ("--latency_ms"):
+            latency_ms = float(arg)
+        elif opt in ("--jitter_ms"):
+            jitter_ms = float(arg)
+        elif opt in ("--error_rate"):
+            error_rate = float(arg)
+        elif opt in ("--throttle_rate"):
+            throttle_rate = float(arg)
+        elif opt in ("--fixture_dir"):
+            fixture_dir = arg
+        elif opt in ("-l", "--logfile"):
+            log_file = arg
+
+    print('Port:', port)
+    print('Listings per category:', num_listings)
+    print('Day:', day)
+    print('Churn/price change:', churn, price_change)
+    print('Latency:', latency_ms, '+-', jitter_ms, 'ms')
+    print('Error/throttle rate:', error_rate, throttle_rate)
+    print('Fixture dir:', fixture_dir)
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO,
+                        filename=log_file or None)
+
+    listings = {category: MockListings(category, num_listings, churn, price_change) for category in CATEGORY_ID_OFFSETS}
+    fixture_pages = read_fixture_pages(fixture_dir) if fixture_dir != '' else {}
+    site = server.Site(MockHomesResource(listings, day, page_size, latency_ms / 1000, jitter_ms / 1000, error_rate,
+                                         throttle_rate, fixture_pages))
+    reactor.listenTCP(port, site)
+    logging.info(f'Mock homes.co.jp listening on {port}.')
+    reactor.run()
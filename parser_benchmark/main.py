@@ -0,0 +1,356 @@
+"""
+python3 ./main.py -m record --raw_page_dir ../house_info_spider/output/raw_pages --store segment \
+--category mansion_chuko --limit 50
+
+python3 ./main.py -m record --page_kind chintai_list --file ~/chintai_list_page_2.html \
+--url https://www.homes.co.jp/chintai/tokyo/list/?page=2
+
+python3 ./main.py -m golden
+
+python3 ./main.py -n 20
+
+Offline benchmark of the page parsers over a corpus of saved pages:
+
+- MansionInfo (kind `mansion`) and RentInfo (kind `rent`) on detail pages;
+- HouseListSpider.parse_mansion_list_page/parse_other_list_page/parse_chintai_list_page
+  (kinds `mansion_list`, `other_list`, `chintai_list`) on list pages.
+
+The corpus lives in `fixtures/`: `manifest.json` lists every page as {"kind", "name", "url"},
+the page is `fixtures/<kind>/<name>.html` and its golden output `fixtures/<kind>/<name>.json`.
+`-m record` adds pages (detail pages from the raw page store, list pages one file at a time),
+`-m golden` (re)writes the golden outputs with the current parsers, and the default `-m run`
+reports per kind pages/sec, the time of every FieldSpec field and of the utils/text_parsers.py parser
+of every numeric field, the peak Python heap per page (tracemalloc, lxml's own memory is not traced) and
+the pages whose output differs from the golden, field by field. It exits with 1 if any output differs, a page
+has no golden output or no page of the requested kinds is in the corpus, so an optimization can be checked to be
+faster and not wrong before it is deployed.
+"""
+import getopt
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+# The scrapy project must win over the same-named outer folder found from ROOT_DIR.
+sys.path.insert(0, os.path.join(ROOT_DIR, 'house_list_spider'))
+sys.path.append(ROOT_DIR)
+
+from scrapy.http import HtmlResponse
+
+from house_info_processor import raw_page_store
+from house_info_processor.mansion_info import MansionInfo, MANSION_FIELD_SPEC
+from house_info_processor.rent_info import RentInfo, RENT_FIELD_SPEC
+from house_list_spider.spiders.house_list_spider import HouseListSpider
+from utils import constant
+from utils import text_parsers
+from utils import utils
+
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, 'fixtures')
+MANIFEST_PATH = os.path.join(FIXTURE_DIR, 'manifest.json')
+
+MANSION = 'mansion'
+RENT = 'rent'
+MANSION_LIST = 'mansion_list'
+OTHER_LIST = 'other_list'
+CHINTAI_LIST = 'chintai_list'
+KINDS = [MANSION, RENT, MANSION_LIST, OTHER_LIST, CHINTAI_LIST]
+
+LIST_PARSER_CATEGORIES = {
+    MANSION_LIST: constant.MANSION_CHUKO,
+    OTHER_LIST: constant.OTHER,
+    CHINTAI_LIST: constant.CHINTAI,
+}
+
+# FieldSpec field -> text parser reading it in MansionInfo/RentInfo
+TEXT_PARSER_FIELDS = {
+    MANSION: {
+        'price_inner': text_parsers.parse_price,
+        'moneykyoueki': text_parsers.parse_yen,
+        'moneyshuuzen': text_parsers.parse_yen,
+        'traffic': text_parsers.parse_walk_minutes,
+        'build_date': text_parsers.parse_year_month,
+        'house_area': text_parsers.parse_area,
+        'floor_infos': text_parsers.parse_floors,
+        'other_fee_details': text_parsers.parse_yen_total,
+    },
+    RENT: {
+        'rent': text_parsers.parse_price,
+        'manage_fee': text_parsers.parse_yen,
+        'traffic': text_parsers.parse_walk_minutes,
+        'build_date': text_parsers.parse_year_month,
+        'house_area': text_parsers.parse_area,
+        'floor_infos': text_parsers.parse_floors,
+        'other_fee_details': text_parsers.parse_yen_total,
+    },
+}
+
+
+def get_parser(kind):
+    """
+    :return: A function from (page, response) to the json-serializable output of the parser
+    """
+    if kind == MANSION:
+        return lambda page, response: MansionInfo(page['name'], response).to_dict()
+    if kind == RENT:
+        return lambda page, response: RentInfo(page['name'], response).to_dict()
+    category = LIST_PARSER_CATEGORIES[kind]
+    spider = HouseListSpider(error_list_urls_path='', category=category)
+    parse_fn = {
+        constant.MANSION_CHUKO: spider.parse_mansion_list_page,
+        constant.OTHER: spider.parse_other_list_page,
+        constant.CHINTAI: spider.parse_chintai_list_page,
+    }[category]
+    return lambda page, response: list(parse_fn(response))
+
+
+def get_field_spec(kind):
+    return {MANSION: MANSION_FIELD_SPEC, RENT: RENT_FIELD_SPEC}.get(kind)
+
+
+def read_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return []
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest):
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(sorted(manifest, key=lambda x: (x['kind'], x['name'])), f, indent=2)
+
+
+def get_fixture_path(page, suffix):
+    return os.path.join(FIXTURE_DIR, page['kind'], f'{page["name"]}{suffix}')
+
+
+def load_response(page):
+    with open(get_fixture_path(page, '.html'), 'rb') as f:
+        return HtmlResponse(url=page['url'], body=f.read(), encoding='utf-8')
+
+
+def normalize_output(output):
+    # Tuples become lists like in the golden json.
+    return json.loads(json.dumps(output, ensure_ascii=False))
+
+
+def add_page(manifest, kind, name, url, body):
+    page = {'kind': kind, 'name': name, 'url': url}
+    os.makedirs(os.path.dirname(get_fixture_path(page, '.html')), exist_ok=True)
+    with open(get_fixture_path(page, '.html'), 'wb') as f:
+        f.write(body)
+    manifest[:] = [x for x in manifest if (x['kind'], x['name']) != (kind, name)] + [page]
+
+
+def record_raw_pages(raw_page_dir, store_type, category, limit):
+    """
+    Copy detail pages saved by house_info_spider into the corpus.
+    """
+    manifest = read_manifest()
+    kind = RENT if category == constant.CHINTAI else MANSION
+    get_url = {
+        constant.MANSION_CHUKO: utils.get_lifull_mansion_url_from_house_id,
+        constant.OTHER: utils.get_lifull_other_url_from_house_id,
+        constant.CHINTAI: utils.get_lifull_chintai_url_from_house_id,
+    }[category]
+    num_pages = 0
+    for house_id, body in raw_page_store.iter_pages(raw_page_dir, store_type, category=category):
+        if num_pages >= limit:
+            break
+        add_page(manifest, kind, house_id, get_url(house_id), body)
+        num_pages += 1
+    write_manifest(manifest)
+    print(f'{num_pages} {kind} pages recorded.')
+
+
+def record_file(kind, file_path, url):
+    manifest = read_manifest()
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    with open(file_path, 'rb') as f:
+        add_page(manifest, kind, name, url, f.read())
+    write_manifest(manifest)
+    print(f'{file_path} recorded as {kind} page {name}.')
+
+
+def write_golden():
+    manifest = read_manifest()
+    for page in manifest:
+        output = normalize_output(get_parser(page['kind'])(page, load_response(page)))
+        with open(get_fixture_path(page, '.json'), 'w') as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
+    print(f'{len(manifest)} golden outputs written.')
+
+
+def diff_output(golden, output, prefix=''):
+    """
+    :return: [(field path, golden value, output value)] of the fields that differ
+    """
+    if isinstance(golden, dict) and isinstance(output, dict):
+        diffs = []
+        for key in sorted(set(golden) | set(output)):
+            diffs += diff_output(golden.get(key), output.get(key), f'{prefix}.{key}' if prefix else key)
+        return diffs
+    if isinstance(golden, list) and isinstance(output, list) and len(golden) == len(output) \
+            and any(isinstance(x, dict) for x in golden):
+        diffs = []
+        for idx, (golden_item, item) in enumerate(zip(golden, output)):
+            diffs += diff_output(golden_item, item, f'{prefix}[{idx}]')
+        return diffs
+    return [] if golden == output else [(prefix, golden, output)]
+
+
+def benchmark_kind(kind, pages, num_runs):
+    """
+    :return: Number of pages whose output differs from the golden or that have no golden
+    """
+    parser = get_parser(kind)
+    responses = [load_response(x) for x in pages]
+
+    # Output equality, also warms up the parsers.
+    num_different_pages = 0
+    for page, response in zip(pages, responses):
+        golden_path = get_fixture_path(page, '.json')
+        if not os.path.exists(golden_path):
+            print(f'  {page["name"]}: no golden output, run -m golden')
+            num_different_pages += 1
+            continue
+        with open(golden_path) as f:
+            diffs = diff_output(json.load(f), normalize_output(parser(page, response)))
+        if len(diffs) > 0:
+            num_different_pages += 1
+            for field, golden_value, value in diffs:
+                print(f'  {page["name"]}: {field} {golden_value!r} != {value!r}')
+
+    start_time = time.perf_counter()
+    for _ in range(num_runs):
+        for page, response in zip(pages, responses):
+            parser(page, response)
+    elapsed = time.perf_counter() - start_time
+    num_parsed = num_runs * len(responses)
+    print(f'  {num_parsed / elapsed:.1f} pages/sec, {elapsed / num_parsed * 1000:.3f} ms/page')
+
+    tracemalloc.start()
+    peaks = []
+    for page, response in zip(pages, responses):
+        tracemalloc.reset_peak()
+        base_size = tracemalloc.get_traced_memory()[0]
+        parser(page, response)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base_size)
+    tracemalloc.stop()
+    print(f'  peak python heap per page: mean {sum(peaks) / len(peaks) / 1024:.1f} KiB, max {max(peaks) / 1024:.1f} KiB')
+
+    field_spec = get_field_spec(kind)
+    if field_spec is not None:
+        field_times = {}
+        for _ in range(num_runs):
+            for response in responses:
+                field_spec.extract(response, field_times)
+        print('  field times (us/page):')
+        for name, seconds in sorted(field_times.items(), key=lambda x: -x[1]):
+            print(f'    {name:<32}{seconds / num_parsed * 1e6:10.1f}')
+
+        all_fields = [field_spec.extract(x) for x in responses]
+        print('  text parser times (us/call):')
+        for name, text_parser in TEXT_PARSER_FIELDS[kind].items():
+            texts = [text for fields in all_fields for text in fields.getall(name)]
+            if len(texts) == 0:
+                continue
+            start_time = time.perf_counter()
+            for _ in range(num_runs):
+                for text in texts:
+                    text_parser(text)
+            elapsed = time.perf_counter() - start_time
+            print(f'    {name:<32}{text_parser.__name__:<20}{elapsed / (num_runs * len(texts)) * 1e6:10.2f}')
+    return num_different_pages
+
+
+def run_benchmark(kinds, num_runs):
+    """
+    :return: True if there are pages and every output equals its golden
+    """
+    manifest = read_manifest()
+    num_pages = 0
+    num_different_pages = 0
+    for kind in kinds:
+        pages = [x for x in manifest if x['kind'] == kind]
+        if len(pages) == 0:
+            print(f'{kind}: no page in {MANIFEST_PATH}')
+            continue
+        print(f'{kind}: {len(pages)} pages x {num_runs} runs')
+        num_pages += len(pages)
+        num_different_pages += benchmark_kind(kind, pages, num_runs)
+    if num_pages == 0:
+        print('No page to benchmark, run -m record first.')
+        return False
+    print(f'{num_different_pages} pages differ from their golden output.')
+    return num_different_pages == 0
+
+
+if __name__ == "__main__":
+    usage = 'main.py -m <run|golden|record> -n <num_runs> --kinds <kind,...> ' \
+            '--raw_page_dir <dir> --store <file|segment> --category <category> --limit <num_pages> ' \
+            '--page_kind <kind> --file <html_file> --url <url>'
+    mode = 'run'
+    num_runs = 10
+    kinds = KINDS
+    raw_page_dir = ''
+    store_type = raw_page_store.FLAT_FILE
+    category = constant.MANSION_CHUKO
+    limit = 50
+    kind = ''
+    file_path = ''
+    url = ''
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hm:n:",
+                                   ["mode=", "runs=", "kinds=", "raw_page_dir=", "store=", "category=", "limit=",
+                                    "page_kind=", "file=", "url="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-m", "--mode"):
+            mode = arg
+        elif opt in ("-n", "--runs"):
+            num_runs = int(arg)
+        elif opt == '--kinds':
+            kinds = arg.split(',')
+        elif opt == '--raw_page_dir':
+            raw_page_dir = arg
+        elif opt == '--store':
+            store_type = arg
+        elif opt == '--category':
+            category = arg
+        elif opt == '--limit':
+            limit = int(arg)
+        elif opt == '--page_kind':
+            kind = arg
+        elif opt == '--file':
+            file_path = arg
+        elif opt == '--url':
+            url = arg
+    assert mode in ('run', 'golden', 'record')
+    assert all(x in KINDS for x in kinds)
+
+    # The parsers log every page they read.
+    logging.basicConfig(level=logging.WARNING)
+
+    if mode == 'record':
+        if file_path != '':
+            assert kind in KINDS and url != ''
+            record_file(kind, file_path, url)
+        elif raw_page_dir != '':
+            record_raw_pages(raw_page_dir, store_type, category, limit)
+        else:
+            print(usage)
+            sys.exit(2)
+    elif mode == 'golden':
+        write_golden()
+    else:
+        sys.exit(0 if run_benchmark(kinds, num_runs) else 1)
@@ -0,0 +1,169 @@
+"""
+Extension that tunes the concurrency and download delay of every downloader slot (host) on its own.
+
+Every AUTOTUNE_INTERVAL seconds each slot is judged on the responses of the last window:
+
+- error rate (download errors, 403/429 and 5xx) above AUTOTUNE_MAX_ERROR_RATE: halve the
+  concurrency and double the delay;
+- average latency above AUTOTUNE_TARGET_LATENCY: one request less;
+- otherwise: one request more and half the delay, up to AUTOTUNE_MAX_CONCURRENCY and down to
+  AUTOTUNE_MIN_DELAY, which defaults to DOWNLOAD_DELAY so that tuning never drops the politeness floor.
+
+The chosen values are logged, kept in the crawl stats and saved per spider/category in
+AUTOTUNE_STATE_PATH, which the next crawl of the same category starts from. It replaces
+AutoThrottle, the two would fight over the slot delay.
+"""
+import json
+import logging
+import os
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+# Statuses that mean the site wants us to slow down, 404 is a normal expired house.
+THROTTLED_STATUSES = {403, 429}
+
+
+class SlotWindow:
+    def __init__(self):
+        self.num_requests = 0
+        self.num_responses = 0
+        self.num_throttled = 0
+        self.num_server_errors = 0
+        self.latency_sum = 0.0
+
+    def get_error_rate(self):
+        num_download_errors = self.num_requests - self.num_responses
+        return (max(num_download_errors, 0) + self.num_throttled + self.num_server_errors) / self.num_requests
+
+    def get_mean_latency(self):
+        return self.latency_sum / self.num_responses if self.num_responses > 0 else 0.0
+
+
+class ConcurrencyAutoTuner:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('AUTOTUNE_ENABLED'):
+            raise NotConfigured
+        if settings.getbool('AUTOTHROTTLE_ENABLED'):
+            logging.warning('AUTOTUNE_ENABLED overrides AUTOTHROTTLE_ENABLED, disable one of them.')
+        self.crawler = crawler
+        self.interval = settings.getfloat('AUTOTUNE_INTERVAL', 30)
+        self.min_concurrency = settings.getint('AUTOTUNE_MIN_CONCURRENCY', 1)
+        self.max_concurrency = settings.getint('AUTOTUNE_MAX_CONCURRENCY', 16)
+        self.min_delay = settings.getfloat('AUTOTUNE_MIN_DELAY', settings.getfloat('DOWNLOAD_DELAY'))
+        self.max_delay = settings.getfloat('AUTOTUNE_MAX_DELAY', 30)
+        self.target_latency = settings.getfloat('AUTOTUNE_TARGET_LATENCY', 2.0)
+        self.max_error_rate = settings.getfloat('AUTOTUNE_MAX_ERROR_RATE', 0.05)
+        self.state_path = settings.get('AUTOTUNE_STATE_PATH', 'output/autotune_state.json')
+        self.state_key = None
+        # slot key -> {'concurrency': n, 'delay': seconds} chosen by the last crawl
+        self.initial_slot_values = {}
+        self.windows = {}
+        self.tuned_slot_keys = set()
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        tuner = cls(crawler)
+        crawler.signals.connect(tuner.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(tuner.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(tuner.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(tuner.response_downloaded, signal=signals.response_downloaded)
+        return tuner
+
+    def read_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def spider_opened(self, spider):
+        self.state_key = f'{spider.name}-{getattr(spider, "category", "")}'
+        self.initial_slot_values = self.read_state().get(self.state_key, {})
+        self.loop = task.LoopingCall(self.tune, spider)
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.save_state()
+
+    def save_state(self):
+        slots = self.crawler.engine.downloader.slots
+        if len(slots) == 0:
+            return
+        state = self.read_state()
+        state[self.state_key] = {key: {'concurrency': slot.concurrency, 'delay': slot.delay}
+                                 for key, slot in slots.items()}
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f, indent=2)
+
+    def get_window(self, request):
+        slot_key = request.meta.get('download_slot')
+        if slot_key is None:
+            return None
+        if slot_key not in self.tuned_slot_keys:
+            self.tuned_slot_keys.add(slot_key)
+            self.apply_initial_values(slot_key)
+        return self.windows.setdefault(slot_key, SlotWindow())
+
+    def apply_initial_values(self, slot_key):
+        slot = self.crawler.engine.downloader.slots.get(slot_key)
+        initial_values = self.initial_slot_values.get(slot_key)
+        if slot is None or initial_values is None:
+            return
+        slot.concurrency = initial_values['concurrency']
+        # The saved delay may come from a crawl with a lower floor.
+        slot.delay = min(self.max_delay, max(self.min_delay, initial_values['delay']))
+        logging.info(f'autotune {self.state_key} {slot_key}: start from concurrency={slot.concurrency}, '
+                     f'delay={slot.delay:.2f}s')
+
+    def request_left_downloader(self, request, spider):
+        window = self.get_window(request)
+        if window is not None:
+            window.num_requests += 1
+
+    def response_downloaded(self, response, request, spider):
+        window = self.get_window(request)
+        if window is None:
+            return
+        window.num_responses += 1
+        window.latency_sum += request.meta.get('download_latency', 0.0)
+        if response.status in THROTTLED_STATUSES:
+            window.num_throttled += 1
+        elif response.status >= 500:
+            window.num_server_errors += 1
+
+    def tune(self, spider):
+        windows = self.windows
+        self.windows = {}
+        slots = self.crawler.engine.downloader.slots
+        for slot_key, window in windows.items():
+            slot = slots.get(slot_key)
+            if slot is None or window.num_requests == 0:
+                continue
+            error_rate = window.get_error_rate()
+            mean_latency = window.get_mean_latency()
+            concurrency, delay = slot.concurrency, slot.delay
+            if error_rate > self.max_error_rate:
+                concurrency = max(self.min_concurrency, concurrency // 2)
+                delay = min(self.max_delay, max(delay * 2, 0.25))
+            elif mean_latency > self.target_latency:
+                concurrency = max(self.min_concurrency, concurrency - 1)
+            else:
+                concurrency = min(self.max_concurrency, concurrency + 1)
+                delay = max(self.min_delay, delay / 2)
+
+            if (concurrency, delay) != (slot.concurrency, slot.delay):
+                logging.info(f'autotune {self.state_key} {slot_key}: concurrency {slot.concurrency}->{concurrency}, '
+                             f'delay {slot.delay:.2f}->{delay:.2f}s ({window.num_requests} requests, '
+                             f'error_rate={error_rate:.3f}, latency={mean_latency:.2f}s)')
+            slot.concurrency = concurrency
+            slot.delay = delay
+            self.crawler.stats.set_value(f'autotune/{slot_key}/concurrency', concurrency, spider=spider)
+            self.crawler.stats.set_value(f'autotune/{slot_key}/delay', delay, spider=spider)
+            self.crawler.stats.max_value(f'autotune/{slot_key}/max_concurrency', concurrency, spider=spider)
+        self.save_state()
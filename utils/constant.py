@@ -76,6 +76,87 @@ TOKYO_OTHER_DISTRICTS = [
 ]
 TOKYO_DISTRICTS = TOKYO_CENTRAL_DISTRICTS + TOKYO_NON_CENTRAL_23_DISTRICTS + TOKYO_OTHER_DISTRICTS
 
+# Municipality codes (JIS X 0402) of TOKYO_DISTRICTS, as in the cond[city] list form data.
+# The 支庁 are not municipalities and have none.
+TOKYO_DISTRICT_CODES = {
+    '千代田区': '13101',
+    '中央区': '13102',
+    '港区': '13103',
+    '新宿区': '13104',
+    '文京区': '13105',
+    '台東区': '13106',
+    '墨田区': '13107',
+    '江東区': '13108',
+    '品川区': '13109',
+    '目黒区': '13110',
+    '大田区': '13111',
+    '世田谷区': '13112',
+    '渋谷区': '13113',
+    '中野区': '13114',
+    '杉並区': '13115',
+    '豊島区': '13116',
+    '北区': '13117',
+    '荒川区': '13118',
+    '板橋区': '13119',
+    '練馬区': '13120',
+    '足立区': '13121',
+    '葛飾区': '13122',
+    '江戸川区': '13123',
+    '八王子市': '13201',
+    '立川市': '13202',
+    '武蔵野市': '13203',
+    '三鷹市': '13204',
+    '青梅市': '13205',
+    '府中市': '13206',
+    '昭島市': '13207',
+    '調布市': '13208',
+    '町田市': '13209',
+    '小金井市': '13210',
+    '小平市': '13211',
+    '日野市': '13212',
+    '東村山市': '13213',
+    '国分寺市': '13214',
+    '国立市': '13215',
+    '福生市': '13218',
+    '狛江市': '13219',
+    '東大和市': '13220',
+    '清瀬市': '13221',
+    '東久留米市': '13222',
+    '武蔵村山市': '13223',
+    '多摩市': '13224',
+    '稲城市': '13225',
+    '羽村市': '13227',
+    'あきる野市': '13228',
+    '西東京市': '13229',
+    '西多摩郡瑞穂町': '13303',
+    '西多摩郡日の出町': '13305',
+    '西多摩郡檜原村': '13307',
+    '西多摩郡奥多摩町': '13308',
+    '大島支庁': None,
+    '大島町': '13361',
+    '利島村': '13362',
+    '新島村': '13363',
+    '神津島村': '13364',
+    '三宅支庁': None,
+    '三宅島三宅村': '13381',
+    '御蔵島村': '13382',
+    '八丈支庁': None,
+    '八丈島八丈町': '13401',
+    '青ヶ島村': '13402',
+    '小笠原支庁': None,
+    '小笠原村': '13421',
+}
+# 13101..13123
+TOKYO_23_WARD_CODES = sorted(TOKYO_DISTRICT_CODES[x] for x in TOKYO_CENTRAL_DISTRICTS + TOKYO_NON_CENTRAL_23_DISTRICTS)
+
 CHINTAI = 'chintai'
 MANSION_CHUKO = 'mansion_chuko'
 OTHER = 'other'
+
+# Crawl priority of a house in house_id_to_crawl.csv, higher is crawled first.
+CRAWL_PRIORITY_NEW = 30
+# Price changed or reopened
+CRAWL_PRIORITY_CHANGED = 20
+# Available but missing from today's house list
+CRAWL_PRIORITY_MISSING = 10
+CRAWL_PRIORITY_REFRESH = 0
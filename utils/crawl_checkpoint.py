@@ -0,0 +1,93 @@
+"""
+Durable crawl state shared by both spiders, so a crawl killed half way resumes where it stopped.
+
+The state of one crawl is an append-only json lines file, one record per line:
+
+    {"op": "queued", "key": ..., "data": ...}      a request the spider scheduled
+    {"op": "completed", "key": ..., "data": ...}   its result is safely stored
+
+Replaying the file gives the queue (queued but not completed) and the completed set back.
+Records are flushed and fsync'ed per call, callers batch them where they can.
+"""
+import json
+import logging
+import os
+import threading
+
+QUEUED = 'queued'
+COMPLETED = 'completed'
+
+
+class CrawlCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        # key -> data, in the order they were queued
+        self.queued = {}
+        self.completed = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        needs_newline = False
+        if os.path.exists(path):
+            needs_newline = self.load()
+        self.checkpoint_file = open(path, 'a')
+        if needs_newline:
+            # Terminate a record torn by the crash so the next one starts on its own line.
+            self.checkpoint_file.write('\n')
+
+    def load(self):
+        """
+        :return: True if the file does not end with a newline
+        """
+        last_line = ''
+        with open(self.path) as f:
+            for line in f:
+                last_line = line
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['op'] == QUEUED:
+                    self.queued[record['key']] = record.get('data')
+                elif record['op'] == COMPLETED:
+                    self.completed[record['key']] = record.get('data')
+        logging.info(f'Crawl checkpoint {self.path} loaded: {len(self.queued)} queued, {len(self.completed)} completed.')
+        return last_line != '' and not last_line.endswith('\n')
+
+    def is_resumed(self):
+        return len(self.queued) > 0 or len(self.completed) > 0
+
+    def is_completed(self, key):
+        return key in self.completed
+
+    def get_pending(self):
+        """
+        :return: {key: data} queued by an earlier run and not completed yet
+        """
+        with self._lock:
+            return {k: v for k, v in self.queued.items() if k not in self.completed}
+
+    def _append(self, op, records):
+        self.checkpoint_file.writelines(json.dumps({'op': op, 'key': key, 'data': data}) + '\n'
+                                        for key, data in records.items())
+        self.checkpoint_file.flush()
+        os.fsync(self.checkpoint_file.fileno())
+
+    def queue_many(self, records):
+        """
+        :param records: {key: data}, keys already queued are skipped
+        """
+        with self._lock:
+            records = {k: v for k, v in records.items() if k not in self.queued}
+            if len(records) == 0:
+                return
+            self.queued.update(records)
+            self._append(QUEUED, records)
+
+    def complete_many(self, records):
+        with self._lock:
+            self.completed.update(records)
+            self._append(COMPLETED, records)
+
+    def close(self):
+        with self._lock:
+            self.checkpoint_file.close()
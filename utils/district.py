@@ -0,0 +1,133 @@
+"""
+Resolve the Tokyo district (区/市/町/村) of an address in one pass.
+
+The district names of constant.TOKYO_DISTRICTS are compiled once into an Aho-Corasick automaton.
+resolve_district() skips a leading prefecture, gives up on addresses of another prefecture
+(`大阪府大阪市中央区` is not 中央区), and keeps the leftmost match, the longest one if several
+start there, so the result is the same whatever the order of the district lists.
+
+    >>> resolve_district('東京都北区赤羽1丁目')
+    District(name='北区', code='13117', area='non_central_23')
+"""
+import collections
+import re
+
+from utils import constant
+
+CENTRAL = 'central'
+NON_CENTRAL_23 = 'non_central_23'
+OTHER = 'other'
+
+District = collections.namedtuple('District', ['name', 'code', 'area'])
+
+# 北海道, 東京都, 京都府, 大阪府 and the 43 ○○県 (神奈川県, 鹿児島県...)
+PREFECTURE_PATTERN = re.compile(r'^\s*(北海道|東京都|京都府|大阪府|[^\s都道府県]{2,3}県)')
+TOKYO = '東京都'
+
+
+class AhoCorasick:
+    def __init__(self, words):
+        # State 0 is the root, goto[state] = {char: next state}
+        self.goto = [{}]
+        self.fail = [0]
+        # Words ending at the state, its own and the ones reached through the fail links
+        self.outputs = [[]]
+        self.max_word_length = 0
+        for word in words:
+            state = 0
+            for char in word:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append(word)
+            self.max_word_length = max(self.max_word_length, len(word))
+
+        # Breadth first, so the fail state of a state is always built before it.
+        queue = collections.deque(self.goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state != 0 and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0) if state != 0 else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def iter_matches(self, text, start=0):
+        """
+        :return: Iterator of (start index, end index, word) of every occurrence, by end index
+        """
+        state = 0
+        for idx in range(start, len(text)):
+            char = text[idx]
+            while state != 0 and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for word in self.outputs[state]:
+                yield idx + 1 - len(word), idx + 1, word
+
+    def find_leftmost_longest(self, text, start=0):
+        """
+        :return: (start index, word) of the leftmost occurrence, the longest one if several start there, or None
+        """
+        best_match = None
+        for match_start, match_end, word in self.iter_matches(text, start):
+            if best_match is not None and match_end - self.max_word_length > best_match[0]:
+                # No word ending from here can start at or before best_match.
+                break
+            if best_match is None or match_start < best_match[0] or \
+                    (match_start == best_match[0] and len(word) > len(best_match[1])):
+                best_match = (match_start, word)
+        return best_match
+
+
+class DistrictResolver:
+    def __init__(self, district_codes=None):
+        """
+        :param district_codes: {district name: code}, constant.TOKYO_DISTRICT_CODES by default
+        """
+        self.district_codes = constant.TOKYO_DISTRICT_CODES if district_codes is None else district_codes
+        self.automaton = AhoCorasick(self.district_codes)
+
+    def resolve(self, address):
+        """
+        :return: The District of a Tokyo address, or None
+        """
+        if not isinstance(address, str):
+            return None
+        start = 0
+        prefecture_match = PREFECTURE_PATTERN.match(address)
+        if prefecture_match is not None:
+            if prefecture_match.group(1) != TOKYO:
+                return None
+            start = prefecture_match.end()
+        match = self.automaton.find_leftmost_longest(address, start)
+        if match is None:
+            return None
+        return get_district(match[1], self.district_codes)
+
+
+def get_district_area(name):
+    if name in constant.TOKYO_CENTRAL_DISTRICTS:
+        return CENTRAL
+    if name in constant.TOKYO_NON_CENTRAL_23_DISTRICTS:
+        return NON_CENTRAL_23
+    return OTHER
+
+
+def get_district(name, district_codes=constant.TOKYO_DISTRICT_CODES):
+    """
+    :return: The District of a district name, e.g. for the district column of the house tables
+    """
+    return District(name, district_codes.get(name), get_district_area(name))
+
+
+DISTRICT_RESOLVER = DistrictResolver()
+
+
+def resolve_district(address):
+    return DISTRICT_RESOLVER.resolve(address)
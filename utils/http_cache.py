@@ -0,0 +1,161 @@
+"""
+Downloader middleware that revalidates pages instead of re-downloading them.
+
+For every request it remembers the ETag/Last-Modified validators and an md5 of the body in a
+small sqlite file, and sends them back as If-None-Match/If-Modified-Since on the next crawl.
+A response is flagged 'unchanged' when the server answers 304 or the body hashes the same
+as last time, so spiders can skip processing it. With REVALIDATION_CACHE_STORE_BODY the body
+is kept too and a 304 is answered with the cached page, which list spiders need to parse.
+
+With REVALIDATION_CACHE_SAVE_ON_COMMIT the validators of a page are not saved when it is
+downloaded but left in request.meta['revalidation_validators'], and only saved once the
+spider sends validators_committed for them, i.e. once what was extracted from the page is
+in the database. A page whose write failed or was cut short by a crash is then downloaded
+and processed again instead of being revalidated as unchanged.
+"""
+import gzip
+import hashlib
+import os
+import sqlite3
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+
+UNCHANGED_FLAG = 'unchanged'
+VALIDATORS_META_KEY = 'revalidation_validators'
+
+# Sent with validators=[request.meta['revalidation_validators'], ...] once those pages are committed
+validators_committed = object()
+
+
+class RevalidationCacheMiddleware:
+    def __init__(self, cache_path, store_body, request_fingerprinter, stats, save_on_commit=False, commit_every=100):
+        self.cache_path = cache_path
+        self.store_body = store_body
+        self.save_on_commit = save_on_commit
+        self.request_fingerprinter = request_fingerprinter
+        self.stats = stats
+        self.commit_every = commit_every
+        self.num_pending_writes = 0
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(cache_path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS validators (
+                request_key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                encoding TEXT,
+                body BLOB
+            )""")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('REVALIDATION_CACHE_ENABLED'):
+            raise NotConfigured
+        middleware = cls(cache_path=crawler.settings.get('REVALIDATION_CACHE_PATH', 'output/revalidation_cache.sqlite'),
+                         store_body=crawler.settings.getbool('REVALIDATION_CACHE_STORE_BODY'),
+                         request_fingerprinter=crawler.request_fingerprinter,
+                         stats=crawler.stats,
+                         save_on_commit=crawler.settings.getbool('REVALIDATION_CACHE_SAVE_ON_COMMIT'))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.validators_committed, signal=validators_committed)
+        return middleware
+
+    def spider_closed(self, spider):
+        self.db.commit()
+        self.db.close()
+
+    def get_request_key(self, request):
+        return self.request_fingerprinter.fingerprint(request).hex()
+
+    def lookup(self, request_key):
+        return self.db.execute('SELECT etag, last_modified, body_hash, encoding, body FROM validators '
+                               'WHERE request_key=?', (request_key,)).fetchone()
+
+    def get_validators(self, request_key, response, body_hash):
+        """
+        :return: The validators row of response, as saved by save()
+        """
+        return (request_key,
+                response.headers.get('ETag', b'').decode('latin-1') or None,
+                response.headers.get('Last-Modified', b'').decode('latin-1') or None,
+                body_hash,
+                getattr(response, 'encoding', None),
+                gzip.compress(response.body) if self.store_body else None)
+
+    def save(self, validators):
+        self.db.execute('REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)', validators)
+        self.num_pending_writes += 1
+        if self.num_pending_writes >= self.commit_every:
+            self.db.commit()
+            self.num_pending_writes = 0
+
+    def validators_committed(self, validators):
+        for x in validators:
+            self.save(x)
+
+    def process_request(self, request, spider):
+        request_key = self.get_request_key(request)
+        request.meta['revalidation_key'] = request_key
+        if request.meta.get('dont_revalidate'):
+            # Downloaded in full, its validators are still saved. The request may be a replace() of a
+            # revalidated one, so drop the validators sent by then.
+            for header in (b'If-None-Match', b'If-Modified-Since'):
+                if header in request.headers:
+                    del request.headers[header]
+            return None
+        cached = self.lookup(request_key)
+        if cached is None:
+            return None
+        etag, last_modified = cached[0], cached[1]
+        if etag is not None and b'If-None-Match' not in request.headers:
+            request.headers['If-None-Match'] = etag
+        if last_modified is not None and b'If-Modified-Since' not in request.headers:
+            request.headers['If-Modified-Since'] = last_modified
+        return None
+
+    def process_response(self, request, response, spider):
+        request_key = request.meta.get('revalidation_key')
+        if request_key is None:
+            return response
+
+        if response.status == 304:
+            cached = self.lookup(request_key)
+            if cached is None:
+                return response
+            self.stats.inc_value('revalidation/not_modified', spider=spider)
+            encoding, body = cached[3], cached[4]
+            if body is not None:
+                # A 304 carries no Content-Type, so rebuild the html response explicitly.
+                return HtmlResponse(url=response.url, status=200, headers=response.headers,
+                                    body=gzip.decompress(body), encoding=encoding or 'utf-8',
+                                    request=request, flags=response.flags + [UNCHANGED_FLAG])
+            return response.replace(flags=response.flags + [UNCHANGED_FLAG])
+
+        if response.status == 200:
+            body_hash = hashlib.md5(response.body).hexdigest()
+            cached = self.lookup(request_key)
+            validators = self.get_validators(request_key, response, body_hash)
+            if self.save_on_commit:
+                request.meta[VALIDATORS_META_KEY] = validators
+            else:
+                self.save(validators)
+            if cached is not None and cached[2] == body_hash:
+                self.stats.inc_value('revalidation/same_body', spider=spider)
+                return response.replace(flags=response.flags + [UNCHANGED_FLAG])
+            self.stats.inc_value('revalidation/changed', spider=spider)
+        return response
+
+
+def is_unchanged(response):
+    return UNCHANGED_FLAG in response.flags
+
+
+def get_pending_validators(response):
+    """
+    :return: The validators of response to send with validators_committed, None if there is nothing to save
+    """
+    return response.meta.get(VALIDATORS_META_KEY)
+
@@ -0,0 +1,220 @@
+"""
+Prometheus metrics of the crawl and of the MySQL hot paths.
+
+Everything is registered on REGISTRY and only recorded once enable() was called, so nothing
+is measured (and no cursor is wrapped) by default:
+
+- MetricsExtension (METRICS_ENABLED setting) enables it for the spiders: download latency,
+  responses per status, pages/sec and queue depths per spider/category. The metrics are served on
+  METRICS_PORT, and/or written to METRICS_TEXTFILE_PATH or pushed to METRICS_PUSHGATEWAY_URL.
+- Batch processes (house_list_processor, house_info_processor) call enable_from_env() and
+  export() at the end, driven by $HOUSPIDER_METRICS_TEXTFILE/$HOUSPIDER_METRICS_PUSHGATEWAY
+  since they do not live long enough to be scraped.
+- MySQL statements run through db.pool sessions or db.utils.get_mysql_cnx() connections are
+  timed per table and statement type by InstrumentedCursor.
+- time_extraction() times the page parsers per page type.
+"""
+from contextlib import nullcontext
+import logging
+import os
+import re
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import push_to_gateway, start_http_server, write_to_textfile
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+REGISTRY = CollectorRegistry()
+
+DOWNLOAD_LATENCY = Histogram('houspider_download_latency_seconds', 'Download latency of a page',
+                             ['spider', 'category'], registry=REGISTRY,
+                             buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64))
+RESPONSES = Counter('houspider_responses_total', 'Responses received', ['spider', 'category', 'status'],
+                    registry=REGISTRY)
+PAGES_PER_SECOND = Gauge('houspider_pages_per_second', 'Pages downloaded per second over the last interval',
+                         ['spider', 'category'], registry=REGISTRY)
+QUEUE_DEPTH = Gauge('houspider_queue_depth', 'Requests or items waiting in a queue',
+                    ['spider', 'category', 'queue'], registry=REGISTRY)
+EXTRACTION_SECONDS = Histogram('houspider_extraction_seconds', 'Time to extract one page', ['page_type'],
+                               registry=REGISTRY,
+                               buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+DB_STATEMENT_SECONDS = Histogram('houspider_db_statement_seconds', 'MySQL statement latency',
+                                 ['table', 'statement'], registry=REGISTRY,
+                                 buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+_enabled = False
+_http_server_ports = set()
+_http_server_lock = threading.Lock()
+
+_STATEMENT_PATTERN = re.compile(r'^\s*(\w+)')
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?: IF (?:NOT )?EXISTS)?)\s+`?(\w+)', re.IGNORECASE)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable_from_env():
+    """
+    Enable the metrics of a batch process if it is asked to export them.
+    """
+    if os.environ.get('HOUSPIDER_METRICS_TEXTFILE') or os.environ.get('HOUSPIDER_METRICS_PUSHGATEWAY'):
+        enable()
+
+
+def export(job, textfile_path=None, pushgateway_url=None):
+    """
+    Write the metrics to a node_exporter textfile and/or push them to a Pushgateway,
+    default to $HOUSPIDER_METRICS_TEXTFILE/$HOUSPIDER_METRICS_PUSHGATEWAY.
+    """
+    if not _enabled:
+        return
+    textfile_path = textfile_path or os.environ.get('HOUSPIDER_METRICS_TEXTFILE')
+    pushgateway_url = pushgateway_url or os.environ.get('HOUSPIDER_METRICS_PUSHGATEWAY')
+    try:
+        if textfile_path:
+            os.makedirs(os.path.dirname(os.path.abspath(textfile_path)), exist_ok=True)
+            write_to_textfile(textfile_path, REGISTRY)
+        if pushgateway_url:
+            push_to_gateway(pushgateway_url, job=job, registry=REGISTRY)
+    except Exception:
+        # Metrics must never fail the crawl.
+        logging.exception(f'Fail to export metrics of {job}')
+
+
+def serve(port):
+    """
+    Serve REGISTRY over http, once per port for all the crawlers of the process.
+    """
+    with _http_server_lock:
+        if port in _http_server_ports:
+            return
+        start_http_server(port, registry=REGISTRY)
+        _http_server_ports.add(port)
+    logging.info(f'Metrics served on :{port}/metrics')
+
+
+def time_extraction(page_type):
+    return EXTRACTION_SECONDS.labels(page_type).time() if _enabled else nullcontext()
+
+
+def get_statement_labels(query):
+    """
+    :return: (table, statement type) of a SQL statement, e.g. ('lifull_house_info', 'INSERT')
+    """
+    statement_match = _STATEMENT_PATTERN.match(query)
+    table_match = _TABLE_PATTERN.search(query)
+    return (table_match.group(1) if table_match is not None else 'unknown',
+            statement_match.group(1).upper() if statement_match is not None else 'unknown')
+
+
+class InstrumentedCursor:
+    """
+    Cursor proxy that times execute/executemany per table and statement type.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, fn, query, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return fn(query, *args, **kwargs)
+        finally:
+            DB_STATEMENT_SECONDS.labels(*get_statement_labels(query)).observe(time.perf_counter() - start_time)
+
+    def execute(self, query, *args, **kwargs):
+        return self._timed(self._cursor.execute, query, *args, **kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        return self._timed(self._cursor.executemany, query, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """
+    Connection proxy whose cursors are InstrumentedCursors.
+    """
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._cnx.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+
+def instrument_cursor(cursor):
+    return InstrumentedCursor(cursor) if _enabled else cursor
+
+
+def instrument_connection(cnx):
+    return InstrumentedConnection(cnx) if _enabled else cnx
+
+
+class MetricsExtension:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        enable()
+        self.crawler = crawler
+        self.interval = settings.getfloat('METRICS_INTERVAL', 15)
+        self.port = settings.getint('METRICS_PORT', 0)
+        self.textfile_path = settings.get('METRICS_TEXTFILE_PATH')
+        self.pushgateway_url = settings.get('METRICS_PUSHGATEWAY_URL')
+        self.labels = None
+        self.num_pages = 0
+        self.num_reported_pages = 0
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        self.labels = (spider.name, getattr(spider, 'category', ''))
+        if self.port > 0:
+            serve(self.port)
+        self.loop = task.LoopingCall(self.report)
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.report()
+
+    def response_received(self, response, request, spider):
+        self.num_pages += 1
+        RESPONSES.labels(*self.labels, str(response.status)).inc()
+        if 'download_latency' in request.meta:
+            DOWNLOAD_LATENCY.labels(*self.labels).observe(request.meta['download_latency'])
+
+    def report(self):
+        PAGES_PER_SECOND.labels(*self.labels).set((self.num_pages - self.num_reported_pages) / self.interval)
+        self.num_reported_pages = self.num_pages
+        engine = self.crawler.engine
+        if engine is not None and engine.slot is not None:
+            QUEUE_DEPTH.labels(*self.labels, 'scheduler').set(len(engine.slot.scheduler))
+            QUEUE_DEPTH.labels(*self.labels, 'downloader').set(len(engine.downloader.active))
+        if self.textfile_path or self.pushgateway_url:
+            export(f'{self.labels[0]}-{self.labels[1]}', self.textfile_path, self.pushgateway_url)
@@ -0,0 +1,207 @@
+"""
+Opt-in profiling of the pipeline stages, written as flamegraph-ready files.
+
+Nothing here runs unless asked for: houspider_runner/main.py --profile profiles every stage, and
+PROFILE_ENABLED profiles a standalone `scrapy crawl` through ProfilingExtension. A profile named
+e.g. `chintai-info_crawl` is written to the profile dir as:
+
+- `chintai-info_crawl.collapsed`: wall-clock stack samples of every thread while the stage ran,
+  one `thread;outer frame;...;inner frame count` line per stack, ready for flamegraph.pl or speedscope;
+- `chintai-info_crawl.samples.txt`: the functions with the most samples, inclusive and self.
+
+Stages running on a pool thread (list processing, emails) are also run under cProfile:
+`chintai-list_process.prof` (pstats dump, e.g. for snakeviz) and `chintai-list_process.pstats.txt`.
+
+The stages of the concurrent categories share the reactor thread, so their samples overlap;
+profile one category (--categories) to tell them apart. Pages extracted in EXTRACT_PROCESSES
+child processes are not sampled.
+"""
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+DEFAULT_INTERVAL = 0.01
+NUM_TOP_FUNCTIONS = 50
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collapse_stack(frame, thread_name):
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """
+    One sampling thread per process, shared by every running StageProfile.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='stack_sampler', daemon=True)
+        self.interval = interval
+        self.profiles = set()
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.add(profile)
+
+    def remove(self, profile):
+        with self.lock:
+            self.profiles.discard(profile)
+
+    def run(self):
+        own_thread_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                profiles = list(self.profiles)
+            if len(profiles) == 0:
+                continue
+            thread_names = {x.ident: x.name for x in threading.enumerate()}
+            stacks = {thread_id: collapse_stack(frame, thread_names.get(thread_id, str(thread_id)))
+                      for thread_id, frame in sys._current_frames().items() if thread_id != own_thread_id}
+            for profile in profiles:
+                profile.add_samples(stacks)
+
+
+def get_sampler(interval=DEFAULT_INTERVAL):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(interval)
+            _sampler.start()
+        return _sampler
+
+
+class StageProfile:
+    def __init__(self, name, profile_dir, interval=DEFAULT_INTERVAL):
+        """
+        :param name: File name prefix of the profile, e.g. chintai-info_crawl
+        :param interval: Seconds between two samples, only the first profile of the process sets it
+        """
+        self.name = name
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.samples_lock = threading.Lock()
+
+    def add_samples(self, stacks):
+        with self.samples_lock:
+            self.samples.update(stacks.values())
+
+    def start(self):
+        get_sampler(self.interval).add(self)
+        return self
+
+    def stop(self):
+        get_sampler(self.interval).remove(self)
+        try:
+            self.write()
+        except OSError:
+            # A profile must never fail the stage it profiled.
+            logging.exception(f'Fail to write the profile of {self.name}')
+
+    def get_path(self, suffix):
+        return os.path.join(self.profile_dir, f'{self.name}{suffix}')
+
+    def write(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with self.samples_lock:
+            samples = self.samples.most_common()
+        with open(self.get_path('.collapsed'), 'w') as f:
+            for stack, count in samples:
+                f.write(f'{stack} {count}\n')
+
+        inclusive_counts = collections.Counter()
+        self_counts = collections.Counter()
+        for stack, count in samples:
+            frames = stack.split(';')[1:]
+            if len(frames) == 0:
+                continue
+            self_counts[frames[-1]] += count
+            for frame_name in set(frames):
+                inclusive_counts[frame_name] += count
+        num_samples = sum(x[1] for x in samples)
+        with open(self.get_path('.samples.txt'), 'w') as f:
+            f.write(f'{num_samples} samples every {self.interval}s over all threads\n')
+            for title, counts in (('inclusive', inclusive_counts), ('self', self_counts)):
+                f.write(f'\n{"samples":>10} {"%":>6}  function ({title})\n')
+                for frame_name, count in counts.most_common(NUM_TOP_FUNCTIONS):
+                    f.write(f'{count:>10} {count / max(num_samples, 1) * 100:>6.1f}  {frame_name}\n')
+        logging.info(f'Profile of {self.name} written to {self.get_path(".collapsed")}: {num_samples} samples.')
+
+
+def profile_call(name, profile_dir, fn, *args, **kwargs):
+    """
+    Run fn in the current thread under cProfile and write `<name>.prof` and `<name>.pstats.txt`.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one cProfile at a time per process, the stage samples are still written.
+        logging.warning(f'Another profiler is active, {name} is not run under cProfile.')
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, f'{name}.prof'))
+            stats_stream = io.StringIO()
+            pstats.Stats(profiler, stream=stats_stream).sort_stats('cumulative').print_stats(NUM_TOP_FUNCTIONS)
+            with open(os.path.join(profile_dir, f'{name}.pstats.txt'), 'w') as f:
+                f.write(stats_stream.getvalue())
+        except OSError:
+            logging.exception(f'Fail to write the cProfile of {name}')
+
+
+class ProfilingExtension:
+    """
+    Sample a standalone crawl from spider_opened to spider_closed into
+    PROFILE_DIR/<crawl_date>/profiles/<spider name>-<category>.collapsed
+    """
+
+    def __init__(self, profile_dir, interval):
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.profile = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PROFILE_ENABLED'):
+            raise NotConfigured
+        extension = cls(crawler.settings.get('PROFILE_DIR', 'output'),
+                        crawler.settings.getfloat('PROFILE_INTERVAL', DEFAULT_INTERVAL))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        profile_dir = os.path.join(self.profile_dir, spider.crawl_date, 'profiles')
+        self.profile = StageProfile(f'{spider.name}-{spider.category}', profile_dir, self.interval).start()
+
+    def spider_closed(self, spider):
+        if self.profile is not None:
+            self.profile.stop()
@@ -0,0 +1,146 @@
+"""
+Typed parsers of the numbers and dates found in the listing pages, with precompiled patterns.
+
+Each parser reads its value in one regex pass instead of joining every digit of the text, which
+glued unrelated numbers together (`100.5m²（30.4坪）`, `1億500万円`, `バス10分 徒歩3分`).
+
+A None text gives None, like the page field it comes from; a text without the value gives `default`.
+"""
+from datetime import date
+import re
+
+_NUMBER = r'\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?'
+
+NUMBER_PATTERN = re.compile(_NUMBER)
+# 1億2,800万円, 1億円, 5,980万円, 5,980 (the 万円 unit is often in its own span), 12.5万円
+PRICE_PATTERN = re.compile(rf'(?:(?P<oku>{_NUMBER})\s*億)?\s*(?P<man>{_NUMBER})?')
+# 8,000円, 1万2,000円, 1.2万円
+YEN_PATTERN = re.compile(rf'(?:(?P<man>{_NUMBER})\s*万\s*(?P<yen_after_man>{_NUMBER})?|(?P<yen>{_NUMBER}))\s*円')
+WALK_MINUTES_PATTERN = re.compile(r'徒歩\s*(\d+)\s*分')
+FLOOR_PATTERN = re.compile(r'(地下|B)?\s*(\d+)\s*階\s*/')
+TOTAL_FLOOR_PATTERN = re.compile(r'/\s*(?:地上)?\s*(\d+)\s*階建')
+YEAR_MONTH_PATTERN = re.compile(r'(\d{4})\s*年\s*(\d{1,2})\s*月')
+BUILDING_AGE_PATTERN = re.compile(r'築\s*(\d+)\s*年')
+
+
+def to_number(number_str):
+    return float(number_str.replace(',', ''))
+
+
+def parse_number(text, default=0):
+    """
+    First number of the text, e.g. `70.12m²（壁芯）` -> 70.12, `1ヶ月` -> 1.0, `5.2%` -> 5.2
+    """
+    if text is None:
+        return None
+    match = NUMBER_PATTERN.search(text)
+    return default if match is None else to_number(match.group())
+
+
+def parse_int(text, default=0):
+    """
+    First integer of the text, e.g. `1,234件` -> 1234, `120戸` -> 120
+    """
+    number = parse_number(text, None)
+    if number is None:
+        return None if text is None else default
+    return int(number)
+
+
+def parse_area(text, default=0):
+    """
+    Area in m² (the 坪 figure that may follow it is ignored), e.g. `70.12m²（21.21坪）` -> 70.12
+    """
+    return parse_number(text, default)
+
+
+def parse_price(text, default=0):
+    """
+    Sale price or rent in 万円, e.g. `1億2,800万円` -> 12800.0, `1億円` -> 10000.0, `12.5万円` -> 12.5
+    """
+    if text is None:
+        return None
+    for match in PRICE_PATTERN.finditer(text):
+        oku, man = match.group('oku'), match.group('man')
+        if oku is not None or man is not None:
+            return (to_number(oku) * 10000 if oku is not None else 0) + (to_number(man) if man is not None else 0)
+    return default
+
+
+def parse_yen(text, default=0):
+    """
+    First amount in 円, e.g. `管理費等 8,000円` -> 8000.0, `1万2,000円/月` -> 12000.0; a bare number is taken as 円
+    """
+    if text is None:
+        return None
+    match = YEN_PATTERN.search(text)
+    return parse_number(text, default) if match is None else _get_yen(match)
+
+
+def parse_yen_total(text, default=0):
+    """
+    Sum of every amount in 円, e.g. `町会費：300円/月、インターネット：1,650円/月` -> 1950.0
+    """
+    if text is None:
+        return None
+    amounts = [_get_yen(x) for x in YEN_PATTERN.finditer(text)]
+    return default if len(amounts) == 0 else sum(amounts)
+
+
+def _get_yen(match):
+    if match.group('man') is not None:
+        yen_after_man = match.group('yen_after_man')
+        return to_number(match.group('man')) * 10000 + (to_number(yen_after_man) if yen_after_man is not None else 0)
+    return to_number(match.group('yen'))
+
+
+def parse_walk_minutes(text, default=None):
+    """
+    Minutes on foot, e.g. `徒歩5分` -> 5, `バス10分 徒歩3分` -> 3
+    """
+    if text is None:
+        return None
+    match = WALK_MINUTES_PATTERN.search(text)
+    return default if match is None else int(match.group(1))
+
+
+def parse_floors(text):
+    """
+    :return: (floor, number of floors above ground), e.g. `3階 / 10階建` -> (3, 10), `地下1階 / 5階建` -> (-1, 5);
+             each is None if it is not in the text
+    """
+    if text is None:
+        return None, None
+    floor_match = FLOOR_PATTERN.search(text)
+    total_floor_match = TOTAL_FLOOR_PATTERN.search(text)
+    floor_num = None
+    if floor_match is not None:
+        floor_num = -int(floor_match.group(2)) if floor_match.group(1) is not None else int(floor_match.group(2))
+    return floor_num, None if total_floor_match is None else int(total_floor_match.group(1))
+
+
+def parse_year_month(text, day=1):
+    """
+    :return: date of the first `YYYY年M月` of the text, e.g. `2005年3月（築18年）` -> date(2005, 3, 1), or None
+    """
+    if text is None:
+        return None
+    match = YEAR_MONTH_PATTERN.search(text)
+    if match is None:
+        return None
+    month = int(match.group(2))
+    if not 1 <= month <= 12:
+        return None
+    return date(int(match.group(1)), month, day)
+
+
+def parse_building_age(text):
+    """
+    :return: Age in years of `築18年`, 0 for `新築`, or None
+    """
+    if text is None:
+        return None
+    match = BUILDING_AGE_PATTERN.search(text)
+    if match is not None:
+        return int(match.group(1))
+    return 0 if '新築' in text else None
@@ -2,22 +2,28 @@ from datetime import datetime, timedelta
 import pytz
 import re
 import logging
-from utils import constant
+from utils import text_parsers
+from utils.district import resolve_district
 
+# Overridden by the LIFULL_BASE_URL setting, e.g. to crawl mock_homes/server.py
+LIFULL_BASE_URL = 'https://www.homes.co.jp'
 
-def get_lifull_mansion_url_from_house_id(house_id):
-    return f'https://www.homes.co.jp/mansion/b-{house_id}/?iskks=1'
+_DIGITS_PATTERN = re.compile(r'\d+')
 
 
-def get_lifull_other_url_from_house_id(house_id):
-    return f'https://www.homes.co.jp/other/b-{house_id}/?iskks=1'
+def get_lifull_mansion_url_from_house_id(house_id, base_url=LIFULL_BASE_URL):
+    return f'{base_url}/mansion/b-{house_id}/?iskks=1'
 
 
-def get_lifull_chintai_url_from_house_id(house_id):
+def get_lifull_other_url_from_house_id(house_id, base_url=LIFULL_BASE_URL):
+    return f'{base_url}/other/b-{house_id}/?iskks=1'
+
+
+def get_lifull_chintai_url_from_house_id(house_id, base_url=LIFULL_BASE_URL):
     if house_id.isnumeric():
-        return f'https://www.homes.co.jp/chintai/b-{house_id}/?iskks=1'
+        return f'{base_url}/chintai/b-{house_id}/?iskks=1'
 
-    return f'https://www.homes.co.jp/chintai/room/{house_id}'
+    return f'{base_url}/chintai/room/{house_id}'
 
 
 def get_date_str_today():
@@ -30,7 +36,7 @@ def get_date_str_yesterday():
 
 def get_int_from_text(item, empty_str_to_none=False):
     if isinstance(item, str):
-        parsed_str = ''.join(re.findall(r'\d+', item))
+        parsed_str = ''.join(_DIGITS_PATTERN.findall(item))
         if parsed_str == '':
             if empty_str_to_none:
                 return None
@@ -41,14 +47,11 @@ def get_int_from_text(item, empty_str_to_none=False):
 
 
 def get_float_from_text(item, empty_str_to_none=False):
+    """
+    First number of the text, see utils/text_parsers.py for prices, areas, floors and dates.
+    """
     if isinstance(item, str):
-        parsed_str = ''.join(re.findall(r'\d*[.\d+]', item))
-        if parsed_str == '':
-            if empty_str_to_none:
-                return None
-            else:
-                return 0
-        return float(parsed_str)
+        return text_parsers.parse_number(item, default=None if empty_str_to_none else 0)
     return None
 
 
@@ -66,8 +69,8 @@ def get_log_level_from_str(log_level_str):
 
 
 def get_district_from_name(name):
-    valid_district = []
-    for district in constant.TOKYO_DISTRICTS:
-        if district in name:
-            valid_district.append(district)
-    return valid_district
+    """
+    :return: [district] of a Tokyo address, or [], see utils/district.py for its code and area
+    """
+    district = resolve_district(name)
+    return [] if district is None else [district.name]